@@ -0,0 +1,181 @@
+# Español: Caché persistente de los análisis de Gemini. Las recomendaciones son deterministas, así
+# que el mismo libro de referencia con las mismas cinco recomendaciones vuelve una y otra vez; cada
+# llamada al modelo tarda segundos y se paga. La caché vive en un fichero SQLite que comparten
+# todos los workers de gunicorn.
+# English: Persistent cache of Gemini analyses. Recommendations are deterministic, so the same
+# reference book with the same five recommendations comes back again and again; every model call
+# takes seconds and is billed. The cache lives in a SQLite file shared by every gunicorn worker.
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from title_index import normalize_title
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS analyses (
+        key TEXT PRIMARY KEY,
+        reference_key TEXT NOT NULL,
+        analyses TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        last_access REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS analyses_reference_key ON analyses (reference_key);
+    CREATE INDEX IF NOT EXISTS analyses_last_access ON analyses (last_access);
+"""
+
+
+# Español: La clave incluye el modelo y la versión del prompt: si cambia cualquiera de los dos,
+# las respuestas antiguas dejan de servir automáticamente. Identifica exactamente lo que entra en el
+# prompt: el libro de referencia por su `book_id` (o por la clave de su título si no lo hay), cada
+# recomendación con id por ese id (su sinopsis se lee de `books`) y las que no lo tienen por su
+# título y un hash de la sinopsis que mandó el cliente.
+# English: The key includes the model and the prompt version: if either changes, old answers
+# automatically stop being served. It identifies exactly what goes into the prompt: the reference
+# book by its `book_id` (or its title's key if there's none), each recommendation with an id by that
+# id (its synopsis is read from `books`) and those without one by their title and a hash of the
+# synopsis the client sent.
+def analysis_key(reference_title, recommendations, model_name, prompt_version, book_id=None):
+    def recommendation_key(rec):
+        if rec.get("id") is not None:
+            return ["id", int(rec["id"])]
+        synopsis = hashlib.sha256(str(rec.get("synopsis")).encode("utf-8")).hexdigest()
+        return ["titolo", normalize_title(rec.get("titolo")), synopsis]
+
+    payload = json.dumps({
+        "reference": ["id", book_id] if book_id is not None else ["titolo", normalize_title(reference_title)],
+        "recommendations": [recommendation_key(rec) for rec in recommendations],
+        "model": model_name,
+        "prompt_version": prompt_version,
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+    # Español: `touch_interval` es cada cuánto, como mucho, un acierto actualiza `last_access`: la
+    # expulsión LRU no necesita más precisión y así casi ningún acierto escribe en el fichero.
+    # English: `touch_interval` is how often, at most, a hit updates `last_access`: LRU eviction
+    # doesn't need more precision and this way almost no hit writes to the file.
+    def __init__(self, path, ttl_seconds=7 * 24 * 3600, max_entries=10000, touch_interval=60.0):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    # Español: Una conexión por operación: SQLite las abre en microsegundos y así no compartimos
+    # conexiones entre hilos. WAL permite leer mientras otro worker escribe.
+    # English: One connection per operation: SQLite opens them in microseconds and this way we
+    # never share connections between threads. WAL allows reads while another worker writes.
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=5.0)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def get(self, key):
+        now = time.time()
+        db = self._connect()
+        try:
+            with db:
+                row = db.execute("SELECT analyses, created_at, last_access FROM analyses WHERE key = ?",
+                                 (key,)).fetchone()
+                if row is None:
+                    return None
+                if now - row[1] > self.ttl_seconds:
+                    db.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                    return None
+                # Español: Un SELECT no toma el cerrojo de escritura de SQLite; el UPDATE sí.
+                # English: A SELECT doesn't take SQLite's write lock; the UPDATE does.
+                if now - row[2] >= self.touch_interval:
+                    db.execute("UPDATE analyses SET last_access = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+        finally:
+            db.close()
+
+    def put(self, key, reference_title, analyses):
+        now = time.time()
+        db = self._connect()
+        try:
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO analyses (key, reference_key, analyses, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, normalize_title(reference_title), json.dumps(analyses, ensure_ascii=False), now, now))
+                self._evict(db, now)
+        finally:
+            db.close()
+
+    # Español: Primero borramos lo caducado; si aún sobran entradas, las menos usadas recientemente.
+    # English: First we delete what has expired; if there are still too many entries, the least recently used.
+    def _evict(self, db, now):
+        db.execute("DELETE FROM analyses WHERE created_at < ?", (now - self.ttl_seconds,))
+        excess = db.execute("SELECT COUNT(*) FROM analyses").fetchone()[0] - self.max_entries
+        if excess > 0:
+            db.execute(
+                "DELETE FROM analyses WHERE key IN (SELECT key FROM analyses ORDER BY last_access LIMIT ?)",
+                (excess,))
+
+    # Español: Invalida las entradas de un libro de referencia, o todas si no se indica ninguno.
+    # English: Invalidates the entries of one reference book, or all of them if none is given.
+    def invalidate(self, reference_title=None):
+        db = self._connect()
+        try:
+            with db:
+                if reference_title is None:
+                    cursor = db.execute("DELETE FROM analyses")
+                else:
+                    cursor = db.execute("DELETE FROM analyses WHERE reference_key = ?",
+                                        (normalize_title(reference_title),))
+            return cursor.rowcount
+        finally:
+            db.close()
+
+    def stats(self):
+        db = self._connect()
+        try:
+            entries = db.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+        finally:
+            db.close()
+        return {"entries": entries, "max_entries": self.max_entries, "ttl_seconds": self.ttl_seconds}
+
+
+_cache = None
+
+
+def analysis_cache_enabled():
+    return os.getenv("ANALYSIS_CACHE", "on").strip().lower() not in ("off", "0", "false")
+
+
+def get_analysis_cache():
+    global _cache
+    if _cache is None:
+        _cache = AnalysisCache(
+            os.getenv("ANALYSIS_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "analysis_cache.sqlite3")),
+            ttl_seconds=float(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+            max_entries=int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "10000")),
+            touch_interval=float(os.getenv("ANALYSIS_CACHE_TOUCH_SECONDS", "60")),
+        )
+    return _cache
+
+
+# Español: Uso: python analysis_cache.py clear [--titolo "Titolo"] | python analysis_cache.py stats
+# English: Usage: python analysis_cache.py clear [--titolo "Titolo"] | python analysis_cache.py stats
+if __name__ == "__main__":
+    import argparse
+
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Administra la caché de análisis de Gemini.")
+    parser.add_argument("command", choices=["clear", "stats"])
+    parser.add_argument("--titolo", default=None, help="Solo las entradas de este libro de referencia.")
+    args = parser.parse_args()
+
+    load_dotenv()
+    cache = get_analysis_cache()
+    if args.command == "clear":
+        print(f"{cache.invalidate(args.titolo)} entradas eliminadas.")
+    else:
+        print(json.dumps(cache.stats(), indent=2))
@@ -0,0 +1,141 @@
+# Español: Gestión del índice ANN (vecinos aproximados) de pgvector sobre books.embedding. La
+# consulta `ORDER BY embedding <=> %s` de /api/recomend depende de él; aquí lo creamos o
+# reconstruimos tras la carga y fijamos por sesión los parámetros de búsqueda.
+# English: Management of the pgvector ANN (approximate nearest neighbour) index on
+# books.embedding. /api/recomend's `ORDER BY embedding <=> %s` query depends on it; here we
+# create or rebuild it after loading and set the search parameters per session.
+import os
+import time
+
+INDEX_NAME = "books_embedding_ann"
+
+
+# Español: Configuración del índice leída del entorno. ANN_INDEX puede ser hnsw, ivfflat o none.
+# ANN_STORAGE=halfvec indexa los embeddings convertidos a float16 (la mitad de memoria); las
+# consultas eligen candidatos en ese índice y los reordenan con el vector float32 de la tabla.
+# English: Index configuration read from the environment. ANN_INDEX may be hnsw, ivfflat or none.
+# ANN_STORAGE=halfvec indexes the embeddings cast to float16 (half the memory); queries pick
+# candidates from that index and reorder them with the table's float32 vector.
+def index_settings_from_env():
+    return {
+        "method": os.getenv("ANN_INDEX", "hnsw").strip().lower(),
+        "m": int(os.getenv("HNSW_M", "16")),
+        "ef_construction": int(os.getenv("HNSW_EF_CONSTRUCTION", "64")),
+        "lists": int(os.getenv("IVFFLAT_LISTS", "0")) or None,
+        "storage": os.getenv("ANN_STORAGE", "vector").strip().lower(),
+        "dimension": int(os.getenv("EMBEDDING_DIMENSION", "384")),
+    }
+
+
+def halfvec_storage_enabled():
+    return os.getenv("ANN_STORAGE", "vector").strip().lower() == "halfvec"
+
+
+# Español: La recomendación de pgvector para IVFFlat: filas/1000 hasta 1M filas, raíz cuadrada después.
+# English: pgvector's recommendation for IVFFlat: rows/1000 up to 1M rows, square root beyond.
+def default_lists(rows):
+    if rows <= 1_000_000:
+        return max(1, rows // 1000)
+    return int(rows ** 0.5)
+
+
+def index_ddl(method, table="books", index_name=INDEX_NAME, column="embedding",
+              m=16, ef_construction=64, lists=None, rows=0, if_not_exists=False,
+              storage="vector", dimension=384):
+    exists = "IF NOT EXISTS " if if_not_exists else ""
+    if storage == "halfvec":
+        target = f"(({column})::halfvec({int(dimension)})) halfvec_cosine_ops"
+    elif storage == "vector":
+        target = f"{column} vector_cosine_ops"
+    else:
+        raise ValueError(f"Almacenamiento ANN desconocido: '{storage}'.")
+    if method == "hnsw":
+        return (f"CREATE INDEX {exists}{index_name} ON {table} USING hnsw ({target}) "
+                f"WITH (m = {int(m)}, ef_construction = {int(ef_construction)})")
+    if method == "ivfflat":
+        lists = lists or default_lists(rows)
+        return (f"CREATE INDEX {exists}{index_name} ON {table} USING ivfflat ({target}) "
+                f"WITH (lists = {int(lists)})")
+    raise ValueError(f"Tipo de índice ANN desconocido: '{method}'.")
+
+
+# Español: La consulta de vecinos en dos pasos para ANN_STORAGE=halfvec: `candidates` candidatos
+# por el índice float16 y, de ellos, los k mejores según el vector float32. Parámetros, en orden:
+# id excluido (o None), vector, candidatos, vector, k. hnsw.ef_search debe ser >= candidates.
+# English: The two-step neighbours query for ANN_STORAGE=halfvec: `candidates` candidates from the
+# float16 index and, among them, the best k by the float32 vector. Parameters, in order: excluded
+# id (or None), vector, candidates, vector, k. hnsw.ef_search must be >= candidates.
+def rescoring_query(dimension=384, table="books", column="embedding"):
+    return f"""
+        SELECT id, titolo, autore, synopsis, collocazione, anno
+        FROM (
+            SELECT id, titolo, autore, synopsis, collocazione, anno, {column}
+            FROM {table}
+            WHERE id IS DISTINCT FROM %s
+            ORDER BY ({column})::halfvec({int(dimension)}) <=> (%s::vector)::halfvec({int(dimension)})
+            LIMIT %s
+        ) candidates
+        ORDER BY {column} <=> %s::vector
+        LIMIT %s
+    """
+
+
+# Español: En las recargas completas se borra antes de cargar: insertar en un índice HNSW fila a
+# fila es mucho más lento que construirlo una vez al final.
+# English: On full reloads it is dropped before loading: inserting into an HNSW index row by row
+# is much slower than building it once at the end.
+def drop_ann_index(cur, index_name=INDEX_NAME):
+    cur.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+
+# Español: Borra y vuelve a crear el índice. `rebuild=False` solo lo crea si falta (modo
+# incremental: HNSW se mantiene solo con los INSERT/UPDATE). Devuelve los segundos que tardó.
+# English: Drops and recreates the index. `rebuild=False` only creates it if missing (incremental
+# mode: HNSW maintains itself on INSERT/UPDATE). Returns how many seconds it took.
+def ensure_ann_index(cur, settings=None, rebuild=True, table="books", index_name=INDEX_NAME):
+    settings = settings or index_settings_from_env()
+    method = settings["method"]
+    start = time.perf_counter()
+    if rebuild or method == "none":
+        drop_ann_index(cur, index_name)
+    if method == "none":
+        return 0.0
+    maintenance_work_mem = os.getenv("ANN_MAINTENANCE_WORK_MEM")
+    if maintenance_work_mem:
+        cur.execute("SET LOCAL maintenance_work_mem = %s", (maintenance_work_mem,))
+    rows = 0
+    if method == "ivfflat" and not settings.get("lists"):
+        cur.execute(f"SELECT COUNT(*) FROM {table}")
+        rows = cur.fetchone()[0]
+    cur.execute(index_ddl(method, table=table, index_name=index_name, m=settings["m"],
+                          ef_construction=settings["ef_construction"], lists=settings.get("lists"),
+                          rows=rows, if_not_exists=not rebuild, storage=settings.get("storage", "vector"),
+                          dimension=settings.get("dimension", 384)))
+    return time.perf_counter() - start
+
+
+# Español: Parámetros de búsqueda por sesión: hnsw.ef_search (calidad de HNSW) e ivfflat.probes
+# (listas visitadas en IVFFlat). Solo se fijan si están en el entorno.
+# English: Per-session search parameters: hnsw.ef_search (HNSW quality) and ivfflat.probes (lists
+# visited by IVFFlat). They are only set when present in the environment.
+def search_settings_from_env():
+    settings = {}
+    if os.getenv("ANN_EF_SEARCH"):
+        settings["hnsw.ef_search"] = int(os.getenv("ANN_EF_SEARCH"))
+    if os.getenv("ANN_PROBES"):
+        settings["ivfflat.probes"] = int(os.getenv("ANN_PROBES"))
+    return settings
+
+
+# Español: Se aplica a cada conexión nueva del pool. Hacemos commit porque un SET dentro de una
+# transacción que luego se revierte (el pool hace rollback al devolverla) también se revertiría.
+# English: Applied to every new pool connection. We commit because a SET inside a transaction that
+# is later rolled back (the pool rolls back on return) would be rolled back too.
+def apply_search_settings(conn, settings=None):
+    settings = search_settings_from_env() if settings is None else settings
+    if not settings:
+        return
+    with conn.cursor() as cur:
+        for name, value in settings.items():
+            cur.execute(f"SET {name} = {int(value)}")
+    conn.commit()
@@ -1,16 +1,39 @@
-# Español: Empezamos importando todas las herramientas necesarias para nuestra aplicación.
-# English: We start by importing all the necessary tools for our application.
+# Español: Empezamos importando todas las herramientas necesarias para nuestra aplicación. Medimos
+# cuánto tarda la importación entera (ver sdk_loader.py).
+# English: We start by importing all the necessary tools for our application. We time how long the
+# whole import takes (see sdk_loader.py).
+import time
+APP_IMPORT_START = time.perf_counter()
 import re
-from flask import Flask, request, jsonify
+import json
+import numpy as np
+from contextlib import nullcontext
+from flask import Flask, Response, g, has_request_context, request, jsonify
 from flask_cors import CORS
 import psycopg2
 import psycopg2.extras
 from dotenv import load_dotenv
 import os
-import google.generativeai as genai
-import firebase_admin
-from firebase_admin import credentials, auth
 from functools import wraps
+from db_pool import get_pool
+from vector_engine import get_vector_engine, normalize_rows, parse_vector, vector_engine_enabled
+from title_index import (get_title_index, normalize_title, resolve_title_query, title_index_enabled,
+                         title_lookup_params, title_options)
+from token_cache import ensure_public_keys_warm, get_token_cache
+from analysis_cache import analysis_cache_enabled, analysis_key, get_analysis_cache
+from streaming import DelimitedStreamParser, sse_event
+from neighbors import fetch_neighbors, neighbors_table_enabled
+from ann_index import halfvec_storage_enabled, rescoring_query
+from filters import BookFilter, batch_neighbors, filtered_neighbors, vector_neighbors
+from singleflight import get_singleflight, singleflight_enabled
+from query_encoder import ensure_query_encoder_warm, get_query_encoder, semantic_search_enabled
+from bulk_load import format_vectors
+from sdk_loader import (ensure_sdks_warm, get_firebase_auth, get_gemini_model, lazy_sdk_enabled, log_startup,
+                        record_startup, startup_stage, startup_stats)
+from deep_dive_prompt import (DEEP_DIVE_PROMPT_VERSION, GEMINI_MODEL_NAME, build_deep_dive_prompt,
+                              prompt_recommendations, recommendation_ids)
+from metrics import (DEEP_DIVE_MISMATCHES, REGISTRY, REQUEST_ERRORS, REQUEST_SECONDS, STAGE_SECONDS,
+                     RequestTimings)
 
 # Español: Aquí nace nuestra aplicación Flask, el corazón de nuestro backend.
 # English: Here our Flask application is born, the heart of our backend.
@@ -22,7 +45,7 @@ CORS(app, origins=[
     "http://localhost:4200",
     "https://book-recommender-rosy.vercel.app",
     re.compile(r"^https://book-recommender-.*-celes-projects-b4460b91\.vercel\.app$")
-], supports_credentials=True)
+], supports_credentials=True, expose_headers=["Server-Timing", "X-Book-Id"])
 
 # Español: Cargamos las variables de entorno, nuestros pequeños secretos de configuración.
 # English: We load the environment variables, our little configuration secrets.
@@ -31,30 +54,100 @@ load_dotenv()
 # --- Inicialización de Firebase ---
 # --- Firebase Initialization ---
 
-# Español: Buscamos las credenciales de Firebase. Son la llave maestra para los servicios de Google.
-# English: We look for the Firebase credentials. They are the master key to Google's services.
-cred_path = os.getenv("FIREBASE_CREDENTIALS_PATH")
-if not cred_path:
-    cred_path = os.path.join(os.path.dirname(__file__), "firebase_credentials.json")
-
-try:
-    # Español: Con las credenciales en mano, nos identificamos ante Firebase.
-    # English: With the credentials in hand, we identify ourselves to Firebase.
-    cred = credentials.Certificate(cred_path)
-    firebase_admin.initialize_app(cred)
-    print("Firebase Admin SDK initialized successfully.")
-except Exception as e:
-    # Español: Si algo sale mal, lo sabremos y detendremos todo para no causar problemas.
-    # English: If something goes wrong, we'll know and stop everything to avoid causing problems.
-    print(f"Error initializing Firebase Admin SDK: {e}")
-    exit(1)
+# Español: Con las credenciales de FIREBASE_CREDENTIALS_PATH (o firebase_credentials.json), nos
+# identificamos ante Firebase. Con SDK_INIT=lazy esto se aplaza hasta el primer uso.
+# English: With the credentials from FIREBASE_CREDENTIALS_PATH (or firebase_credentials.json), we
+# identify ourselves to Firebase. With SDK_INIT=lazy this is deferred until first use.
+if not lazy_sdk_enabled():
+    try:
+        get_firebase_auth()
+    except Exception as e:
+        # Español: Si algo sale mal, lo sabremos y detendremos todo para no causar problemas.
+        # English: If something goes wrong, we'll know and stop everything to avoid causing problems.
+        print(f"Error initializing Firebase Admin SDK: {e}")
+        exit(1)
 
 # Español: Creamos nuestra lista de invitados VIP. Solo los emails en esta lista podrán usar la API.
 # English: We create our VIP guest list. Only emails on this list will be able to use the API.
-AUTHORIZED_EMAILS = os.getenv("AUTHORIZED_EMAILS", "").split(',')
-if not AUTHORIZED_EMAILS or AUTHORIZED_EMAILS == [""]:
+# Español: Es un conjunto normalizado (sin espacios, en minúsculas), así cada comprobación es inmediata.
+# English: It's a normalized set (no whitespace, lowercase), so each check is instant.
+AUTHORIZED_EMAILS = {
+    email.strip().lower() for email in os.getenv("AUTHORIZED_EMAILS", "").split(',') if email.strip()
+}
+if not AUTHORIZED_EMAILS:
     print("WARNING: AUTHORIZED_EMAILS is not set or is empty. No users will be authorized.")
-    AUTHORIZED_EMAILS = []
+
+# Español: Los administradores, aparte (ADMIN_EMAILS): solo ellos pueden usar las rutas /api/admin.
+# Si la lista está vacía, nadie puede; la caché de análisis se sigue pudiendo vaciar desde el
+# servidor con `python analysis_cache.py clear`.
+# English: The administrators, separately (ADMIN_EMAILS): only they can use the /api/admin routes.
+# If the list is empty, nobody can; the analysis cache can still be cleared from the server with
+# `python analysis_cache.py clear`.
+ADMIN_EMAILS = {
+    email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(',') if email.strip()
+}
+
+# --- Instrumentación ---
+# --- Instrumentation ---
+
+# Español: Cada petición mide sus etapas (auth, firebase_verify, db_connect, title_lookup,
+# vector_query, gemini). Al terminar, el desglose sale en la cabecera Server-Timing, en una línea
+# de log JSON (REQUEST_TIMING_LOG=off para apagarla) y en los histogramas de /metrics.
+# English: Every request times its stages (auth, firebase_verify, db_connect, title_lookup,
+# vector_query, gemini). When it finishes, the breakdown goes out in the Server-Timing header, in
+# a JSON log line (REQUEST_TIMING_LOG=off to turn it off) and in /metrics' histograms.
+REQUEST_TIMING_LOG = os.getenv("REQUEST_TIMING_LOG", "on").strip().lower() not in ("off", "0", "false")
+
+def timed(stage):
+    timings = g.get('timings') if has_request_context() else None
+    return timings.stage(stage) if timings is not None else nullcontext()
+
+# Español: Guardamos el tipo de la excepción para que los errores no sean solo un texto en `details`.
+# English: We keep the exception type so errors aren't just a string in `details`.
+def note_error(e):
+    if has_request_context():
+        g.error_type = type(e).__name__
+
+def current_route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+@app.before_request
+def start_request_timer():
+    g.timings = RequestTimings()
+
+# Español: El codificador de /api/search (y los SDK con SDK_INIT=lazy) se cargan en segundo plano
+# con la primera petición del worker.
+# English: /api/search's encoder (and the SDKs with SDK_INIT=lazy) are loaded in the background
+# with the worker's first request.
+@app.before_request
+def warm_background_loaders():
+    ensure_query_encoder_warm()
+    ensure_sdks_warm()
+
+@app.after_request
+def record_request_timings(response):
+    timings = g.get('timings')
+    if timings is None:
+        return response
+    route = current_route()
+    total = timings.total()
+    REQUEST_SECONDS.observe(total, route=route, method=request.method, status=response.status_code)
+    for stage, seconds in timings.stages.items():
+        STAGE_SECONDS.observe(seconds, route=route, stage=stage)
+    if response.status_code >= 400:
+        REQUEST_ERRORS.inc(route=route, status=response.status_code, error=g.get('error_type', ''))
+    response.headers['Server-Timing'] = timings.server_timing(total)
+    if REQUEST_TIMING_LOG and route != '/metrics':
+        print(json.dumps({
+            "event": "request",
+            "route": route,
+            "method": request.method,
+            "status": response.status_code,
+            "error": g.get('error_type'),
+            "total_ms": round(total * 1000, 2),
+            "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in timings.stages.items()},
+        }), flush=True)
+    return response
 
 # --- Decorador de Autenticación ---
 # --- Authentication Decorator ---
@@ -71,11 +164,22 @@ def firebase_auth_required(f):
             return jsonify({"error": "Authorization header missing."}), 401
 
         try:
-            # Español: Verificamos que la identificación sea válida y no una falsificación.
-            # English: We verify that the identification is valid and not a fake.
-            id_token = auth_header.split(' ')[1]
-            decoded_token = auth.verify_id_token(id_token)
-            user_email = decoded_token.get('email')
+            # Español: Verificamos que la identificación sea válida y no una falsificación. Si ya
+            # la verificamos antes y no ha caducado, la caché nos ahorra repetir el trabajo.
+            # English: We verify that the identification is valid and not a fake. If we already
+            # verified it and it hasn't expired, the cache saves us from repeating the work.
+            with timed('auth'):
+                id_token = auth_header.split(' ')[1]
+                token_cache = get_token_cache()
+                decoded_token = token_cache.get(id_token)
+                if decoded_token is None:
+                    with timed('firebase_verify'):
+                        decoded_token = get_firebase_auth().verify_id_token(id_token)
+                    token_cache.put(id_token, decoded_token)
+                # Español: Aquí la app de Firebase ya está inicializada (también con SDK_INIT=lazy).
+                # English: By now the Firebase app is initialized (with SDK_INIT=lazy too).
+                ensure_public_keys_warm()
+            user_email = (decoded_token.get('email') or '').strip().lower()
 
             # Español: Comprobamos si el email del usuario está en nuestra lista VIP.
             # English: We check if the user's email is on our VIP list.
@@ -87,187 +191,745 @@ def firebase_auth_required(f):
             else:
                 # Español: Acceso denegado. Este email no está en la lista.
                 # English: Access denied. This email is not on the list.
-                return jsonify({"error": "Unauthorized: Email not in whitelist."}, 403)
+                return jsonify({"error": "Unauthorized: Email not in whitelist."}), 403
         except Exception as e:
             # Español: La identificación parece ser inválida o ha expirado.
             # English: The identification seems to be invalid or has expired.
+            note_error(e)
             return jsonify({"error": f"Authentication failed: {e}"}), 401
     return decorated_function
 
+# Español: Va después de firebase_auth_required: el usuario ya está verificado y en la lista VIP,
+# y además tiene que estar en ADMIN_EMAILS.
+# English: Goes after firebase_auth_required: the user is already verified and on the VIP list,
+# and must also be in ADMIN_EMAILS.
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        user_email = (request.current_user.get('email') or '').strip().lower()
+        if user_email not in ADMIN_EMAILS:
+            return jsonify({"error": "Forbidden: Email not in admin list."}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 # --- Configuración de la Base de Datos ---
 # --- Database Configuration ---
 
-# Español: Esta función crea un túnel seguro hacia nuestra base de datos PostgreSQL.
-# English: This function creates a secure tunnel to our PostgreSQL database.
+# Español: En vez de abrir un túnel nuevo hacia PostgreSQL en cada petición, cada worker
+# mantiene un pool de conexiones reutilizables (ver db_pool.py). Tamaño y comprobaciones se
+# configuran con DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT y DB_POOL_CHECK_INTERVAL.
+# English: Instead of opening a new tunnel to PostgreSQL on every request, each worker keeps
+# a pool of reusable connections (see db_pool.py). Size and checks are configured with
+# DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT and DB_POOL_CHECK_INTERVAL.
 def get_db_connection():
     try:
-        database_url = os.getenv("DATABASE_URL")
-        if not database_url:
-            raise ValueError("La variable de entorno DATABASE_URL no está configurada.")
-        
-        conn = psycopg2.connect(database_url)
-        return conn
+        with timed('db_connect'):
+            return get_pool().getconn()
     except psycopg2.OperationalError as e:
         print(f"Error al conectar con la base de datos: {e}")
         raise
 
-# Español: Despertamos a nuestro crítico literario de IA, Gemini, dándole su clave de API.
-# English: We awaken our AI literary critic, Gemini, by giving it its API key.
-gemini_api_key = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=gemini_api_key)
+# Español: Devolvemos la conexión al pool. Si quedó rota (por ejemplo tras un failover), el pool la descarta.
+# English: We hand the connection back to the pool. If it broke (e.g. after a failover), the pool discards it.
+def release_db_connection(conn):
+    get_pool().putconn(conn)
+
+# Español: Con VECTOR_ENGINE=memory cargamos los embeddings al arrancar el worker, para que la
+# primera petición no pague la carga. Si falla, se reintentará en la primera recomendación.
+# English: With VECTOR_ENGINE=memory we load the embeddings when the worker starts, so the
+# first request doesn't pay for it. If it fails, it will be retried on the first recommendation.
+if vector_engine_enabled():
+    warmup_conn = None
+    try:
+        with startup_stage("vector_engine_load"):
+            warmup_conn = get_db_connection()
+            get_vector_engine().maybe_refresh(warmup_conn)
+    except Exception as e:
+        print(f"No se pudo precargar el motor vectorial: {e}")
+    finally:
+        if warmup_conn is not None:
+            release_db_connection(warmup_conn)
+
+# Español: Despertamos a nuestro crítico literario de IA, Gemini, con su clave de API (GEMINI_API_KEY)
+# y sus instrucciones: es un experto y debe hablar siempre en italiano. Con SDK_INIT=lazy, al primer uso.
+# English: We awaken our AI literary critic, Gemini, with its API key (GEMINI_API_KEY) and its
+# instructions: it's an expert and must always speak Italian. With SDK_INIT=lazy, on first use.
+if not lazy_sdk_enabled():
+    get_gemini_model()
 
-# Español: Le damos a Gemini sus instrucciones: es un experto y debe hablar siempre en italiano.
-# English: We give Gemini its instructions: it's an expert and must always speak Italian.
-model = genai.GenerativeModel(
-    'gemini-1.5-flash-latest',
-    system_instruction="Sei un critico letterario esperto. Rispondi sempre e solo in italiano.")
+# Español: Dimensión de los embeddings y candidatos que se reordenan con ANN_STORAGE=halfvec.
+# English: Embedding dimension and candidates reordered with ANN_STORAGE=halfvec.
+EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION", "384"))
+ANN_RESCORE_CANDIDATES = int(os.getenv("ANN_RESCORE_CANDIDATES", "40"))
 
 # --- Rutas de la API ---
 # --- API Routes ---
 
+# Español: Consulta de resolución de títulos con los marcadores de psycopg2 (ver title_index.py).
+# English: Title resolution query with psycopg2's placeholders (see title_index.py).
+RESOLVE_TITLE_SQL = resolve_title_query("%(key)s", "%(pattern)s")
+
+# Español: La búsqueda de /api/recomend: del título (o directamente del id) a los 5 vecinos. Devuelve
+# (cuerpo, estado, id del libro) para que varias peticiones idénticas puedan compartir el mismo resultado.
+# English: /api/recomend's search: from the title (or straight from the id) to the 5 neighbours.
+# Returns (body, status, book id) so several identical requests can share the same result.
+def find_recommendations(title, book_filter, book_id=None):
+    # Español: Abrimos la conexión con la base de datos para buscar el libro.
+    # English: We open the connection to the database to search for the book.
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+
+        # Español: Buscamos libros que coincidan con el título que nos dieron, por su clave
+        # normalizada. Con un 'book_id' no hace falta: el cliente ya eligió el libro.
+        # English: We search for books that match the title we were given, by its normalized key.
+        # With a 'book_id' there's no need: the client already chose the book.
+        if book_id is None:
+            key, pattern = title_lookup_params(title)
+            with timed('title_lookup'):
+                cur.execute(RESOLVE_TITLE_SQL, {"key": key, "pattern": pattern})
+                matching_books = cur.fetchall()
+
+            if not matching_books:
+                return {"error": f"Nessun libro trovato che corrisponda a '{title}'."}, 404, None
+
+            # Español: Si hay muchos resultados, le pedimos al usuario que sea más específico.
+            # English: If there are too many results, we ask the user to be more specific.
+            if len(matching_books) > 1:
+                return title_options(matching_books), 200, None
+
+            book_id = matching_books[0]['id']
+
+        # Español: Todo el cálculo de vecinos (motor, tabla precalculada o pgvector) cuenta como vector_query.
+        # English: The whole neighbour computation (engine, precomputed table or pgvector) counts as vector_query.
+        with timed('vector_query'):
+            # Español: Si el motor en memoria está activo, calculamos los 5 vecinos sin volver a la base de datos.
+            # English: If the in-memory engine is enabled, we compute the 5 neighbours without going back to the database.
+            results = None
+            if vector_engine_enabled():
+                engine = get_vector_engine()
+                engine.maybe_refresh(conn)
+                results = engine.recommend(book_id, k=5, book_filter=book_filter)
+                if results is not None:
+                    for book in results:
+                        book.pop('score', None)
+
+            # Español: Si no, leemos los vecinos que populate_db.py dejó precalculados.
+            # English: Otherwise, we read the neighbours that populate_db.py left precomputed.
+            # Español: La tabla solo guarda los vecinos sin filtrar, así que con filtros no sirve.
+            # English: The table only stores unfiltered neighbours, so it's no use with filters.
+            if results is None and book_filter is None and neighbors_table_enabled():
+                results = fetch_neighbors(conn, book_id, k=5)
+
+            if results is None:
+                # Español: El "vector embedding" del libro (su ADN literario) solo se lee aquí, ya con
+                # un único libro elegido: el motor en memoria y la tabla de vecinos no lo necesitan.
+                # English: The book's "vector embedding" (its literary DNA) is only read here, once a
+                # single book has been chosen: the in-memory engine and the neighbours table don't need it.
+                cur.execute("SELECT embedding FROM books WHERE id = %s", (book_id,))
+                book_row = cur.fetchone()
+                if book_row is None:
+                    return {"error": f"Nessun libro trovato con id {book_id}."}, 404, None
+                book_vector = book_row['embedding']
+
+                # Español: Usamos el ADN del libro para encontrar los 5 libros más similares en toda la base de datos.
+                # English: We use the book's DNA to find the 5 most similar books in the entire database.
+                # Español: Con filtros, el WHERE va dentro de la búsqueda del índice (escaneo iterativo).
+                # English: With filters, the WHERE goes inside the index search (iterative scan).
+                if book_filter is not None:
+                    similar_books = filtered_neighbors(cur, book_id, book_vector, book_filter, k=5)
+                # Español: Con ANN_STORAGE=halfvec, candidatos por el índice float16 y reordenación con float32.
+                # English: With ANN_STORAGE=halfvec, candidates from the float16 index and reordering with float32.
+                elif halfvec_storage_enabled():
+                    cur.execute(rescoring_query(EMBEDDING_DIMENSION),
+                                (book_id, book_vector, ANN_RESCORE_CANDIDATES, book_vector, 5))
+                    similar_books = cur.fetchall()
+                else:
+                    query = """
+                        SELECT id, titolo, autore, synopsis, collocazione, anno
+                        FROM books 
+                        WHERE id != %s
+                        ORDER BY embedding <=> %s 
+                        LIMIT 5
+                    """
+                    cur.execute(query, (book_id, book_vector,))
+                    similar_books = cur.fetchall()
+
+                results = [dict(book) for book in similar_books]
+
+        cur.close()
+        return results, 200, book_id
+    finally:
+        # Español: Al final, siempre devolvemos la conexión al pool para ser ordenados.
+        # English: In the end, we always return the connection to the pool to be tidy.
+        release_db_connection(conn)
+
 # Español: La ruta para encontrar recomendaciones. Solo usuarios autorizados pueden pasar.
 # English: The route for finding recommendations. Only authorized users are allowed.
 @app.route('/api/recomend', methods=['POST'])
 @firebase_auth_required
 def recommend():
-    conn = None
     try:
         # Español: Obtenemos el título del libro que el usuario quiere usar como referencia.
         # English: We get the title of the book the user wants to use as a reference.
         data = request.get_json()
-        if not data or 'titolo' not in data:
-            return jsonify({"error": "El campo 'titolo' es requerido en el JSON."}, 400)
-        
-        title = data['titolo']
+        if not data or ('titolo' not in data and 'book_id' not in data):
+            return jsonify({"error": "El campo 'titolo' (o 'book_id') es requerido en el JSON."}, 400)
+
+        title = data.get('titolo', '')
+
+        # Español: 'book_id' (opcional) elige el libro directamente, sin buscar el título.
+        # English: 'book_id' (optional) picks the book directly, without looking up the title.
+        try:
+            book_id = None if data.get('book_id') is None else int(data['book_id'])
+        except (TypeError, ValueError):
+            return jsonify({"error": "El campo 'book_id' debe ser un número entero."}), 400
+
+        # Español: Filtros opcionales ("filters": anno_min, anno_max, autore, exclude_autore, collocazione).
+        # English: Optional filters ("filters": anno_min, anno_max, autore, exclude_autore, collocazione).
+        try:
+            book_filter = BookFilter.from_json(data.get('filters'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Español: Las peticiones idénticas simultáneas (mismo libro y mismos filtros) comparten una
+        # sola búsqueda; la clave es el id o la clave normalizada del título que se buscará.
+        # English: Identical concurrent requests (same book and same filters) share a single search;
+        # the key is the id or the normalized title key that will be looked up.
+        if singleflight_enabled():
+            book_key = ['id', book_id] if book_id is not None else ['titolo', normalize_title(title)]
+            flight_key = json.dumps([book_key, book_filter.key() if book_filter else None])
+            (payload, status, found_id), _ = get_singleflight('recommend').do(
+                flight_key, lambda: find_recommendations(title, book_filter, book_id))
+        else:
+            payload, status, found_id = find_recommendations(title, book_filter, book_id)
+
+        # Español: El id del libro elegido va en X-Book-Id, para que el cliente lo mande a /api/deep_dive.
+        # English: The chosen book's id goes in X-Book-Id, so the client can send it to /api/deep_dive.
+        response = jsonify(payload)
+        if found_id is not None:
+            response.headers['X-Book-Id'] = str(found_id)
+        return response, status
+
+    except psycopg2.OperationalError as e:
+        note_error(e)
+        return jsonify({"error": "Error de base de datos.", "details": str(e)}), 500
+    except Exception as e:
+        note_error(e)
+        return jsonify({"error": "Ha ocurrido un error interno en el servidor.", "details": str(e)}), 500
+
+# Español: Límites de la ruta por lotes, para que una sola petición no monopolice el worker.
+# English: Limits for the batch route, so a single request can't monopolize the worker.
+BATCH_MAX_INPUTS = int(os.getenv("RECOMMEND_BATCH_MAX_INPUTS", "100"))
+BATCH_MAX_K = int(os.getenv("RECOMMEND_BATCH_MAX_K", "50"))
+
+# Español: Recomendaciones para una lista entera (una estantería, una lista de lectura) en una sola
+# petición: una única consulta resuelve todos los títulos e ids, y todas las consultas se puntúan
+# contra el catálogo con un solo producto de matrices en el motor vectorial (con
+# VECTOR_ENGINE=pgvector, con una sola consulta a pgvector).
+# English: Recommendations for a whole list (a shelf, a reading list) in a single request: one
+# query resolves every title and id, and every query is scored against the catalog with a single
+# matrix product in the vector engine (with VECTOR_ENGINE=pgvector, with a single pgvector query).
+@app.route('/api/recomend_batch', methods=['POST'])
+@firebase_auth_required
+def recommend_batch():
+    conn = None
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "Se requiere una lista 'titoli' y/o una lista 'ids' en el JSON."}), 400
+
+        titles = data.get('titoli', [])
+        raw_ids = data.get('ids', [])
+        if not isinstance(titles, list) or not isinstance(raw_ids, list) or not (titles or raw_ids):
+            return jsonify({"error": "Se requiere una lista 'titoli' y/o una lista 'ids' en el JSON."}), 400
+        if not all(isinstance(title, str) for title in titles):
+            return jsonify({"error": "Todos los elementos de 'titoli' deben ser textos."}), 400
+        if len(titles) + len(raw_ids) > BATCH_MAX_INPUTS:
+            return jsonify({"error": f"Como máximo {BATCH_MAX_INPUTS} libros por petición."}), 400
+        try:
+            book_ids = [int(book_id) for book_id in raw_ids]
+            k = max(1, min(int(data.get('k', 5)), BATCH_MAX_K))
+        except (TypeError, ValueError):
+            return jsonify({"error": "Los campos 'ids' y 'k' deben ser números enteros."}), 400
+        combined = bool(data.get('combined', False))
+        try:
+            book_filter = BookFilter.from_json(data.get('filters'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        # Español: Abrimos la conexión con la base de datos para buscar el libro.
-        # English: We open the connection to the database to search for the book.
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
-        # Español: Buscamos libros que coincidan con el título que nos dieron.
-        # English: We search for books that match the title we were given.
-        search_pattern = f"%{title.strip()}%"
-        cur.execute("SELECT id, titolo, embedding FROM books WHERE TRIM(titolo) ILIKE %s", (search_pattern,))
-        matching_books = cur.fetchall()
-
-        if not matching_books:
-            return jsonify({"error": f"Nessun libro trovato che corrisponda a '{title}'."}), 404
-
-        # Español: Si hay muchos resultados, le pedimos al usuario que sea más específico.
-        # English: If there are too many results, we ask the user to be more specific.
-        if len(matching_books) > 1:
-            return jsonify({
-                "message": "Trovati più libri. Seleziona quello corretto.",
-                "options": [book['titolo'] for book in matching_books]
-            }), 200
-
-        # Español: Encontramos el libro exacto y tomamos su "vector embedding", que es como su ADN literario.
-        # English: We found the exact book and take its "vector embedding", which is like its literary DNA.
-        the_book = matching_books[0]
-        book_id = the_book['id']
-        book_vector = the_book['embedding']
-        
-        # Español: Usamos el ADN del libro para encontrar los 5 libros más similares en toda la base de datos.
-        # English: We use the book's DNA to find the 5 most similar books in the entire database.
-        query = """
-            SELECT id, titolo, autore, synopsis, collocazione, anno
-            FROM books 
-            WHERE id != %s
-            ORDER BY embedding <=> %s 
-            LIMIT 5
-        """
-        cur.execute(query, (book_id, book_vector,))
-        similar_books = cur.fetchall()
-
-        results = [dict(book) for book in similar_books]
+        # Español: Una sola consulta resuelve todas las entradas; `idx` dice a qué entrada pertenece cada fila.
+        # Como en /api/recomend, cada título se busca primero por su clave exacta y solo los que no
+        # la encuentran pasan a la búsqueda por subcadena.
+        # English: A single query resolves every input; `idx` tells which input each row belongs to.
+        # Like in /api/recomend, each title is looked up by its exact key first and only the ones that
+        # don't find it go on to the substring search.
+        lookups = [title_lookup_params(title) for title in titles]
+        cur.execute("""
+            WITH q AS (
+                SELECT * FROM unnest(%s::text[], %s::text[]) WITH ORDINALITY AS q(key, pattern, idx)
+            ), exact AS (
+                SELECT q.idx, b.id, b.titolo, b.autore, b.anno FROM q JOIN books b ON b.titolo_key = q.key
+            )
+            SELECT 'titolo' AS kind, idx, id, titolo, autore, anno FROM exact
+            UNION ALL
+            SELECT 'titolo' AS kind, q.idx, b.id, b.titolo, b.autore, b.anno
+            FROM q JOIN books b ON b.titolo_key LIKE q.pattern
+            WHERE q.idx NOT IN (SELECT idx FROM exact)
+            UNION ALL
+            SELECT 'id' AS kind, q.idx, b.id, b.titolo, b.autore, b.anno
+            FROM unnest(%s::bigint[]) WITH ORDINALITY AS q(book_id, idx)
+            JOIN books b ON b.id = q.book_id
+            ORDER BY 1, 2, 3
+        """, ([key for key, _ in lookups], [pattern for _, pattern in lookups], book_ids))
+        matches = {}
+        for row in cur.fetchall():
+            matches.setdefault((row['kind'], row['idx']), []).append(row)
+
+        # Español: Con el motor en memoria, los vectores y la puntuación salen del motor; si no
+        # (VECTOR_ENGINE=pgvector), se leen los embeddings de los libros elegidos y pgvector puntúa.
+        # English: With the in-memory engine, the vectors and the scoring come from the engine;
+        # otherwise (VECTOR_ENGINE=pgvector), the chosen books' embeddings are read and pgvector scores.
+        engine = None
+        if vector_engine_enabled():
+            engine = get_vector_engine()
+            engine.maybe_refresh(conn)
+            vector_for = engine.vector_for
+        else:
+            chosen_ids = [found[0]['id'] for found in matches.values() if len(found) == 1]
+            cur.execute("SELECT id, embedding FROM books WHERE id = ANY(%s) AND embedding IS NOT NULL",
+                        (chosen_ids,))
+            stored = {row['id']: normalize_rows(parse_vector(row['embedding'])[None, :])[0] for row in cur.fetchall()}
+            vector_for = stored.get
+
+        inputs = [('titolo', i + 1, title) for i, title in enumerate(titles)]
+        inputs += [('id', i + 1, book_id) for i, book_id in enumerate(book_ids)]
+
+        results = []
+        resolved = []
+        for kind, idx, value in inputs:
+            found = matches.get((kind, idx), [])
+            entry = {"input": value}
+            if not found:
+                entry["error"] = f"Nessun libro trovato che corrisponda a '{value}'."
+            elif len(found) > 1:
+                # Español: La misma forma que /api/recomend, con los ids para volver a pedir con 'ids'.
+                # English: The same shape as /api/recomend, with the ids to ask again with 'ids'.
+                entry.update(title_options(found))
+            elif vector_for(found[0]['id']) is None:
+                entry["error"] = f"Il libro '{found[0]['titolo']}' non ha un embedding."
+            else:
+                entry["book"] = {"id": found[0]['id'], "titolo": found[0]['titolo']}
+                resolved.append(entry)
+            results.append(entry)
+
+        resolved_ids = [entry["book"]["id"] for entry in resolved]
+        vectors = [vector_for(book_id) for book_id in resolved_ids]
+        if engine is not None:
+            batch = engine.top_k_many(vectors, k=k, exclude_ids=[[book_id] for book_id in resolved_ids],
+                                      book_filter=book_filter)
+        else:
+            batch = batch_neighbors(cur, resolved_ids, book_filter, k=k)
+        for entry, recommendations in zip(resolved, batch):
+            entry["recommendations"] = recommendations
 
+        response = {"results": results}
+        if combined:
+            # Español: "Quien leyó esta lista": el vector medio de toda la lista, sin repetir los libros de la lista.
+            # English: "Readers of this list": the mean vector of the whole list, without repeating the list's books.
+            response["combined"] = []
+            if vectors:
+                mean_vector = np.mean(vectors, axis=0)
+                if engine is not None:
+                    response["combined"] = engine.top_k_many([mean_vector], k=k, exclude_ids=[set(resolved_ids)],
+                                                             book_filter=book_filter)[0]
+                else:
+                    response["combined"] = vector_neighbors(cur, format_vectors([mean_vector])[0], resolved_ids,
+                                                            book_filter, k=k)
         cur.close()
-        return jsonify(results), 200
+
+        return jsonify(response), 200
 
     except psycopg2.OperationalError as e:
+        note_error(e)
         return jsonify({"error": "Error de base de datos.", "details": str(e)}), 500
     except Exception as e:
+        note_error(e)
         return jsonify({"error": "Ha ocurrido un error interno en el servidor.", "details": str(e)}), 500
     finally:
-        # Español: Al final, siempre cerramos la conexión para ser ordenados.
-        # English: In the end, we always close the connection to be tidy.
         if conn is not None:
-            conn.close()
+            release_db_connection(conn)
 
-# Español: La ruta para un análisis profundo, donde la IA entra en acción.
-# English: The route for a deep dive, where the AI comes into play.
-@app.route('/api/deep_dive', methods=['POST'])
+# Español: Límites de la búsqueda de texto libre.
+# English: Limits for the free-text search.
+SEARCH_MAX_K = int(os.getenv("SEARCH_MAX_K", "50"))
+SEARCH_MAX_QUERY_LENGTH = int(os.getenv("SEARCH_MAX_QUERY_LENGTH", "500"))
+
+# Español: Búsqueda semántica de texto libre ("libros sobre el mar"): la consulta se convierte en un
+# vector con el mismo modelo que las sinopsis (ver query_encoder.py) y se buscan los k libros más
+# cercanos, con los mismos filtros opcionales que /api/recomend.
+# English: Free-text semantic search ("books about the sea"): the query is turned into a vector
+# with the same model as the synopses (see query_encoder.py) and the k closest books are looked
+# up, with the same optional filters as /api/recomend.
+@app.route('/api/search', methods=['POST'])
 @firebase_auth_required
-def deep_dive():
+def search():
     conn = None
     try:
-        # Español: Recibimos el libro original y las recomendaciones que encontramos antes.
-        # English: We receive the original book and the recommendations we found earlier.
-        data = request.get_json()
-        if not data or 'titolo' not in data or 'recommendations' not in data:
-            return jsonify({"error": "Los campos 'titolo' y 'recommendations' son requeridos."}, 400)
+        data = request.get_json(silent=True)
+        query = data.get('query') if isinstance(data, dict) else None
+        if not isinstance(query, str) or not query.strip():
+            return jsonify({"error": "El campo 'query' es requerido en el JSON."}), 400
+        if len(query) > SEARCH_MAX_QUERY_LENGTH:
+            return jsonify({"error": f"La consulta puede tener como máximo {SEARCH_MAX_QUERY_LENGTH} caracteres."}), 400
+        try:
+            k = max(1, min(int(data.get('k', 10)), SEARCH_MAX_K))
+        except (TypeError, ValueError):
+            return jsonify({"error": "El campo 'k' debe ser un número entero."}), 400
+        try:
+            book_filter = BookFilter.from_json(data.get('filters'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if not semantic_search_enabled():
+            return jsonify({"error": "La búsqueda semántica no está activada."}), 503
 
-        original_title = data['titolo']
-        recommendations = data['recommendations']
+        # Español: Consultas repetidas salen de la caché; las nuevas se codifican en micro-lotes.
+        # English: Repeated queries come from the cache; new ones are encoded in micro-batches.
+        with timed('query_encode'):
+            try:
+                query_vector = get_query_encoder().encode(query)
+            except Exception as e:
+                note_error(e)
+                return jsonify({"error": "El codificador de consultas no está disponible.", "details": str(e)}), 503
 
         conn = get_db_connection()
+        with timed('vector_query'):
+            if vector_engine_enabled():
+                engine = get_vector_engine()
+                engine.maybe_refresh(conn)
+                results = engine.top_k(query_vector, k=k, book_filter=book_filter)
+                for book in results:
+                    book.pop('score', None)
+            else:
+                cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+                vector = format_vectors([query_vector])[0]
+                if book_filter is not None:
+                    similar_books = filtered_neighbors(cur, None, vector, book_filter, k=k)
+                elif halfvec_storage_enabled():
+                    cur.execute(rescoring_query(EMBEDDING_DIMENSION),
+                                (None, vector, max(ANN_RESCORE_CANDIDATES, k), vector, k))
+                    similar_books = cur.fetchall()
+                else:
+                    cur.execute("""
+                        SELECT id, titolo, autore, synopsis, collocazione, anno
+                        FROM books
+                        ORDER BY embedding <=> %s::vector
+                        LIMIT %s
+                    """, (vector, k))
+                    similar_books = cur.fetchall()
+                cur.close()
+                results = [dict(book) for book in similar_books]
+
+        return jsonify(results), 200
+
+    except psycopg2.OperationalError as e:
+        note_error(e)
+        return jsonify({"error": "Error de base de datos.", "details": str(e)}), 500
+    except Exception as e:
+        note_error(e)
+        return jsonify({"error": "Ha ocurrido un error interno en el servidor.", "details": str(e)}), 500
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
+
+# Español: Análisis guardados de este libro con estas recomendaciones, o None si no los hay.
+# English: Stored analyses of this book with these recommendations, or None if there are none.
+def cached_analyses_for(cache_key, recommendations):
+    try:
+        cached_analyses = get_analysis_cache().get(cache_key)
+    except Exception as e:
+        print(f"Error al leer la caché de análisis: {e}")
+        return None
+    if cached_analyses is not None and len(cached_analyses) == len(recommendations):
+        return cached_analyses
+    return None
+
+# Español: La sinopsis del libro original: por su id si el cliente lo manda (el X-Book-Id de
+# /api/recomend), si no por la clave normalizada del título, por el índice.
+# English: The original book's synopsis: by its id if the client sends it (/api/recomend's
+# X-Book-Id), otherwise by the title's normalized key, through the index.
+def fetch_original_book(cur, original_title, book_id):
+    if book_id is not None:
+        cur.execute("SELECT synopsis FROM books WHERE id = %s", (book_id,))
+    else:
+        cur.execute("SELECT synopsis FROM books WHERE titolo_key = %s ORDER BY id LIMIT 1",
+                    (normalize_title(original_title),))
+    return cur.fetchone()
+
+# Español: Título y sinopsis de las recomendaciones con id, leídos de `books`: {id: (titolo, synopsis)}.
+# English: Title and synopsis of the recommendations with an id, read from `books`: {id: (titolo, synopsis)}.
+def fetch_recommendation_books(cur, ids):
+    if not ids:
+        return {}
+    cur.execute("SELECT id, titolo, synopsis FROM books WHERE id = ANY(%s)", (ids,))
+    return {row['id']: (row['titolo'], row['synopsis']) for row in cur.fetchall()}
+
+def missing_recommendations_error(ids, stored):
+    missing = sorted(set(ids) - set(stored))
+    if missing:
+        return {"error": f"Libros recomendados no encontrados: {', '.join(map(str, missing))}."}
+    return None
+
+# Español: El trabajo de deep_dive que no está en la caché: sinopsis del libro original y llamada a
+# Gemini. Devuelve (estado, análisis), con un análisis por recomendación (o ninguno si la respuesta
+# no cuadra), para que varias peticiones idénticas puedan compartir una sola llamada a Gemini.
+# English: The deep_dive work that isn't in the cache: the original book's synopsis and the Gemini
+# call. Returns (status, analyses), with one analysis per recommendation (or none if the response
+# doesn't match), so several identical requests can share a single Gemini call.
+def generate_analyses(original_title, recommendations, cache_key, book_id=None):
+    conn = get_db_connection()
+    try:
         cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
         # Español: Buscamos la sinopsis del libro original para dársela a la IA como contexto.
         # English: We look for the original book's synopsis to give to the AI as context.
-        cur.execute("SELECT synopsis FROM books WHERE LOWER(TRIM(titolo)) = LOWER(TRIM(%s))", (original_title,))
-        original_book_result = cur.fetchone()
+        # Español: Las sinopsis de las recomendaciones también salen de `books`, no de la petición.
+        # English: The recommendations' synopses come from `books` too, not from the request.
+        ids = recommendation_ids(recommendations)
+        with timed('title_lookup'):
+            original_book_result = fetch_original_book(cur, original_title, book_id)
+            stored = fetch_recommendation_books(cur, ids)
 
         if original_book_result is None:
-            return jsonify({"error": f"Libro original con título '{original_title}' no encontrado."}, 404)
+            return 404, {"error": f"Libro original con título '{original_title}' no encontrado."}
+        error = missing_recommendations_error(ids, stored)
+        if error is not None:
+            return 404, error
 
         original_synopsis = original_book_result['synopsis']
 
-        # Español: Preparamos un texto con todas las recomendaciones para enviárselo a Gemini.
-        # English: We prepare a text with all the recommendations to send to Gemini.
-        recommendations_text = "\n".join(
-            [f" - Titolo: {rec['titolo']}, Sinossi: {rec['synopsis']}" for rec in recommendations]
-        )
-
-        # Español: Creamos el "prompt": las instrucciones detalladas para que la IA haga su análisis.
-        # English: We create the "prompt": the detailed instructions for the AI to perform its analysis.
-        prompt = f"""
-Libro di riferimento: '{original_title}'
-Sinossi di riferimento: {original_synopsis}
-
-Libri consigliati:
-{recommendations_text}
-
-Analizza la somiglianza di ciascun libro consigliato con el libro de referencia, considerando stile, genere, trama, ambientazione e tono.
-IMPORTANTE: Fornisci solo le analisi, separate dal delimitatore '|||'. Non includer los títulos de los libros en tu respuesta.
-"""
+        prompt = build_deep_dive_prompt(original_title, original_synopsis,
+                                        prompt_recommendations(recommendations, stored))
 
         # Español: Enviamos el prompt a Gemini y esperamos su experta opinión.
         # English: We send the prompt to Gemini and await its expert opinion.
-        response = model.generate_content(prompt)
+        with timed('gemini'):
+            response = get_gemini_model().generate_content(prompt)
         
         # Español: Procesamos la respuesta de la IA para organizarla y enviarla de vuelta al usuario.
         # English: We process the AI's response to organize it and send it back to the user.
-        analyses = response.text.split('|||')
-        analysis_by_title = {}
+        analyses = [analysis.strip() for analysis in response.text.split('|||')]
+        cur.close()
 
-        if len(analyses) == len(recommendations):
-            for i, rec in enumerate(recommendations):
-                analysis_by_title[rec['titolo']] = analyses[i].strip()
-        else:
+        if len(analyses) != len(recommendations):
+            DEEP_DIVE_MISMATCHES.inc(route='/api/deep_dive')
             print(f"Error: El número de análisis ({len(analyses)}) no coincide con el número de recomendaciones ({len(recommendations)}).")
+            return 200, []
 
-        cur.close()
-        return jsonify({"analysis": analysis_by_title})
+        # Español: Solo guardamos respuestas bien formadas (un análisis por recomendación).
+        # English: We only store well-formed responses (one analysis per recommendation).
+        if cache_key is not None:
+            try:
+                get_analysis_cache().put(cache_key, original_title, analyses)
+            except Exception as e:
+                print(f"Error al guardar en la caché de análisis: {e}")
+        return 200, analyses
+    finally:
+        release_db_connection(conn)
+
+# Español: La ruta para un análisis profundo, donde la IA entra en acción.
+# English: The route for a deep dive, where the AI comes into play.
+@app.route('/api/deep_dive', methods=['POST'])
+@firebase_auth_required
+def deep_dive():
+    try:
+        # Español: Recibimos el libro original y las recomendaciones que encontramos antes.
+        # English: We receive the original book and the recommendations we found earlier.
+        data = request.get_json()
+        if not data or 'titolo' not in data or 'recommendations' not in data:
+            return jsonify({"error": "Los campos 'titolo' y 'recommendations' son requeridos."}, 400)
+
+        original_title = data['titolo']
+        recommendations = data['recommendations']
+        try:
+            book_id = None if data.get('book_id') is None else int(data['book_id'])
+        except (TypeError, ValueError):
+            return jsonify({"error": "El campo 'book_id' debe ser un número entero."}), 400
+        try:
+            recommendation_ids(recommendations)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Español: Si ya analizamos este mismo libro con estas mismas recomendaciones, devolvemos
+        # el análisis guardado sin llamar a Gemini (ni a la base de datos).
+        # English: If we already analysed this same book with these same recommendations, we
+        # return the stored analysis without calling Gemini (or the database).
+        cache_key = None
+        if analysis_cache_enabled():
+            cache_key = analysis_key(original_title, recommendations, GEMINI_MODEL_NAME, DEEP_DIVE_PROMPT_VERSION, book_id)
+            cached_analyses = cached_analyses_for(cache_key, recommendations)
+            if cached_analyses is not None:
+                return jsonify({"analysis": {
+                    rec['titolo']: analysis for rec, analysis in zip(recommendations, cached_analyses)
+                }})
+
+        # Español: Las peticiones idénticas simultáneas comparten una sola llamada a Gemini. Con
+        # SINGLEFLIGHT_LOCK_DIR también entre workers: quien espera al cerrojo de otro worker lee
+        # después su respuesta de la caché de análisis.
+        # English: Identical concurrent requests share a single Gemini call. With
+        # SINGLEFLIGHT_LOCK_DIR also across workers: whoever waits for another worker's lock then
+        # reads its answer from the analysis cache.
+        if singleflight_enabled():
+            flight_key = cache_key or analysis_key(original_title, recommendations, GEMINI_MODEL_NAME,
+                                                   DEEP_DIVE_PROMPT_VERSION, book_id)
+            shared_lookup = None
+            if cache_key is not None:
+                def shared_lookup():
+                    cached_analyses = cached_analyses_for(cache_key, recommendations)
+                    return None if cached_analyses is None else (200, cached_analyses)
+            (status, analyses), _ = get_singleflight('deep_dive').do(
+                flight_key, lambda: generate_analyses(original_title, recommendations, cache_key, book_id),
+                shared_lookup)
+        else:
+            status, analyses = generate_analyses(original_title, recommendations, cache_key, book_id)
+
+        if status != 200:
+            return jsonify(analyses), status
+        return jsonify({"analysis": {rec['titolo']: analysis for rec, analysis in zip(recommendations, analyses)}})
 
     except psycopg2.OperationalError as e:
+        note_error(e)
         return jsonify({"error": "Error de base de datos.", "details": str(e)}), 500
     except Exception as e:
+        note_error(e)
+        return jsonify({"error": "Ha ocurrido un error interno en el servidor.", "details": str(e)}), 500
+
+# Español: El mismo análisis de deep_dive, pero transmitido por Server-Sent Events: cada
+# recomendación se envía como un evento `analysis` en cuanto Gemini termina de escribirla, y un
+# evento final `done` informa de si el número de análisis coincide con el de recomendaciones.
+# English: The same deep_dive analysis, but streamed over Server-Sent Events: each
+# recommendation is sent as an `analysis` event as soon as Gemini finishes writing it, and a
+# final `done` event reports whether the number of analyses matches the recommendations.
+@app.route('/api/deep_dive/stream', methods=['POST'])
+@firebase_auth_required
+def deep_dive_stream():
+    conn = None
+    try:
+        data = request.get_json()
+        if not data or 'titolo' not in data or 'recommendations' not in data:
+            return jsonify({"error": "Los campos 'titolo' y 'recommendations' son requeridos."}), 400
+
+        original_title = data['titolo']
+        recommendations = data['recommendations']
+        try:
+            book_id = None if data.get('book_id') is None else int(data['book_id'])
+        except (TypeError, ValueError):
+            return jsonify({"error": "El campo 'book_id' debe ser un número entero."}), 400
+        try:
+            ids = recommendation_ids(recommendations)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        cache_key = None
+        cached_analyses = None
+        if analysis_cache_enabled():
+            cache_key = analysis_key(original_title, recommendations, GEMINI_MODEL_NAME, DEEP_DIVE_PROMPT_VERSION, book_id)
+            try:
+                cached_analyses = get_analysis_cache().get(cache_key)
+            except Exception as e:
+                print(f"Error al leer la caché de análisis: {e}")
+
+        original_synopsis = None
+        trusted_recommendations = None
+        if cached_analyses is None or len(cached_analyses) != len(recommendations):
+            cached_analyses = None
+            conn = get_db_connection()
+            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            with timed('title_lookup'):
+                original_book_result = fetch_original_book(cur, original_title, book_id)
+                stored = fetch_recommendation_books(cur, ids)
+            cur.close()
+            # Español: Devolvemos la conexión antes de empezar a transmitir: el stream puede durar
+            # segundos y no necesita la base de datos.
+            # English: We return the connection before streaming starts: the stream can last
+            # seconds and doesn't need the database.
+            release_db_connection(conn)
+            conn = None
+
+            if original_book_result is None:
+                return jsonify({"error": f"Libro original con título '{original_title}' no encontrado."}), 404
+            error = missing_recommendations_error(ids, stored)
+            if error is not None:
+                return jsonify(error), 404
+            original_synopsis = original_book_result['synopsis']
+            trusted_recommendations = prompt_recommendations(recommendations, stored)
+
+    except psycopg2.OperationalError as e:
+        note_error(e)
+        return jsonify({"error": "Error de base de datos.", "details": str(e)}), 500
+    except Exception as e:
+        note_error(e)
         return jsonify({"error": "Ha ocurrido un error interno en el servidor.", "details": str(e)}), 500
     finally:
         if conn is not None:
-            conn.close()
+            release_db_connection(conn)
+
+    def analysis_event(index, analysis):
+        return sse_event('analysis', {
+            "index": index,
+            "titolo": recommendations[index]['titolo'],
+            "analysis": analysis.strip(),
+        })
+
+    def generate():
+        if cached_analyses is not None:
+            for index, analysis in enumerate(cached_analyses):
+                yield analysis_event(index, analysis)
+            yield sse_event('done', {"count": len(cached_analyses), "expected": len(recommendations), "mismatch": False})
+            return
+
+        # Español: La cabecera Server-Timing ya se envió al empezar el stream, así que el tiempo de
+        # Gemini va directamente al histograma de /metrics.
+        # English: The Server-Timing header was already sent when the stream started, so Gemini's
+        # time goes straight into /metrics' histogram.
+        parser = DelimitedStreamParser()
+        analyses = []
+        gemini_started = time.perf_counter()
+        try:
+            prompt = build_deep_dive_prompt(original_title, original_synopsis, trusted_recommendations)
+            for chunk in get_gemini_model().generate_content(prompt, stream=True):
+                for segment in parser.feed(chunk.text):
+                    analyses.append(segment)
+                    if len(analyses) <= len(recommendations):
+                        yield analysis_event(len(analyses) - 1, segment)
+            analyses.append(parser.finish())
+            if len(analyses) <= len(recommendations):
+                yield analysis_event(len(analyses) - 1, analyses[-1])
+        except Exception as e:
+            REQUEST_ERRORS.inc(route='/api/deep_dive/stream', status='stream', error=type(e).__name__)
+            yield sse_event('error', {"error": "Ha ocurrido un error interno en el servidor.", "details": str(e)})
+            return
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - gemini_started, route='/api/deep_dive/stream', stage='gemini')
+
+        mismatch = len(analyses) != len(recommendations)
+        if mismatch:
+            DEEP_DIVE_MISMATCHES.inc(route='/api/deep_dive/stream')
+            print(f"Error: El número de análisis ({len(analyses)}) no coincide con el número de recomendaciones ({len(recommendations)}).")
+        elif cache_key is not None:
+            try:
+                get_analysis_cache().put(cache_key, original_title, [analysis.strip() for analysis in analyses])
+            except Exception as e:
+                print(f"Error al guardar en la caché de análisis: {e}")
+        yield sse_event('done', {"count": len(analyses), "expected": len(recommendations), "mismatch": mismatch})
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
 
 # Español: Una ruta de ayuda para sugerir títulos mientras el usuario escribe (autocomplete).
 # English: A helper route to suggest titles as the user writes (autocomplete).
@@ -281,24 +943,102 @@ def suggest_titles():
         if not search_query:
             return jsonify([])
 
+        # Español: Con el índice en memoria, la mayoría de pulsaciones no tocan la base de datos:
+        # solo pedimos una conexión cuando toca comprobar si el catálogo ha cambiado.
+        # English: With the in-memory index, most keystrokes never touch the database: we only
+        # check out a connection when it's time to see whether the catalog has changed.
+        if title_index_enabled():
+            index = get_title_index()
+            if index.refresh_due():
+                conn = get_db_connection()
+                index.maybe_refresh(conn)
+            with timed('title_lookup'):
+                suggestions = index.search(search_query, limit=10)
+            return jsonify(suggestions), 200
+
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
         # Español: Buscamos en la base de datos hasta 10 títulos que empiecen con esas letras.
         # English: We search the database for up to 10 titles that start with those letters.
-        cur.execute("SELECT DISTINCT titolo FROM books WHERE TRIM(titolo) ILIKE %s ORDER BY titolo LIMIT 10", (f"%{search_query.strip()}%",))
-        suggestions = [row['titolo'] for row in cur.fetchall()]
+        with timed('title_lookup'):
+            cur.execute("SELECT DISTINCT titolo FROM books WHERE TRIM(titolo) ILIKE %s ORDER BY titolo LIMIT 10", (f"%{search_query.strip()}%",))
+            suggestions = [row['titolo'] for row in cur.fetchall()]
         
         cur.close()
         return jsonify(suggestions), 200
 
     except psycopg2.OperationalError as e:
+        note_error(e)
         return jsonify({"error": "Error de base de datos.", "details": str(e)}), 500
     except Exception as e:
+        note_error(e)
         return jsonify({"error": "Ha ocurrido un error interno en el servidor.", "details": str(e)}), 500
     finally:
         if conn is not None:
-            conn.close()
+            release_db_connection(conn)
+
+# Español: Estadísticas del pool de conexiones para monitorización (en uso, esperas, tiempo de espera).
+# English: Connection pool statistics for monitoring (in use, waits, wait time).
+@app.route('/api/db_pool_stats', methods=['GET'])
+@firebase_auth_required
+def db_pool_stats():
+    return jsonify(get_pool().stats()), 200
+
+# Español: Invalida la caché de análisis: de un libro de referencia (campo 'titolo') o entera.
+# English: Invalidates the analysis cache: for one reference book ('titolo' field) or all of it.
+@app.route('/api/admin/analysis_cache/invalidate', methods=['POST'])
+@firebase_auth_required
+@admin_required
+def invalidate_analysis_cache():
+    data = request.get_json(silent=True) or {}
+    deleted = get_analysis_cache().invalidate(data.get('titolo'))
+    return jsonify({"deleted": deleted}), 200
+
+# Español: Aciertos y fallos de la caché de tokens: cuánta verificación nos estamos ahorrando.
+# English: Token cache hits and misses: how much verification work we are saving.
+@app.route('/api/auth_cache_stats', methods=['GET'])
+@firebase_auth_required
+def auth_cache_stats():
+    return jsonify(get_token_cache().stats()), 200
+
+# Español: Métricas en formato de texto de Prometheus: histogramas de latencia por ruta y etapa,
+# errores por ruta, desajustes de '|||' en deep_dive y el estado del pool y de la caché de tokens.
+# Si METRICS_TOKEN está definido, hay que enviarlo como `Authorization: Bearer <token>`.
+# English: Metrics in Prometheus text format: latency histograms per route and stage, errors per
+# route, '|||' mismatches in deep_dive and the state of the pool and the token cache. If
+# METRICS_TOKEN is set, it must be sent as `Authorization: Bearer <token>`.
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    metrics_token = os.getenv("METRICS_TOKEN")
+    if metrics_token and request.headers.get('Authorization') != f"Bearer {metrics_token}":
+        return jsonify({"error": "Unauthorized."}), 401
+    snapshots = [
+        ("db_pool", get_pool().stats() if os.getenv("DATABASE_URL") else {},
+         {"connects", "discards", "timeouts", "waits", "health_check_failures", "checkouts", "wait_time_total"}),
+        ("auth_token_cache", get_token_cache().stats(), {"hits", "misses", "expired", "evictions"}),
+    ]
+    # Español: En deep_dive, coalesced + coalesced_cross_worker son las llamadas a Gemini evitadas.
+    # English: For deep_dive, coalesced + coalesced_cross_worker are the Gemini calls avoided.
+    for name in ('recommend', 'deep_dive'):
+        snapshots.append((f"singleflight_{name}", get_singleflight(name).stats(),
+                          {"executions", "coalesced", "coalesced_cross_worker"}))
+    # Español: queries / batches es el tamaño medio de los micro-lotes del codificador.
+    # English: queries / batches is the encoder's average micro-batch size.
+    if semantic_search_enabled():
+        query_encoder = get_query_encoder()
+        snapshots.append(("query_encoder", query_encoder.stats(),
+                          {"batches", "queries", "encoded", "errors", "encode_seconds"}))
+        snapshots.append(("query_cache", query_encoder.cache.stats(), {"hits", "misses", "evictions"}))
+    snapshots.append(("startup", startup_stats(), set()))
+    return Response(REGISTRY.render(snapshots), mimetype='text/plain; version=0.0.4')
+
+# Español: Cuánto ha tardado el worker en estar listo y en qué: importación de la app y, con
+# SDK_INIT=eager, importación e inicialización de cada SDK.
+# English: How long the worker took to be ready and on what: the app's import and, with
+# SDK_INIT=eager, each SDK's import and initialization.
+record_startup("app_import", time.perf_counter() - APP_IMPORT_START)
+log_startup("startup")
 
 # Español: ¡Luces, cámara, acción! Si ejecutamos este archivo directamente, la aplicación se pone en marcha.
 # English: Lights, camera, action! If we run this file directly, the application starts.
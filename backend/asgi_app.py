@@ -0,0 +1,668 @@
+# Español: Modo de servicio asíncrono (ASGI) de las tres rutas principales: /api/recomend,
+# /api/deep_dive y /api/suggest_titles. Con los workers síncronos de gunicorn, cada deep_dive
+# ocupa un proceso entero durante los segundos que tarda Gemini, y unos pocos bastan para dejar
+# sin worker al autocompletado. Aquí la base de datos va por asyncpg (con su propio pool) y Gemini
+# por su cliente asíncrono, así un solo worker mantiene cientos de llamadas en vuelo y sigue
+# respondiendo a suggest_titles al momento. Las respuestas son las mismas que las de app.py.
+# English: Asynchronous (ASGI) serving mode for the three main routes: /api/recomend,
+# /api/deep_dive and /api/suggest_titles. With gunicorn's sync workers, every deep_dive takes a
+# whole process for the seconds Gemini needs, and a handful of them leave autocomplete without a
+# worker. Here the database goes through asyncpg (with its own pool) and Gemini through its async
+# client, so a single worker keeps hundreds of calls in flight and still answers suggest_titles
+# right away. Responses are the same as app.py's.
+#
+#   gunicorn -k uvicorn.workers.UvicornWorker -w 2 --bind 0.0.0.0:10000 asgi_app:app
+import time
+
+APP_IMPORT_START = time.perf_counter()
+
+import asyncio
+import json
+import os
+import re
+from functools import wraps
+
+import asyncpg
+from dotenv import load_dotenv
+from quart import Quart, Response, g, jsonify, request
+from quart_cors import cors
+
+from analysis_cache import analysis_cache_enabled, analysis_key, get_analysis_cache
+from ann_index import halfvec_storage_enabled, search_settings_from_env
+from deep_dive_prompt import (DEEP_DIVE_PROMPT_VERSION, GEMINI_MODEL_NAME, build_deep_dive_prompt,
+                              prompt_recommendations, recommendation_ids)
+from filters import ITERATIVE_SCAN_SETTINGS, BookFilter
+from metrics import (DEEP_DIVE_MISMATCHES, REGISTRY, REQUEST_ERRORS, REQUEST_SECONDS, STAGE_SECONDS,
+                     RequestTimings)
+from neighbors import neighbors_table_enabled
+from query_encoder import ensure_query_encoder_warm, get_query_encoder, semantic_search_enabled
+from sdk_loader import (GEMINI, ensure_sdks_warm, get_firebase_auth, get_gemini_model, lazy_sdk_enabled, log_startup,
+                        record_startup, startup_stats)
+from singleflight import AsyncSingleFlight, get_singleflight, singleflight_enabled
+from bulk_load import format_vectors
+from title_index import (TitleIndexState, normalize_title, resolve_title_query, title_index_enabled,
+                         title_lookup_params, title_options)
+from token_cache import ensure_public_keys_warm, get_token_cache
+
+load_dotenv()
+
+app = Quart(__name__)
+app = cors(app, allow_origin=[
+    "http://localhost:4200",
+    "https://book-recommender-rosy.vercel.app",
+    re.compile(r"^https://book-recommender-.*-celes-projects-b4460b91\.vercel\.app$")
+], allow_credentials=True, expose_headers=["Server-Timing", "X-Book-Id"])
+
+# --- Firebase y Gemini ---
+# --- Firebase and Gemini ---
+
+# Español: Como en app.py, con SDK_INIT=lazy ambos SDK se cargan al primer uso (ver sdk_loader.py).
+# English: Like in app.py, with SDK_INIT=lazy both SDKs are loaded on first use (see sdk_loader.py).
+if not lazy_sdk_enabled():
+    try:
+        get_firebase_auth()
+    except Exception as e:
+        print(f"Error initializing Firebase Admin SDK: {e}")
+        exit(1)
+
+AUTHORIZED_EMAILS = {
+    email.strip().lower() for email in os.getenv("AUTHORIZED_EMAILS", "").split(',') if email.strip()
+}
+if not AUTHORIZED_EMAILS:
+    print("WARNING: AUTHORIZED_EMAILS is not set or is empty. No users will be authorized.")
+
+if not lazy_sdk_enabled():
+    get_gemini_model()
+
+# Español: La carga aplazada importa módulos y lee credenciales: se hace en un hilo para no
+# bloquear el bucle de eventos.
+# English: The deferred load imports modules and reads credentials: it runs in a thread so it
+# doesn't block the event loop.
+async def gemini_model():
+    return get_gemini_model() if GEMINI.loaded else await asyncio.to_thread(get_gemini_model)
+
+def verify_id_token(id_token):
+    return get_firebase_auth().verify_id_token(id_token)
+
+# --- Instrumentación ---
+# --- Instrumentation ---
+
+# Español: Igual que en app.py: Server-Timing en cada respuesta e histogramas para /metrics.
+# English: Same as app.py: Server-Timing on every response and histograms for /metrics.
+def timed(stage):
+    return g.timings.stage(stage)
+
+def note_error(e):
+    g.error_type = type(e).__name__
+
+def current_route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+@app.before_request
+async def start_request_timer():
+    g.timings = RequestTimings()
+
+@app.after_request
+async def record_request_timings(response):
+    timings = g.get('timings')
+    if timings is None:
+        return response
+    route = current_route()
+    total = timings.total()
+    REQUEST_SECONDS.observe(total, route=route, method=request.method, status=response.status_code)
+    for stage, seconds in timings.stages.items():
+        STAGE_SECONDS.observe(seconds, route=route, stage=stage)
+    if response.status_code >= 400:
+        REQUEST_ERRORS.inc(route=route, status=response.status_code, error=g.get('error_type', ''))
+    response.headers['Server-Timing'] = timings.server_timing(total)
+    return response
+
+# --- Base de datos ---
+# --- Database ---
+
+# Español: Un pool de asyncpg por worker, creado al arrancar el bucle de eventos. Los parámetros de
+# búsqueda ANN (ANN_EF_SEARCH, ANN_PROBES) van como server_settings: asyncpg hace RESET ALL al
+# devolver cada conexión, así que un SET normal se perdería.
+# English: One asyncpg pool per worker, created when the event loop starts. ANN search parameters
+# (ANN_EF_SEARCH, ANN_PROBES) go in as server_settings: asyncpg runs RESET ALL when each connection
+# is released, so a plain SET would be lost.
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+@app.before_serving
+async def open_db_pool():
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise ValueError("La variable de entorno DATABASE_URL no está configurada.")
+    app.db_pool = await asyncpg.create_pool(
+        database_url,
+        min_size=int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+        max_size=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+        server_settings={name: str(value) for name, value in search_settings_from_env().items()},
+    )
+    # Español: El codificador de /api/search (y los SDK con SDK_INIT=lazy) se cargan en segundo plano
+    # mientras el worker arranca.
+    # English: /api/search's encoder (and the SDKs with SDK_INIT=lazy) are loaded in the background
+    # while the worker starts.
+    ensure_query_encoder_warm()
+    ensure_sdks_warm()
+
+@app.after_serving
+async def close_db_pool():
+    await app.db_pool.close()
+
+async def get_db_connection():
+    with timed('db_connect'):
+        return await app.db_pool.acquire(timeout=DB_POOL_TIMEOUT)
+
+async def release_db_connection(conn):
+    await app.db_pool.release(conn)
+
+# --- Índice de títulos ---
+# --- Title index ---
+
+class AsyncTitleIndex:
+    # Español: La versión asíncrona de TitleIndex: misma estructura (TitleIndexState) y misma
+    # política de recarga por versión del catálogo, pero leyendo con asyncpg. La construcción del
+    # índice se hace en un hilo para no bloquear el bucle de eventos.
+    # English: The async version of TitleIndex: same structure (TitleIndexState) and same reload
+    # policy by catalog version, but reading through asyncpg. The index is built in a thread so the
+    # event loop is not blocked.
+    def __init__(self, refresh_interval=30.0):
+        self.refresh_interval = refresh_interval
+        self.version = None
+        self._state = None
+        self._last_check = 0.0
+        self._lock = asyncio.Lock()
+
+    def refresh_due(self):
+        return self._state is None or time.monotonic() - self._last_check >= self.refresh_interval
+
+    async def maybe_refresh(self, conn):
+        if not self.refresh_due():
+            return False
+        if self._lock.locked() and self._state is not None:
+            return False
+        async with self._lock:
+            if not self.refresh_due():
+                return False
+            exists = await conn.fetchval("SELECT to_regclass('catalog_meta') IS NOT NULL")
+            version = await conn.fetchval("SELECT version FROM catalog_meta WHERE id") if exists else 0
+            version = version or 0
+            self._last_check = time.monotonic()
+            if self._state is not None and version == self.version:
+                return False
+            rows = await conn.fetch("SELECT DISTINCT titolo FROM books WHERE titolo IS NOT NULL")
+            self._state = await asyncio.to_thread(TitleIndexState, [row['titolo'] for row in rows])
+            self.version = version
+            return True
+
+    def search(self, query, limit=10):
+        return self._state.search(query, limit=limit)
+
+
+title_index = AsyncTitleIndex(refresh_interval=float(os.getenv("SUGGEST_INDEX_REFRESH_SECONDS", "30")))
+
+# --- Decorador de Autenticación ---
+# --- Authentication Decorator ---
+
+# Español: La verificación de Firebase es síncrona; se hace en un hilo para no bloquear el bucle.
+# Con la caché de tokens, casi todas las peticiones ni siquiera llegan a ella.
+# English: Firebase verification is synchronous; it runs in a thread so the loop is not blocked.
+# With the token cache, almost no request even gets that far.
+def firebase_auth_required(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({"error": "Authorization header missing."}), 401
+
+        try:
+            with timed('auth'):
+                id_token = auth_header.split(' ')[1]
+                token_cache = get_token_cache()
+                decoded_token = token_cache.get(id_token)
+                if decoded_token is None:
+                    with timed('firebase_verify'):
+                        decoded_token = await asyncio.to_thread(verify_id_token, id_token)
+                    token_cache.put(id_token, decoded_token)
+                # Español: Aquí la app de Firebase ya está inicializada (también con SDK_INIT=lazy).
+                # English: By now the Firebase app is initialized (with SDK_INIT=lazy too).
+                ensure_public_keys_warm()
+            user_email = (decoded_token.get('email') or '').strip().lower()
+
+            if user_email and user_email in AUTHORIZED_EMAILS:
+                g.current_user = decoded_token
+                return await f(*args, **kwargs)
+            return jsonify({"error": "Unauthorized: Email not in whitelist."}), 403
+        except Exception as e:
+            note_error(e)
+            return jsonify({"error": f"Authentication failed: {e}"}), 401
+    return decorated_function
+
+# --- Rutas de la API ---
+# --- API Routes ---
+
+NEIGHBORS_QUERY = """
+    SELECT b.id, b.titolo, b.autore, b.synopsis, b.collocazione, b.anno
+    FROM book_neighbors n
+    JOIN books b ON b.id = n.neighbor_id
+    WHERE n.book_id = $1
+    ORDER BY n.rank
+    LIMIT $2
+"""
+
+# Español: El vector del libro de referencia se resuelve dentro de la consulta, sin traerlo a Python.
+# English: The reference book's vector is resolved inside the query, without bringing it into Python.
+LIVE_NEIGHBORS_QUERY = """
+    SELECT id, titolo, autore, synopsis, collocazione, anno
+    FROM books
+    WHERE id != $1
+    ORDER BY embedding <=> (SELECT embedding FROM books WHERE id = $1)
+    LIMIT $2
+"""
+
+# Español: Con ANN_STORAGE=halfvec, candidatos por el índice float16 y reordenación con float32 (ver ann_index.py).
+# English: With ANN_STORAGE=halfvec, candidates from the float16 index and reordering with float32 (see ann_index.py).
+EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION", "384"))
+ANN_RESCORE_CANDIDATES = int(os.getenv("ANN_RESCORE_CANDIDATES", "40"))
+HALFVEC_NEIGHBORS_QUERY = f"""
+    SELECT id, titolo, autore, synopsis, collocazione, anno
+    FROM (
+        SELECT id, titolo, autore, synopsis, collocazione, anno, embedding
+        FROM books
+        WHERE id != $1
+        ORDER BY embedding::halfvec({EMBEDDING_DIMENSION})
+            <=> (SELECT embedding::halfvec({EMBEDDING_DIMENSION}) FROM books WHERE id = $1)
+        LIMIT $3
+    ) candidates
+    ORDER BY embedding <=> (SELECT embedding FROM books WHERE id = $1)
+    LIMIT $2
+"""
+
+# Español: Vecinos que cumplen un BookFilter: $1 es el libro, $2 es k y las condiciones del filtro
+# empiezan en $3. Igual que filters.filtered_neighbors, se vuelve a ordenar por distancia.
+# English: Neighbours that match a BookFilter: $1 is the book, $2 is k and the filter conditions
+# start at $3. Like filters.filtered_neighbors, results are sorted by distance again.
+FILTERED_NEIGHBORS_QUERY = """
+    WITH candidates AS MATERIALIZED (
+        SELECT id, titolo, autore, synopsis, collocazione, anno,
+               embedding <=> (SELECT embedding FROM books WHERE id = $1) AS distance
+        FROM books
+        WHERE id != $1 AND {where}
+        ORDER BY embedding <=> (SELECT embedding FROM books WHERE id = $1)
+        LIMIT $2
+    )
+    SELECT id, titolo, autore, synopsis, collocazione, anno
+    FROM candidates
+    ORDER BY distance
+"""
+
+# Español: Las mismas consultas para un vector cualquiera (el de una búsqueda de texto), que llega
+# como texto en $1; k es $2 y, con filtros, las condiciones empiezan en $3.
+# English: The same queries for any vector (a text search's), which comes in as text in $1; k is
+# $2 and, with filters, the conditions start at $3.
+SEARCH_QUERY = """
+    SELECT id, titolo, autore, synopsis, collocazione, anno
+    FROM books
+    ORDER BY embedding <=> $1::text::vector
+    LIMIT $2
+"""
+
+HALFVEC_SEARCH_QUERY = f"""
+    SELECT id, titolo, autore, synopsis, collocazione, anno
+    FROM (
+        SELECT id, titolo, autore, synopsis, collocazione, anno, embedding
+        FROM books
+        ORDER BY embedding::halfvec({EMBEDDING_DIMENSION}) <=> $1::text::halfvec({EMBEDDING_DIMENSION})
+        LIMIT $3
+    ) candidates
+    ORDER BY embedding <=> $1::text::vector
+    LIMIT $2
+"""
+
+FILTERED_SEARCH_QUERY = """
+    WITH candidates AS MATERIALIZED (
+        SELECT id, titolo, autore, synopsis, collocazione, anno, embedding <=> $1::text::vector AS distance
+        FROM books
+        WHERE {where}
+        ORDER BY embedding <=> $1::text::vector
+        LIMIT $2
+    )
+    SELECT id, titolo, autore, synopsis, collocazione, anno
+    FROM candidates
+    ORDER BY distance
+"""
+
+_iterative_scan_supported = None
+
+
+# Español: Versión asyncpg de filters.enable_iterative_scan; la transacción anidada es un savepoint.
+# English: asyncpg version of filters.enable_iterative_scan; the nested transaction is a savepoint.
+async def enable_iterative_scan(conn):
+    global _iterative_scan_supported
+    if _iterative_scan_supported is False:
+        return
+    try:
+        async with conn.transaction():
+            for statement in ITERATIVE_SCAN_SETTINGS:
+                await conn.execute(statement)
+        _iterative_scan_supported = True
+    except asyncpg.PostgresError:
+        _iterative_scan_supported = False
+
+
+async def fetch_filtered_neighbors(conn, book_id, book_filter, k):
+    where, params = book_filter.sql(lambda index: f"${index}", start=2)
+    async with conn.transaction():
+        await enable_iterative_scan(conn)
+        rows = await conn.fetch(FILTERED_NEIGHBORS_QUERY.format(where=where), book_id, k, *params)
+    return [dict(row) for row in rows]
+
+RESOLVE_TITLE_QUERY = resolve_title_query("$1", "$2")
+
+# Español: Como en app.py, la búsqueda devuelve (cuerpo, estado, id del libro) para que las
+# peticiones idénticas simultáneas la compartan.
+# English: Like in app.py, the search returns (body, status, book id) so identical concurrent
+# requests can share it.
+async def find_recommendations(title, book_filter, book_id=None):
+    conn = await get_db_connection()
+    try:
+        if book_id is None:
+            with timed('title_lookup'):
+                matching_books = await conn.fetch(RESOLVE_TITLE_QUERY, *title_lookup_params(title))
+
+            if not matching_books:
+                return {"error": f"Nessun libro trovato che corrisponda a '{title}'."}, 404, None
+            if len(matching_books) > 1:
+                return title_options(matching_books), 200, None
+            book_id = matching_books[0]['id']
+        # Español: Las consultas leen el embedding por id en una subconsulta: un id inexistente
+        # daría vecinos sin sentido, así que antes se comprueba por la clave primaria.
+        # English: The queries read the embedding by id in a subquery: a missing id would give
+        # meaningless neighbours, so it's checked by primary key first.
+        elif await conn.fetchval("SELECT 1 FROM books WHERE id = $1", book_id) is None:
+            return {"error": f"Nessun libro trovato con id {book_id}."}, 404, None
+
+        with timed('vector_query'):
+            results = None
+            if book_filter is not None:
+                results = await fetch_filtered_neighbors(conn, book_id, book_filter, 5)
+            elif neighbors_table_enabled():
+                try:
+                    rows = await conn.fetch(NEIGHBORS_QUERY, book_id, 5)
+                    if len(rows) == 5:
+                        results = [dict(row) for row in rows]
+                except asyncpg.exceptions.UndefinedTableError:
+                    results = None
+            if results is None and halfvec_storage_enabled():
+                rows = await conn.fetch(HALFVEC_NEIGHBORS_QUERY, book_id, 5, ANN_RESCORE_CANDIDATES)
+                results = [dict(row) for row in rows]
+            elif results is None:
+                results = [dict(row) for row in await conn.fetch(LIVE_NEIGHBORS_QUERY, book_id, 5)]
+        return results, 200, book_id
+    finally:
+        await release_db_connection(conn)
+
+@app.route('/api/recomend', methods=['POST'])
+@firebase_auth_required
+async def recommend():
+    try:
+        data = await request.get_json()
+        if not data or ('titolo' not in data and 'book_id' not in data):
+            return jsonify({"error": "El campo 'titolo' (o 'book_id') es requerido en el JSON."}), 400
+        title = data.get('titolo', '')
+        try:
+            book_id = None if data.get('book_id') is None else int(data['book_id'])
+        except (TypeError, ValueError):
+            return jsonify({"error": "El campo 'book_id' debe ser un número entero."}), 400
+        try:
+            book_filter = BookFilter.from_json(data.get('filters'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if singleflight_enabled():
+            book_key = ['id', book_id] if book_id is not None else ['titolo', normalize_title(title)]
+            flight_key = json.dumps([book_key, book_filter.key() if book_filter else None])
+            (payload, status, found_id), _ = await get_singleflight('recommend', AsyncSingleFlight).do(
+                flight_key, lambda: find_recommendations(title, book_filter, book_id))
+        else:
+            payload, status, found_id = await find_recommendations(title, book_filter, book_id)
+        response = jsonify(payload)
+        if found_id is not None:
+            response.headers['X-Book-Id'] = str(found_id)
+        return response, status
+
+    except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+        note_error(e)
+        return jsonify({"error": "Error de base de datos.", "details": str(e)}), 500
+    except Exception as e:
+        note_error(e)
+        return jsonify({"error": "Ha ocurrido un error interno en el servidor.", "details": str(e)}), 500
+
+# Español: La caché de análisis es SQLite local: se consulta en un hilo.
+# English: The analysis cache is local SQLite: it's queried in a thread.
+async def cached_analyses_for(cache_key, recommendations):
+    try:
+        cached_analyses = await asyncio.to_thread(get_analysis_cache().get, cache_key)
+    except Exception as e:
+        print(f"Error al leer la caché de análisis: {e}")
+        return None
+    if cached_analyses is not None and len(cached_analyses) == len(recommendations):
+        return cached_analyses
+    return None
+
+# Español: Sinopsis y llamada a Gemini; devuelve (estado, análisis) como generate_analyses en app.py.
+# English: Synopsis and Gemini call; returns (status, analyses) like generate_analyses in app.py.
+async def generate_analyses(original_title, recommendations, cache_key, book_id=None):
+    # Español: La conexión se devuelve antes de llamar a Gemini: no la necesitamos durante la espera.
+    # English: The connection is released before calling Gemini: we don't need it while waiting.
+    conn = await get_db_connection()
+    try:
+        with timed('title_lookup'):
+            if book_id is not None:
+                original_synopsis = await conn.fetchval("SELECT synopsis FROM books WHERE id = $1", book_id)
+            else:
+                original_synopsis = await conn.fetchval(
+                    "SELECT synopsis FROM books WHERE titolo_key = $1 ORDER BY id LIMIT 1",
+                    normalize_title(original_title))
+            # Español: Las sinopsis de las recomendaciones salen de `books`, no de la petición.
+            # English: The recommendations' synopses come from `books`, not from the request.
+            ids = recommendation_ids(recommendations)
+            rows = await conn.fetch("SELECT id, titolo, synopsis FROM books WHERE id = ANY($1::bigint[])", ids) if ids else []
+    finally:
+        await release_db_connection(conn)
+
+    if original_synopsis is None:
+        return 404, {"error": f"Libro original con título '{original_title}' no encontrado."}
+    stored = {row['id']: (row['titolo'], row['synopsis']) for row in rows}
+    missing = sorted(set(ids) - set(stored))
+    if missing:
+        return 404, {"error": f"Libros recomendados no encontrados: {', '.join(map(str, missing))}."}
+
+    prompt = build_deep_dive_prompt(original_title, original_synopsis, prompt_recommendations(recommendations, stored))
+    with timed('gemini'):
+        response = await (await gemini_model()).generate_content_async(prompt)
+
+    analyses = [analysis.strip() for analysis in response.text.split('|||')]
+    if len(analyses) != len(recommendations):
+        DEEP_DIVE_MISMATCHES.inc(route='/api/deep_dive')
+        print(f"Error: El número de análisis ({len(analyses)}) no coincide con el número de recomendaciones ({len(recommendations)}).")
+        return 200, []
+    if cache_key is not None:
+        try:
+            await asyncio.to_thread(get_analysis_cache().put, cache_key, original_title, analyses)
+        except Exception as e:
+            print(f"Error al guardar en la caché de análisis: {e}")
+    return 200, analyses
+
+@app.route('/api/deep_dive', methods=['POST'])
+@firebase_auth_required
+async def deep_dive():
+    try:
+        data = await request.get_json()
+        if not data or 'titolo' not in data or 'recommendations' not in data:
+            return jsonify({"error": "Los campos 'titolo' y 'recommendations' son requeridos."}), 400
+
+        original_title = data['titolo']
+        recommendations = data['recommendations']
+        try:
+            book_id = None if data.get('book_id') is None else int(data['book_id'])
+        except (TypeError, ValueError):
+            return jsonify({"error": "El campo 'book_id' debe ser un número entero."}), 400
+        try:
+            recommendation_ids(recommendations)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        cache_key = None
+        if analysis_cache_enabled():
+            cache_key = analysis_key(original_title, recommendations, GEMINI_MODEL_NAME, DEEP_DIVE_PROMPT_VERSION, book_id)
+            cached_analyses = await cached_analyses_for(cache_key, recommendations)
+            if cached_analyses is not None:
+                return jsonify({"analysis": {
+                    rec['titolo']: analysis for rec, analysis in zip(recommendations, cached_analyses)
+                }})
+
+        # Español: Las peticiones idénticas simultáneas comparten una sola llamada a Gemini (ver singleflight.py).
+        # English: Identical concurrent requests share a single Gemini call (see singleflight.py).
+        if singleflight_enabled():
+            flight_key = cache_key or analysis_key(original_title, recommendations, GEMINI_MODEL_NAME,
+                                                   DEEP_DIVE_PROMPT_VERSION, book_id)
+            shared_lookup = None
+            if cache_key is not None:
+                async def shared_lookup():
+                    cached_analyses = await cached_analyses_for(cache_key, recommendations)
+                    return None if cached_analyses is None else (200, cached_analyses)
+            (status, analyses), _ = await get_singleflight('deep_dive', AsyncSingleFlight).do(
+                flight_key, lambda: generate_analyses(original_title, recommendations, cache_key, book_id),
+                shared_lookup)
+        else:
+            status, analyses = await generate_analyses(original_title, recommendations, cache_key, book_id)
+
+        if status != 200:
+            return jsonify(analyses), status
+        return jsonify({"analysis": {rec['titolo']: analysis for rec, analysis in zip(recommendations, analyses)}})
+
+    except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+        note_error(e)
+        return jsonify({"error": "Error de base de datos.", "details": str(e)}), 500
+    except Exception as e:
+        note_error(e)
+        return jsonify({"error": "Ha ocurrido un error interno en el servidor.", "details": str(e)}), 500
+
+SEARCH_MAX_K = int(os.getenv("SEARCH_MAX_K", "50"))
+SEARCH_MAX_QUERY_LENGTH = int(os.getenv("SEARCH_MAX_QUERY_LENGTH", "500"))
+
+# Español: Búsqueda semántica de texto libre, como en app.py. El micro-lote se espera sin bloquear
+# el bucle de eventos.
+# English: Free-text semantic search, like in app.py. The micro-batch is awaited without blocking
+# the event loop.
+@app.route('/api/search', methods=['POST'])
+@firebase_auth_required
+async def search():
+    try:
+        data = await request.get_json(silent=True)
+        query = data.get('query') if isinstance(data, dict) else None
+        if not isinstance(query, str) or not query.strip():
+            return jsonify({"error": "El campo 'query' es requerido en el JSON."}), 400
+        if len(query) > SEARCH_MAX_QUERY_LENGTH:
+            return jsonify({"error": f"La consulta puede tener como máximo {SEARCH_MAX_QUERY_LENGTH} caracteres."}), 400
+        try:
+            k = max(1, min(int(data.get('k', 10)), SEARCH_MAX_K))
+        except (TypeError, ValueError):
+            return jsonify({"error": "El campo 'k' debe ser un número entero."}), 400
+        try:
+            book_filter = BookFilter.from_json(data.get('filters'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if not semantic_search_enabled():
+            return jsonify({"error": "La búsqueda semántica no está activada."}), 503
+
+        with timed('query_encode'):
+            try:
+                query_vector = await get_query_encoder().encode_async(query)
+            except Exception as e:
+                note_error(e)
+                return jsonify({"error": "El codificador de consultas no está disponible.", "details": str(e)}), 503
+
+        vector = format_vectors([query_vector])[0]
+        conn = await get_db_connection()
+        try:
+            with timed('vector_query'):
+                if book_filter is not None:
+                    where, params = book_filter.sql(lambda index: f"${index}", start=2)
+                    async with conn.transaction():
+                        await enable_iterative_scan(conn)
+                        rows = await conn.fetch(FILTERED_SEARCH_QUERY.format(where=where), vector, k, *params)
+                elif halfvec_storage_enabled():
+                    rows = await conn.fetch(HALFVEC_SEARCH_QUERY, vector, k, max(ANN_RESCORE_CANDIDATES, k))
+                else:
+                    rows = await conn.fetch(SEARCH_QUERY, vector, k)
+        finally:
+            await release_db_connection(conn)
+        return jsonify([dict(row) for row in rows]), 200
+
+    except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+        note_error(e)
+        return jsonify({"error": "Error de base de datos.", "details": str(e)}), 500
+    except Exception as e:
+        note_error(e)
+        return jsonify({"error": "Ha ocurrido un error interno en el servidor.", "details": str(e)}), 500
+
+@app.route('/api/suggest_titles', methods=['GET'])
+async def suggest_titles():
+    conn = None
+    try:
+        search_query = request.args.get('query', '')
+        if not search_query:
+            return jsonify([])
+
+        if title_index_enabled():
+            if title_index.refresh_due():
+                conn = await get_db_connection()
+                await title_index.maybe_refresh(conn)
+            with timed('title_lookup'):
+                suggestions = title_index.search(search_query, limit=10)
+            return jsonify(suggestions), 200
+
+        conn = await get_db_connection()
+        with timed('title_lookup'):
+            rows = await conn.fetch(
+                "SELECT DISTINCT titolo FROM books WHERE TRIM(titolo) ILIKE $1 ORDER BY titolo LIMIT 10",
+                f"%{search_query.strip()}%")
+        return jsonify([row['titolo'] for row in rows]), 200
+
+    except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+        note_error(e)
+        return jsonify({"error": "Error de base de datos.", "details": str(e)}), 500
+    except Exception as e:
+        note_error(e)
+        return jsonify({"error": "Ha ocurrido un error interno en el servidor.", "details": str(e)}), 500
+    finally:
+        if conn is not None:
+            await release_db_connection(conn)
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    metrics_token = os.getenv("METRICS_TOKEN")
+    if metrics_token and request.headers.get('Authorization') != f"Bearer {metrics_token}":
+        return jsonify({"error": "Unauthorized."}), 401
+    pool = getattr(app, 'db_pool', None)
+    snapshots = [
+        ("db_pool", {"size": pool.get_size(), "idle": pool.get_idle_size(),
+                     "max_size": pool.get_max_size()} if pool is not None else {}, set()),
+        ("auth_token_cache", get_token_cache().stats(), {"hits", "misses", "expired", "evictions"}),
+    ]
+    for name in ('recommend', 'deep_dive'):
+        snapshots.append((f"singleflight_{name}", get_singleflight(name, AsyncSingleFlight).stats(),
+                          {"executions", "coalesced", "coalesced_cross_worker"}))
+    if semantic_search_enabled():
+        query_encoder = get_query_encoder()
+        snapshots.append(("query_encoder", query_encoder.stats(),
+                          {"batches", "queries", "encoded", "errors", "encode_seconds"}))
+        snapshots.append(("query_cache", query_encoder.cache.stats(), {"hits", "misses", "evictions"}))
+    snapshots.append(("startup", startup_stats(), set()))
+    return Response(REGISTRY.render(snapshots), mimetype='text/plain; version=0.0.4')
+
+record_startup("app_import", time.perf_counter() - APP_IMPORT_START)
+log_startup("startup")
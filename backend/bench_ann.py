@@ -0,0 +1,177 @@
+# Español: Banco de pruebas del índice ANN de pgvector. Crea una tabla sintética con vectores
+# agrupados (parecidos a embeddings reales), construye cada configuración de índice y mide el
+# tiempo de construcción, la latencia p50/p99 de la consulta de /api/recomend y el recall@k
+# frente a la búsqueda exacta calculada con NumPy.
+# English: pgvector ANN index benchmark. Creates a synthetic table of clustered vectors (similar
+# to real embeddings), builds each index configuration and measures build time, p50/p99 latency
+# of /api/recomend's query and recall@k against exact search computed with NumPy.
+#
+#   python bench_ann.py --sizes 10000,100000,1000000 --queries 200
+import argparse
+import io
+import json
+import os
+import time
+
+import numpy as np
+import psycopg2
+from dotenv import load_dotenv
+
+from ann_index import apply_search_settings, index_ddl
+from bulk_load import format_vectors
+from vector_engine import normalize_rows, top_k_indices
+
+TABLE = "bench_vectors"
+INDEX_NAME = "bench_vectors_ann"
+
+
+# Español: Mezcla de gaussianas normalizada: los embeddings de sinopsis no son uniformes, y con
+# datos uniformes el recall de los índices aproximados sale engañosamente bajo.
+# English: Normalized Gaussian mixture: synopsis embeddings are not uniform, and with uniform data
+# the recall of approximate indexes comes out misleadingly low.
+def synthetic_vectors(rows, dimension, clusters, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=rows)
+    vectors = centers[labels] + 0.35 * rng.standard_normal((rows, dimension)).astype(np.float32)
+    return normalize_rows(vectors)
+
+
+def load_table(conn, vectors, block_size=20000):
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        cur.execute(f"CREATE TABLE {TABLE} (id BIGINT PRIMARY KEY, embedding vector({vectors.shape[1]}))")
+        for start in range(0, len(vectors), block_size):
+            lines = format_vectors(vectors[start:start + block_size])
+            payload = "".join(f"{start + offset}\t{line}\n" for offset, line in enumerate(lines))
+            cur.copy_expert(f"COPY {TABLE} (id, embedding) FROM STDIN", io.StringIO(payload))
+        cur.execute(f"ANALYZE {TABLE}")
+    conn.commit()
+
+
+def build_index(conn, method, **params):
+    with conn.cursor() as cur:
+        cur.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+        start = time.perf_counter()
+        if method != "none":
+            cur.execute(index_ddl(method, table=TABLE, index_name=INDEX_NAME, **params))
+        conn.commit()
+    return time.perf_counter() - start
+
+
+def run_queries(conn, vectors, query_ids, k, search_settings):
+    apply_search_settings(conn, search_settings)
+    query_text = format_vectors(vectors[query_ids])
+    results, latencies = [], []
+    with conn.cursor() as cur:
+        for query_id, vector in zip(query_ids, query_text):
+            start = time.perf_counter()
+            cur.execute(f"SELECT id FROM {TABLE} WHERE id != %s ORDER BY embedding <=> %s::vector LIMIT %s",
+                        (int(query_id), vector, k))
+            rows = cur.fetchall()
+            latencies.append((time.perf_counter() - start) * 1000)
+            results.append([row[0] for row in rows])
+    conn.rollback()
+    return results, np.array(latencies)
+
+
+# Español: Vecinos exactos con NumPy, excluyendo el propio vector igual que la consulta SQL.
+# English: Exact neighbours with NumPy, excluding the vector itself just like the SQL query.
+def ground_truth(vectors, query_ids, k):
+    truth = []
+    for query_id in query_ids:
+        scores = vectors @ vectors[query_id]
+        scores[query_id] = -np.inf
+        truth.append(set(top_k_indices(scores, k).tolist()))
+    return truth
+
+
+def recall(results, truth, k):
+    return float(np.mean([len(truth_ids.intersection(got)) / k for got, truth_ids in zip(results, truth)]))
+
+
+def configurations(args, rows):
+    yield "none", {}, [{}]
+    for m in args.hnsw_m:
+        for ef_construction in args.hnsw_ef_construction:
+            yield "hnsw", {"m": m, "ef_construction": ef_construction}, \
+                [{"hnsw.ef_search": ef} for ef in args.ef_search]
+    for lists in args.ivfflat_lists or [None]:
+        yield "ivfflat", {"lists": lists, "rows": rows}, [{"ivfflat.probes": probes} for probes in args.probes]
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mide recall y latencia de los índices ANN de pgvector.")
+    parser.add_argument("--sizes", type=_int_list, default=[10000, 100000, 1000000])
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--hnsw-m", type=_int_list, default=[16])
+    parser.add_argument("--hnsw-ef-construction", type=_int_list, default=[64])
+    parser.add_argument("--ef-search", type=_int_list, default=[20, 40, 100])
+    parser.add_argument("--ivfflat-lists", type=_int_list, default=[])
+    parser.add_argument("--probes", type=_int_list, default=[1, 10, 20])
+    parser.add_argument("--output", default=None, help="Fichero JSON lines con los resultados.")
+    parser.add_argument("--keep-table", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    load_dotenv()
+    database_url = os.getenv("BENCH_DATABASE_URL") or os.getenv("DATABASE_URL")
+    if not database_url:
+        raise ValueError("Configura BENCH_DATABASE_URL (o DATABASE_URL) para el banco de pruebas.")
+    conn = psycopg2.connect(database_url)
+    output = open(args.output, "w", encoding="utf-8") if args.output else None
+    results_table = []
+
+    try:
+        for rows in args.sizes:
+            print(f"Generando y cargando {rows} vectores de dimensión {args.dimension}...")
+            vectors = synthetic_vectors(rows, args.dimension, args.clusters, args.seed)
+            load_table(conn, vectors)
+            rng = np.random.default_rng(args.seed + 1)
+            query_ids = rng.choice(rows, size=min(args.queries, rows), replace=False)
+            truth = ground_truth(vectors, query_ids, args.k)
+
+            for method, params, search_grid in configurations(args, rows):
+                build_seconds = build_index(conn, method, **params)
+                for search_settings in search_grid:
+                    got, latencies = run_queries(conn, vectors, query_ids, args.k, search_settings)
+                    result = {
+                        "rows": rows,
+                        "method": method,
+                        **{key: value for key, value in params.items() if key != "rows"},
+                        **search_settings,
+                        "build_seconds": round(build_seconds, 3),
+                        f"recall@{args.k}": round(recall(got, truth, args.k), 4),
+                        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+                    }
+                    results_table.append(result)
+                    print(json.dumps(result))
+                    if output:
+                        output.write(json.dumps(result) + "\n")
+                        output.flush()
+
+            if not args.keep_table:
+                with conn.cursor() as cur:
+                    cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+                conn.commit()
+    finally:
+        if output:
+            output.close()
+        conn.close()
+
+    print()
+    print(f"{'filas':>9} {'método':<8} {'parámetros':<34} {'build s':>8} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for result in results_table:
+        params = ", ".join(f"{key}={value}" for key, value in result.items()
+                           if key not in ("rows", "method", "build_seconds", "p50_ms", "p99_ms")
+                           and not key.startswith("recall"))
+        print(f"{result['rows']:>9} {result['method']:<8} {params:<34} {result['build_seconds']:>8.2f} "
+              f"{result[f'recall@{args.k}']:>7.3f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}")
@@ -0,0 +1,143 @@
+# Español: Compara el despliegue síncrono actual (gunicorn con workers sync, app.py) con el modo
+# asíncrono (uvicorn, asgi_app.py) con el mismo número de procesos, la misma base de datos y los
+# mismos sustitutos de Firebase y Gemini de bench_load.py. Además de cada ruta por separado, mide
+# el escenario que motivó el modo asíncrono: muchos deep_dive en vuelo a la vez que usuarios
+# escribiendo en el autocompletado.
+# English: Compares the current sync deployment (gunicorn with sync workers, app.py) with the
+# async mode (uvicorn, asgi_app.py) with the same number of processes, the same database and the
+# same Firebase and Gemini stand-ins from bench_load.py. Besides each route on its own, it measures
+# the scenario that motivated the async mode: many deep_dives in flight while users are typing in
+# the autocomplete.
+#
+#   BENCH_DATABASE_URL=postgresql://localhost/bench python bench_async.py --workers 2 \
+#       --gemini-latency-ms 2000 --deep-dive-clients 64 --output async_vs_sync.jsonl
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+from bench_load import ROUTES, run_level, seed_database
+
+SERVERS = {
+    "sync": lambda workers, port: [sys.executable, "-m", "gunicorn", "-w", str(workers),
+                                   "-b", f"127.0.0.1:{port}", "--log-level", "warning",
+                                   "bench_load:create_app()"],
+    "async": lambda workers, port: [sys.executable, "-m", "uvicorn", "--factory", "bench_load:create_async_app",
+                                    "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port),
+                                    "--log-level", "warning"],
+}
+
+
+def start_server(mode, workers, port, env):
+    process = subprocess.Popen(SERVERS[mode](workers, port), cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"El servidor '{mode}' terminó al arrancar (código {process.returncode}).")
+        try:
+            with urllib.request.urlopen(f"{base_url}/api/suggest_titles?query=", timeout=1):
+                return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"El servidor '{mode}' no respondió en 60s.")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# Español: deep_dive y suggest_titles a la vez; lo que importa es la latencia del autocompletado.
+# English: deep_dive and suggest_titles at the same time; what matters is autocomplete latency.
+def run_mixed(base_url, deep_dive_clients, suggest_clients, duration, rows, warmup):
+    results = {}
+
+    def run(route, concurrency):
+        results[route] = run_level(base_url, route, concurrency, duration, rows, warmup=warmup)
+
+    threads = [threading.Thread(target=run, args=("deep_dive", deep_dive_clients)),
+               threading.Thread(target=run, args=("suggest_titles", suggest_clients))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [results["deep_dive"], results["suggest_titles"]]
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Compara el modo síncrono (gunicorn) con el asíncrono (ASGI).")
+    parser.add_argument("--modes", default="sync,async")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--routes", default=",".join(ROUTES))
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 8, 32])
+    parser.add_argument("--deep-dive-clients", type=int, default=32)
+    parser.add_argument("--suggest-clients", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--seed-rows", type=int, default=10000)
+    parser.add_argument("--skip-seed", action="store_true")
+    parser.add_argument("--auth-latency-ms", type=float, default=20.0)
+    parser.add_argument("--gemini-latency-ms", type=float, default=1500.0)
+    parser.add_argument("--port", type=int, default=5077)
+    parser.add_argument("--output", default=None, help="Fichero JSON lines con los resultados.")
+    args = parser.parse_args()
+
+    load_dotenv()
+    database_url = os.getenv("BENCH_DATABASE_URL")
+    if not database_url:
+        raise ValueError("Configura BENCH_DATABASE_URL con una base de datos de pruebas.")
+    if not args.skip_seed:
+        seed_database(database_url, args.seed_rows)
+
+    env = dict(os.environ, DATABASE_URL=database_url, ANALYSIS_CACHE="off", REQUEST_TIMING_LOG="off",
+               BENCH_AUTH_LATENCY_MS=str(args.auth_latency_ms), BENCH_GEMINI_LATENCY_MS=str(args.gemini_latency_ms))
+    routes = [route.strip() for route in args.routes.split(",") if route.strip()]
+    output = open(args.output, "w", encoding="utf-8") if args.output else None
+    results = []
+
+    def emit(result):
+        results.append(result)
+        print(json.dumps(result))
+        if output:
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+
+    try:
+        for mode in [mode.strip() for mode in args.modes.split(",") if mode.strip()]:
+            process, base_url = start_server(mode, args.workers, args.port, env)
+            try:
+                for route in routes:
+                    for concurrency in args.concurrency:
+                        result = run_level(base_url, route, concurrency, args.duration, args.seed_rows,
+                                           warmup=args.warmup)
+                        emit({"mode": mode, "workers": args.workers, "scenario": "single", **result})
+                for result in run_mixed(base_url, args.deep_dive_clients, args.suggest_clients,
+                                        args.duration, args.seed_rows, args.warmup):
+                    emit({"mode": mode, "workers": args.workers, "scenario": "mixed", **result})
+            finally:
+                stop_server(process)
+    finally:
+        if output:
+            output.close()
+
+    print()
+    print(f"{'modo':<6} {'escenario':<8} {'ruta':<16} {'conc':>5} {'req/s':>9} {'errores':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for result in results:
+        print(f"{result['mode']:<6} {result['scenario']:<8} {result['route']:<16} {result['concurrency']:>5} "
+              f"{result['throughput_rps']:>9.2f} {result['errors']:>8} {result['p50_ms'] or 0:>9.2f} "
+              f"{result['p95_ms'] or 0:>9.2f} {result['p99_ms'] or 0:>9.2f}")
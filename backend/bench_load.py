@@ -0,0 +1,377 @@
+# Español: Prueba de carga de extremo a extremo de app.py. Siembra un PostgreSQL local con libros
+# y embeddings sintéticos, arranca la aplicación con sustitutos de Firebase y Gemini de latencia
+# configurable (así no hacen falta credenciales ni cuota) y lanza /api/recomend, /api/deep_dive y
+# /api/suggest_titles a distintos niveles de concurrencia. Por cada ruta y nivel escribe una línea
+# JSON con el rendimiento y los percentiles p50/p95/p99, para comparar una ejecución con otra.
+# English: End-to-end load test for app.py. Seeds a local PostgreSQL with synthetic books and
+# embeddings, starts the application with configurable-latency stand-ins for Firebase and Gemini
+# (so no credentials or quota are needed) and drives /api/recomend, /api/deep_dive and
+# /api/suggest_titles at several concurrency levels. For every route and level it writes a JSON
+# line with throughput and p50/p95/p99, so one run can be compared with another.
+#
+#   BENCH_DATABASE_URL=postgresql://localhost/bench python bench_load.py --seed-rows 20000 \
+#       --concurrency 1,8,32 --duration 20 --output resultados.jsonl
+#
+# Español: Para medir con gunicorn (como en producción) se usa la fábrica `create_app()`:
+# English: To measure under gunicorn (as in production) use the `create_app()` factory:
+#
+#   BENCH_AUTH_LATENCY_MS=30 BENCH_GEMINI_LATENCY_MS=1500 DATABASE_URL=... \
+#       gunicorn -w 4 -b 127.0.0.1:5055 "bench_load:create_app()"
+#   python bench_load.py --url http://127.0.0.1:5055 --skip-seed
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+import numpy as np
+
+from streaming import DELIMITER
+
+BENCH_EMAIL = "bench@example.com"
+ROUTES = ("recomend", "deep_dive", "suggest_titles")
+
+
+# Español: Títulos y sinopsis deterministas: el cliente los reconstruye sin consultar la base de
+# datos. El número con ceros a la izquierda hace que cada título solo coincida consigo mismo en la
+# búsqueda de títulos de /api/recomend, también en la de subcadena.
+# English: Deterministic titles and synopses: the client rebuilds them without querying the
+# database. The zero-padded number makes each title only match itself in /api/recomend's title
+# lookup, the substring one included.
+def book_title(book_id):
+    return f"Libro sintetico {book_id:07d}"
+
+
+def book_synopsis(book_id):
+    return f"Sinossi sintetica del libro {book_id}: una storia di prova per il banco di carico."
+
+
+# --- Sustitutos de Firebase y Gemini ---
+# --- Firebase and Gemini stand-ins ---
+
+class FakeGeminiResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiModel:
+    # Español: Responde con un análisis por recomendación del prompt, separados por '|||', tras
+    # `latency` segundos. Con stream=True reparte esa latencia entre los trozos. La variante
+    # asíncrona (la que usa asgi_app.py) espera sin bloquear el bucle de eventos.
+    # English: Answers with one analysis per recommendation in the prompt, separated by '|||',
+    # after `latency` seconds. With stream=True that latency is spread across the chunks. The async
+    # variant (the one asgi_app.py uses) waits without blocking the event loop.
+    def __init__(self, latency, chunks=4):
+        self.latency = latency
+        self.chunks = chunks
+
+    def generate_content(self, prompt, stream=False):
+        count = prompt.count(" - Titolo: ")
+        text = DELIMITER.join(f"Analisi sintetica numero {i + 1}." for i in range(count))
+        if not stream:
+            time.sleep(self.latency)
+            return FakeGeminiResponse(text)
+        return self._stream(text)
+
+    async def generate_content_async(self, prompt, stream=False):
+        count = prompt.count(" - Titolo: ")
+        await asyncio.sleep(self.latency)
+        return FakeGeminiResponse(DELIMITER.join(f"Analisi sintetica numero {i + 1}." for i in range(count)))
+
+    def _stream(self, text):
+        size = max(1, -(-len(text) // self.chunks))
+        for start in range(0, len(text), size):
+            time.sleep(self.latency / self.chunks)
+            yield FakeGeminiResponse(text[start:start + size])
+
+
+def install_stand_ins(auth_latency, gemini_latency):
+    import firebase_admin
+    import google.generativeai as genai
+    from firebase_admin import auth, credentials
+
+    import token_cache
+
+    def verify_id_token(id_token, *args, **kwargs):
+        time.sleep(auth_latency)
+        return {"email": BENCH_EMAIL, "uid": id_token, "exp": time.time() + 3600}
+
+    credentials.Certificate = lambda path: None
+    firebase_admin.initialize_app = lambda *args, **kwargs: None
+    auth.verify_id_token = verify_id_token
+    token_cache.ensure_public_keys_warm = lambda: None
+    genai.configure = lambda *args, **kwargs: None
+    genai.GenerativeModel = lambda *args, **kwargs: FakeGeminiModel(gemini_latency)
+
+    emails = {email for email in os.getenv("AUTHORIZED_EMAILS", "").split(",") if email.strip()}
+    os.environ["AUTHORIZED_EMAILS"] = ",".join(emails | {BENCH_EMAIL})
+
+
+# Español: Importa app.py con los sustitutos ya instalados (app crea el modelo de Gemini e
+# inicializa Firebase al importarse). Sirve también como fábrica para gunicorn.
+# English: Imports app.py with the stand-ins already installed (app creates the Gemini model and
+# initializes Firebase on import). Also works as a gunicorn factory.
+def create_app():
+    install_stand_ins(float(os.getenv("BENCH_AUTH_LATENCY_MS", "20")) / 1000,
+                      float(os.getenv("BENCH_GEMINI_LATENCY_MS", "800")) / 1000)
+    import app as app_module
+
+    return app_module.app
+
+
+# Español: Lo mismo para el modo asíncrono: `uvicorn --factory bench_load:create_async_app`.
+# English: The same for the async mode: `uvicorn --factory bench_load:create_async_app`.
+def create_async_app():
+    install_stand_ins(float(os.getenv("BENCH_AUTH_LATENCY_MS", "20")) / 1000,
+                      float(os.getenv("BENCH_GEMINI_LATENCY_MS", "800")) / 1000)
+    import asgi_app
+
+    return asgi_app.app
+
+
+# --- Datos sintéticos ---
+# --- Synthetic data ---
+
+BOOKS_DDL = """
+    CREATE TABLE IF NOT EXISTS books (
+        id INTEGER PRIMARY KEY,
+        titolo TEXT,
+        autore TEXT,
+        anno INTEGER,
+        synopsis TEXT,
+        collocazione TEXT,
+        embedding vector(%(dimension)s),
+        row_hash TEXT,
+        titolo_key TEXT
+    )
+"""
+
+
+# Español: Vacía y vuelve a llenar books con `rows` libros sintéticos, igual que populate_db
+# (COPY, vecinos precalculados, índice ANN y nueva versión del catálogo).
+# English: Empties and refills books with `rows` synthetic books, just like populate_db (COPY,
+# precomputed neighbours, ANN index and a new catalog version).
+def seed_database(database_url, rows, dimension=384, seed=42):
+    import pandas as pd
+    import psycopg2
+
+    from ann_index import drop_ann_index, ensure_ann_index
+    from bench_ann import synthetic_vectors
+    from bulk_load import bulk_load_books
+    from catalog_version import bump_catalog_version
+    from neighbors import rebuild_neighbors
+    from title_index import TITLE_KEY_DDL, TITLE_KEY_INDEX_DDL
+
+    rng = random.Random(seed)
+    ids = np.arange(1, rows + 1)
+    df = pd.DataFrame({
+        "id": ids,
+        "titolo": [book_title(book_id) for book_id in ids],
+        "autore": [f"Autore {rng.randrange(max(1, rows // 10))}" for _ in ids],
+        "anno": [rng.randrange(1900, 2025) for _ in ids],
+        "synopsis": [book_synopsis(book_id) for book_id in ids],
+        "collocazione": [f"SCAFFALE {rng.randrange(50)}" for _ in ids],
+    })
+    embeddings = synthetic_vectors(rows, dimension, clusters=max(1, rows // 100), seed=seed)
+
+    conn = psycopg2.connect(database_url)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            cur.execute(BOOKS_DDL, {"dimension": dimension})
+            cur.execute(TITLE_KEY_DDL)
+            cur.execute("TRUNCATE TABLE books RESTART IDENTITY CASCADE;")
+            drop_ann_index(cur)
+            loaded, report = bulk_load_books(cur, df, embeddings, verbose=False)
+            print(report.summary())
+            ensure_ann_index(cur)
+            cur.execute(TITLE_KEY_INDEX_DDL)
+            rebuild_neighbors(cur, ids[loaded], embeddings[loaded], k=int(os.getenv("NEIGHBORS_K", "20")))
+            version = bump_catalog_version(cur)
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"Base de datos sembrada con {rows} libros (versión del catálogo {version}).")
+
+
+# --- Generador de carga ---
+# --- Load generator ---
+
+def build_request(route, rows, rng):
+    book_id = rng.randrange(1, rows + 1)
+    if route == "recomend":
+        return "POST", "/api/recomend", {"titolo": book_title(book_id)}
+    if route == "deep_dive":
+        others = rng.sample(range(1, rows + 1), min(5, rows))
+        return "POST", "/api/deep_dive", {
+            "titolo": book_title(book_id),
+            "recommendations": [{"titolo": book_title(other), "synopsis": book_synopsis(other)} for other in others],
+        }
+    if route == "suggest_titles":
+        prefix = book_title(book_id)[:rng.randrange(18, 23)]
+        return "GET", f"/api/suggest_titles?query={quote(prefix)}", None
+    raise ValueError(f"Ruta desconocida: '{route}'.")
+
+
+def percentile(latencies, q):
+    return round(float(np.percentile(latencies, q)), 3) if len(latencies) else None
+
+
+# Español: Mantiene `concurrency` clientes (cada uno con su conexión keep-alive) lanzando
+# peticiones durante `duration` segundos. Cada cliente usa su propio token, como un usuario real;
+# con unique_tokens cada petición usa uno nuevo y siempre pasa por verify_id_token.
+# English: Keeps `concurrency` clients (each with its own keep-alive connection) firing requests
+# for `duration` seconds. Each client uses its own token, like a real user; with unique_tokens
+# every request uses a new one and always goes through verify_id_token.
+def run_level(base_url, route, concurrency, duration, rows, warmup=2.0, unique_tokens=False, seed=0):
+    url = urlsplit(base_url)
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    start_at = time.perf_counter() + warmup
+    stop_at = start_at + duration
+
+    def client(worker):
+        rng = random.Random(seed * 1000 + worker)
+        conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+        local_latencies, local_statuses = [], {}
+        sent = 0
+        try:
+            while True:
+                now = time.perf_counter()
+                if now >= stop_at:
+                    break
+                method, path, body = build_request(route, rows, rng)
+                token = f"bench-{worker}-{sent}" if unique_tokens else f"bench-{worker}"
+                headers = {"Authorization": f"Bearer {token}"}
+                payload = None
+                if body is not None:
+                    payload = json.dumps(body)
+                    headers["Content-Type"] = "application/json"
+                sent += 1
+                begin = time.perf_counter()
+                try:
+                    conn.request(method, path, body=payload, headers=headers)
+                    response = conn.getresponse()
+                    response.read()
+                    status = response.status
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+                    status = "error"
+                elapsed = (time.perf_counter() - begin) * 1000
+                if begin >= start_at:
+                    local_latencies.append(elapsed)
+                    local_statuses[status] = local_statuses.get(status, 0) + 1
+        finally:
+            conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(concurrency)))
+
+    ok = sum(count for status, count in statuses.items() if status != "error" and status < 400)
+    return {
+        "route": route,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(latencies) - ok,
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        "seconds": duration,
+        "throughput_rps": round(ok / duration, 2),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def start_local_server(port):
+    import logging
+
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    server = make_server("127.0.0.1", port, create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Prueba de carga de las rutas de app.py con Firebase y Gemini simulados.")
+    parser.add_argument("--routes", default=",".join(ROUTES))
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 4, 16])
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--seed-rows", type=int, default=10000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--skip-seed", action="store_true", help="No vuelve a sembrar la base de datos.")
+    parser.add_argument("--auth-latency-ms", type=float, default=20.0)
+    parser.add_argument("--gemini-latency-ms", type=float, default=800.0)
+    parser.add_argument("--unique-tokens", action="store_true")
+    parser.add_argument("--url", default=None, help="Servidor ya arrancado (p. ej. gunicorn con create_app()).")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Fichero JSON lines con los resultados.")
+    args = parser.parse_args()
+
+    load_dotenv()
+    # Español: La siembra vacía books, así que solo se hace contra BENCH_DATABASE_URL, nunca contra DATABASE_URL.
+    # English: Seeding empties books, so it only runs against BENCH_DATABASE_URL, never DATABASE_URL.
+    database_url = os.getenv("BENCH_DATABASE_URL")
+    if not database_url and not (args.url and args.skip_seed):
+        raise ValueError("Configura BENCH_DATABASE_URL con una base de datos de pruebas.")
+    if not args.skip_seed:
+        seed_database(database_url, args.seed_rows, args.dimension)
+
+    # Español: Por defecto la caché de análisis se apaga, para medir la ruta completa de deep_dive.
+    # English: By default the analysis cache is turned off, to measure deep_dive's full path.
+    os.environ.setdefault("ANALYSIS_CACHE", "off")
+    os.environ["BENCH_AUTH_LATENCY_MS"] = str(args.auth_latency_ms)
+    os.environ["BENCH_GEMINI_LATENCY_MS"] = str(args.gemini_latency_ms)
+    server = None
+    if args.url:
+        base_url = args.url
+    else:
+        os.environ["DATABASE_URL"] = database_url
+        server, base_url = start_local_server(args.port)
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else None
+    results = []
+    try:
+        for route in [route.strip() for route in args.routes.split(",") if route.strip()]:
+            for concurrency in args.concurrency:
+                result = run_level(base_url, route, concurrency, args.duration, args.seed_rows,
+                                   warmup=args.warmup, unique_tokens=args.unique_tokens)
+                result.update({"auth_latency_ms": args.auth_latency_ms,
+                               "gemini_latency_ms": args.gemini_latency_ms,
+                               "rows": args.seed_rows})
+                results.append(result)
+                print(json.dumps(result))
+                if output:
+                    output.write(json.dumps(result) + "\n")
+                    output.flush()
+    finally:
+        if output:
+            output.close()
+        if server is not None:
+            server.shutdown()
+
+    print()
+    print(f"{'ruta':<16} {'conc':>5} {'peticiones':>10} {'errores':>8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for result in results:
+        print(f"{result['route']:<16} {result['concurrency']:>5} {result['requests']:>10} {result['errors']:>8} "
+              f"{result['throughput_rps']:>9.2f} {result['p50_ms'] or 0:>9.2f} {result['p95_ms'] or 0:>9.2f} "
+              f"{result['p99_ms'] or 0:>9.2f}")
@@ -0,0 +1,154 @@
+# Español: Informe de recall de las representaciones compactas frente a la búsqueda exacta en
+# float32, sobre nuestro catálogo. Para cada libro se calcula su top-k exacto (excluyéndose a sí
+# mismo, como /api/recomend) y se compara con:
+#   - el motor en memoria con float16 e int8, sin reordenar y reordenando k*factor candidatos;
+#   - con --pgvector, la consulta en dos pasos de ANN_STORAGE=halfvec contra la tabla real.
+# También muestra la memoria de cada matriz y el tiempo medio por consulta.
+# English: Recall report of the compact representations against exact float32 search, on our
+# catalog. For every book its exact top-k is computed (excluding itself, like /api/recomend) and
+# compared with:
+#   - the in-memory engine with float16 and int8, without reordering and reordering k*factor candidates;
+#   - with --pgvector, ANN_STORAGE=halfvec's two-step query against the real table.
+# It also shows each matrix's memory and the mean time per query.
+#
+#   python bench_quantization.py --k 5 --factors 1,2,4,8 [--source cache] [--pgvector]
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from quantization import CompactMatrix, rescore
+from vector_engine import normalize_rows, top_k_indices
+
+
+def load_catalog(source, cache_dir):
+    if source == "cache":
+        matrix = np.load(os.path.join(cache_dir, "vectors.npy"))
+        return np.arange(len(matrix)), normalize_rows(matrix.astype(np.float32))
+    import psycopg2
+
+    from vector_engine import load_snapshot
+
+    conn = psycopg2.connect(os.getenv("DATABASE_URL"))
+    try:
+        snapshot = load_snapshot(conn)
+    finally:
+        conn.close()
+    return snapshot.ids, snapshot.matrix
+
+
+def exact_neighbours(matrix, k):
+    truth = []
+    for row in range(len(matrix)):
+        scores = matrix @ matrix[row]
+        scores[row] = -np.inf
+        truth.append(top_k_indices(scores, k))
+    return truth
+
+
+def recall(found, truth, k):
+    return float(np.mean([len(set(got.tolist()) & set(expected.tolist())) / k
+                          for got, expected in zip(found, truth)]))
+
+
+def evaluate_compact(matrix, precision, k, factors, truth):
+    compact = CompactMatrix(matrix, precision)
+    results = []
+    configurations = [("sin reordenar", None)] + [(f"reordenando x{factor}", factor) for factor in factors]
+    for label, factor in configurations:
+        found = []
+        start = time.perf_counter()
+        for row in range(len(matrix)):
+            scores = compact.scores(matrix[row])
+            scores[row] = -np.inf
+            if factor is None:
+                found.append(top_k_indices(scores, k))
+            else:
+                candidates = top_k_indices(scores, min(k * factor, len(matrix) - 1))
+                found.append(rescore(matrix, matrix[row], candidates, k)[0])
+        elapsed = time.perf_counter() - start
+        results.append({
+            "precision": precision,
+            "mode": label,
+            "rescore_factor": factor,
+            f"recall@{k}": round(recall(found, truth, k), 4),
+            "memory_mb": round(compact.nbytes / 1e6, 3),
+            "ms_per_query": round(elapsed / max(len(matrix), 1) * 1000, 4),
+        })
+    return results
+
+
+# Español: Recall de la consulta halfvec en dos pasos de /api/recomend frente a la exacta (sin índice).
+# English: Recall of /api/recomend's two-step halfvec query against the exact one (no index).
+def evaluate_pgvector(k, candidates, dimension, limit=None):
+    import psycopg2
+
+    from ann_index import rescoring_query
+
+    conn = psycopg2.connect(os.getenv("DATABASE_URL"))
+    found, truth, latencies = [], [], []
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, embedding FROM books WHERE embedding IS NOT NULL ORDER BY id")
+            books = cur.fetchall()[:limit]
+            for book_id, vector in books:
+                cur.execute("SET LOCAL enable_indexscan = off")
+                cur.execute("SELECT id FROM books WHERE id != %s ORDER BY embedding <=> %s::vector LIMIT %s",
+                            (book_id, vector, k))
+                truth.append(np.array([row[0] for row in cur.fetchall()]))
+                cur.execute("SET LOCAL enable_indexscan = on")
+                start = time.perf_counter()
+                cur.execute(rescoring_query(dimension), (book_id, vector, candidates, vector, k))
+                found.append(np.array([row[0] for row in cur.fetchall()]))
+                latencies.append((time.perf_counter() - start) * 1000)
+        conn.rollback()
+    finally:
+        conn.close()
+    return {
+        "precision": "halfvec (pgvector)",
+        "mode": f"reordenando {candidates} candidatos",
+        "rescore_factor": candidates / k,
+        f"recall@{k}": round(recall(found, truth, k), 4),
+        "memory_mb": None,
+        "ms_per_query": round(float(np.mean(latencies)), 4) if latencies else None,
+    }
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Recall de float16/int8 frente a la búsqueda exacta en float32.")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--factors", default="1,2,4,8")
+    parser.add_argument("--source", choices=("db", "cache"), default="db")
+    parser.add_argument("--cache-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache"))
+    parser.add_argument("--pgvector", action="store_true", help="Mide también la consulta halfvec en PostgreSQL.")
+    parser.add_argument("--candidates", type=int, default=int(os.getenv("ANN_RESCORE_CANDIDATES", "40")))
+    parser.add_argument("--output", default=None, help="Fichero JSON lines con los resultados.")
+    args = parser.parse_args()
+
+    load_dotenv()
+    factors = [int(factor) for factor in args.factors.split(",") if factor.strip()]
+    ids, matrix = load_catalog(args.source, args.cache_dir)
+    print(f"{len(ids)} libros, dimensión {matrix.shape[1]}, float32: {matrix.nbytes / 1e6:.3f} MB.")
+    truth = exact_neighbours(matrix, args.k)
+
+    results = []
+    for precision in ("float16", "int8"):
+        results.extend(evaluate_compact(matrix, precision, args.k, factors, truth))
+    if args.pgvector:
+        results.append(evaluate_pgvector(args.k, args.candidates, matrix.shape[1]))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            for result in results:
+                output.write(json.dumps(result) + "\n")
+
+    print(f"{'precisión':<20} {'modo':<28} {'recall@' + str(args.k):>9} {'memoria MB':>11} {'ms/consulta':>12}")
+    for result in results:
+        memory = f"{result['memory_mb']:.3f}" if result["memory_mb"] is not None else "-"
+        latency = f"{result['ms_per_query']:.4f}" if result["ms_per_query"] is not None else "-"
+        print(f"{result['precision']:<20} {result['mode']:<28} {result[f'recall@{args.k}']:>9.4f} "
+              f"{memory:>11} {latency:>12}")
@@ -0,0 +1,143 @@
+# Español: Latencia del codificador de /api/search con varios usuarios a la vez. Cada cliente es un
+# hilo que lanza consultas distintas una tras otra contra un QueryEncoder, como harían los hilos
+# de un worker, y se compara:
+#   - sin micro-lotes (cada consulta es una llamada al modelo, de una en una);
+#   - con micro-lotes (las consultas simultáneas comparten una llamada).
+# El modelo se carga una sola vez y se comparte entre ambos modos. Con --repeat-rate una parte de
+# las consultas se repite para medir también la caché LRU. Termina con código 1 si el p99 con
+# micro-lotes supera --target-p99-ms.
+# English: Latency of /api/search's encoder with several users at once. Each client is a thread
+# that fires distinct queries one after another at a QueryEncoder, like a worker's threads would,
+# and it compares:
+#   - without micro-batches (each query is a model call, one at a time);
+#   - with micro-batches (concurrent queries share a call).
+# The model is loaded once and shared by both modes. With --repeat-rate part of the queries are
+# repeated to also measure the LRU cache. Exits with code 1 if the micro-batched p99 exceeds
+# --target-p99-ms.
+#
+#   python bench_query_encoder.py --runtime onnx-int8 --clients 8 --queries-per-client 100
+import argparse
+import json
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+from query_encoder import DEFAULT_ONNX_DIR, RUNTIMES, SAMPLE_QUERIES, QueryEncoder, load_encoder
+
+
+# Español: Consultas distintas y realistas: frases de ejemplo y trozos de sinopsis del catálogo.
+# English: Distinct, realistic queries: sample phrases and synopsis snippets from the catalog.
+def build_queries(count, csv_path, seed=42):
+    rng = random.Random(seed)
+    bases = list(SAMPLE_QUERIES)
+    if csv_path and os.path.exists(csv_path):
+        import pandas as pd
+
+        df = pd.read_csv(csv_path, sep='|', quotechar='"', doublequote=True, on_bad_lines='skip')
+        for synopsis in df['synopsis'].dropna().astype(str):
+            words = synopsis.split()
+            if len(words) >= 6:
+                start = rng.randrange(max(1, len(words) - 12))
+                bases.append(" ".join(words[start:start + rng.randint(4, 12)]))
+    return [f"{bases[i % len(bases)]} {i // len(bases)}" if i >= len(bases) else bases[i] for i in range(count)]
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def run_mode(encoder, queries, clients, per_client, window, max_batch, repeat_rate, cache_size, seed=42):
+    query_encoder = QueryEncoder(window=window, max_batch=max_batch, cache_size=cache_size, encoder=encoder)
+    latencies = [[] for _ in range(clients)]
+    barrier = threading.Barrier(clients + 1)
+
+    def client(index):
+        rng = random.Random(seed + index)
+        mine = queries[index * per_client:(index + 1) * per_client]
+        barrier.wait()
+        for i, query in enumerate(mine):
+            if i and rng.random() < repeat_rate:
+                query = rng.choice(mine[:i])
+            start = time.perf_counter()
+            query_encoder.encode(query)
+            latencies[index].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    all_ms = [latency * 1000 for per_thread in latencies for latency in per_thread]
+    stats = query_encoder.stats()
+    cache = query_encoder.cache.stats()
+    return {
+        "clients": clients,
+        "queries": len(all_ms),
+        "queries_per_second": round(len(all_ms) / seconds, 1),
+        "p50_ms": round(percentile(all_ms, 50), 2),
+        "p95_ms": round(percentile(all_ms, 95), 2),
+        "p99_ms": round(percentile(all_ms, 99), 2),
+        "max_ms": round(max(all_ms), 2),
+        "model_calls": stats["batches"],
+        "mean_batch_size": round(stats["encoded"] / max(stats["batches"], 1), 2),
+        "max_batch_size": stats["max_batch_size"],
+        "cache_hits": cache["hits"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latencia del codificador de consultas con micro-lotes.")
+    parser.add_argument("--runtime", choices=RUNTIMES, default="onnx-int8")
+    parser.add_argument("--model-dir", default=DEFAULT_ONNX_DIR)
+    parser.add_argument("--threads", type=int, default=int(os.getenv("QUERY_ENCODER_THREADS", "2")),
+                        help="Hilos del runtime para cada llamada al modelo.")
+    parser.add_argument("--clients", default="1,4,8,16", help="Usuarios simultáneos (lista separada por comas).")
+    parser.add_argument("--queries-per-client", type=int, default=100)
+    parser.add_argument("--window-ms", type=float, default=float(os.getenv("QUERY_BATCH_WINDOW_MS", "2")))
+    parser.add_argument("--max-batch", type=int, default=int(os.getenv("QUERY_BATCH_MAX", "32")))
+    parser.add_argument("--repeat-rate", type=float, default=0.0,
+                        help="Fracción de consultas que repiten una anterior del mismo cliente (caché).")
+    parser.add_argument("--csv", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                      "catalogo_cuveglio_estructurado.csv"))
+    parser.add_argument("--target-p99-ms", type=float, default=50.0)
+    parser.add_argument("--output", default=None, help="Fichero JSON lines con los resultados.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    encoder = load_encoder(args.runtime, args.model_dir, threads=args.threads)
+    encoder.encode(["warm up"])
+    print(f"Runtime '{encoder.name}' cargado en {time.perf_counter() - start:.2f}s.")
+
+    client_levels = [int(level) for level in args.clients.split(",") if level.strip()]
+    queries = build_queries(max(client_levels) * args.queries_per_client, args.csv)
+    modes = {"sin_lotes": (0.0, 1), "micro_lotes": (args.window_ms / 1000, args.max_batch)}
+    cache_size = 2048 if args.repeat_rate > 0 else 0
+
+    results = []
+    print(f"{'modo':<12} {'clientes':>8} {'consultas/s':>12} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'llamadas':>9} {'lote medio':>10}")
+    for clients in client_levels:
+        for mode, (window, max_batch) in modes.items():
+            result = run_mode(encoder, queries, clients, args.queries_per_client, window, max_batch,
+                              args.repeat_rate, cache_size)
+            result.update(mode=mode, runtime=encoder.name)
+            results.append(result)
+            print(f"{mode:<12} {clients:>8} {result['queries_per_second']:>12.1f} {result['p50_ms']:>8.2f} "
+                  f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['model_calls']:>9} "
+                  f"{result['mean_batch_size']:>10.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            for result in results:
+                output.write(json.dumps(result) + "\n")
+
+    worst = max(result["p99_ms"] for result in results if result["mode"] == "micro_lotes")
+    print(f"\np99 máximo con micro-lotes: {worst:.2f} ms (objetivo {args.target_p99_ms:.0f} ms).")
+    raise SystemExit(0 if worst <= args.target_p99_ms else 1)
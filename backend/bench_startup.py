@@ -0,0 +1,219 @@
+# Español: Arranque en frío de un worker y memoria del catálogo compartido.
+#   1. Arranque: importa app.py en procesos nuevos con SDK_INIT=eager y SDK_INIT=lazy y mide cuánto
+#      tarda en estar listo, cuánto queda aplazado (la carga de los SDK en su primer uso) y la
+#      memoria residente. Usa unas credenciales de Firebase de prueba generadas aquí (no se conecta a
+#      nada) y no necesita base de datos.
+#   2. Memoria: escribe una foto sintética del catálogo y arranca --workers procesos que la usan a la
+#      vez, copiándola cada uno (como al cargar desde la base de datos) o mapeándola
+#      (CATALOG_SNAPSHOT_DIR). Mide RSS y PSS (la parte proporcional de las páginas compartidas) de
+#      cada uno después de recorrer el catálogo entero; la suma de PSS es la memoria física real.
+#      También mide el cambio en caliente a una versión nueva.
+# English: A worker's cold start and the shared catalog's memory.
+#   1. Startup: imports app.py in fresh processes with SDK_INIT=eager and SDK_INIT=lazy and measures
+#      how long it takes to be ready, how much is deferred (loading the SDKs on first use) and the
+#      resident memory. It uses test Firebase credentials generated here (it connects to nothing)
+#      and needs no database.
+#   2. Memory: writes a synthetic catalog snapshot and starts --workers processes that use it at the
+#      same time, each copying it (like loading from the database) or mapping it
+#      (CATALOG_SNAPSHOT_DIR). It measures each one's RSS and PSS (the proportional share of shared
+#      pages) after scanning the whole catalog; the sum of PSS is the real physical memory.
+#      It also measures the hot swap to a new version.
+#
+#   python bench_startup.py --runs 5 --workers 4 --rows 100000
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from catalog_snapshot import write_catalog_snapshot
+from vector_engine import CatalogSnapshot, VectorEngine, map_snapshot, normalize_rows
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STARTUP_CHILD = """
+import json, os, time
+start = time.perf_counter()
+import app
+ready = time.perf_counter() - start
+import sdk_loader
+start = time.perf_counter()
+sdk_loader.get_firebase_auth()
+sdk_loader.get_gemini_model()
+deferred = time.perf_counter() - start
+with open("/proc/self/statm") as statm:
+    rss = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+print("RESULT " + json.dumps({"ready_ms": ready * 1000, "deferred_ms": deferred * 1000, "rss_mb": rss,
+                             "stages_ms": {k: v * 1000 for k, v in sdk_loader.startup_timings().items()}}))
+"""
+
+
+# Español: Una cuenta de servicio de prueba con una clave RSA nueva: basta para inicializar el SDK.
+# English: A test service account with a fresh RSA key: enough to initialize the SDK.
+def fake_credentials(directory):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                            serialization.NoEncryption()).decode("ascii")
+    path = os.path.join(directory, "firebase_credentials.json")
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({
+            "type": "service_account", "project_id": "bench-startup", "private_key_id": "bench",
+            "private_key": pem, "client_email": "bench@bench-startup.iam.gserviceaccount.com",
+            "client_id": "0", "token_uri": "https://oauth2.googleapis.com/token",
+        }, file)
+    return path
+
+
+def measure_startup(mode, runs, credentials_path):
+    env = dict(os.environ, SDK_INIT=mode, FIREBASE_CREDENTIALS_PATH=credentials_path,
+               GEMINI_API_KEY="bench", VECTOR_ENGINE="pgvector", REQUEST_TIMING_LOG="off")
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", STARTUP_CHILD], cwd=BACKEND_DIR, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.rsplit("RESULT ", 1)[1]))
+    return {
+        "mode": mode,
+        "runs": runs,
+        "ready_ms": round(statistics.median(r["ready_ms"] for r in results), 1),
+        "deferred_ms": round(statistics.median(r["deferred_ms"] for r in results), 1),
+        "rss_mb": round(statistics.median(r["rss_mb"] for r in results), 1),
+        "stages_ms": {stage: round(statistics.median(r["stages_ms"].get(stage, 0.0) for r in results), 1)
+                      for stage in results[0]["stages_ms"]},
+    }
+
+
+# --- Memoria del catálogo compartido ---
+# --- Shared catalog memory ---
+
+def synthetic_batches(rows, dimension, seed, batch_size=10000):
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, batch_size):
+        ids = np.arange(start, min(start + batch_size, rows), dtype=np.int64) + 1
+        matrix = normalize_rows(rng.normal(size=(len(ids), dimension)).astype(np.float32))
+        books = [{"id": int(i), "titolo": f"Titolo {i}", "autore": f"Autore {i % 997}",
+                  "synopsis": f"Sinossi sintetica del libro {i}. " * 8, "collocazione": f"SCAFFALE {i % 37}",
+                  "anno": 1900 + int(i) % 120} for i in ids]
+        yield ids, matrix, books
+
+
+def memory_mb():
+    rss = pss = None
+    with open("/proc/self/statm") as statm:
+        rss = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    try:
+        with open("/proc/self/smaps_rollup") as smaps:
+            for line in smaps:
+                if line.startswith("Pss:"):
+                    pss = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return rss, pss
+
+
+def worker(mode, directory, version, queries, barrier, results):
+    baseline_rss, baseline_pss = memory_mb()
+    start = time.perf_counter()
+    snapshot = map_snapshot(directory, version)
+    if mode == "copia":
+        # Español: Lo que hace load_snapshot: la matriz y un dict por libro en la memoria del worker.
+        # English: What load_snapshot does: the matrix and a dict per book in the worker's memory.
+        snapshot = CatalogSnapshot(snapshot.ids.copy(), np.array(snapshot.matrix), list(snapshot.books), version)
+    engine = VectorEngine()
+    engine._state, engine.version = snapshot, version
+    load_seconds = time.perf_counter() - start
+    for query in queries:
+        engine.top_k(query, k=10)
+    barrier.wait()
+    rss, pss = memory_mb()
+    results.put({"mode": mode, "load_ms": load_seconds * 1000, "rss_mb": rss - baseline_rss,
+                 "pss_mb": None if pss is None else pss - baseline_pss})
+    barrier.wait()
+
+
+def measure_memory(mode, workers, directory, version, dimension):
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    queries = normalize_rows(np.random.default_rng(7).normal(size=(5, dimension)).astype(np.float32))
+    processes = [context.Process(target=worker, args=(mode, directory, version, queries, barrier, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    measured = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    pss = [r["pss_mb"] for r in measured if r["pss_mb"] is not None]
+    return {
+        "mode": mode,
+        "workers": workers,
+        "load_ms": round(statistics.median(r["load_ms"] for r in measured), 1),
+        "rss_mb_per_worker": round(statistics.median(r["rss_mb"] for r in measured), 1),
+        "pss_mb_total": round(sum(pss), 1) if pss else None,
+    }
+
+
+# Español: Cambio en caliente: publicar la versión siguiente y mapearla, como hace el worker al
+# ver la nueva versión del catálogo.
+# English: Hot swap: publish the next version and map it, as the worker does when it sees the new
+# catalog version.
+def measure_swap(directory, version, rows, dimension):
+    write_catalog_snapshot(directory, version + 1, rows, synthetic_batches(rows, dimension, seed=version + 1))
+    start = time.perf_counter()
+    snapshot = map_snapshot(directory, version + 1)
+    engine = VectorEngine()
+    engine._state, engine.version = snapshot, version + 1
+    engine.top_k(snapshot.matrix[0], k=10)
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Arranque en frío y memoria del catálogo compartido entre workers.")
+    parser.add_argument("--runs", type=int, default=5, help="Arranques por modo (se da la mediana).")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rows", type=int, default=100000, help="Libros de la foto sintética.")
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--skip-startup", action="store_true", help="Solo la parte de memoria.")
+    parser.add_argument("--output", default=None, help="Fichero JSON lines con los resultados.")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        if not args.skip_startup:
+            credentials_path = fake_credentials(directory)
+            print(f"{'SDK_INIT':<9} {'listo ms':>9} {'aplazado ms':>12} {'RSS MB':>8}  etapas")
+            for mode in ("eager", "lazy"):
+                result = measure_startup(mode, args.runs, credentials_path)
+                results.append(dict(result, bench="startup"))
+                stages = ", ".join(f"{stage}={ms:.0f}" for stage, ms in result["stages_ms"].items())
+                print(f"{mode:<9} {result['ready_ms']:>9.1f} {result['deferred_ms']:>12.1f} {result['rss_mb']:>8.1f}  {stages}")
+            print()
+
+        snapshot_dir = os.path.join(directory, "catalog_snapshot")
+        start = time.perf_counter()
+        manifest = write_catalog_snapshot(snapshot_dir, 1, args.rows, synthetic_batches(args.rows, args.dimension, seed=1))
+        size = sum(os.path.getsize(os.path.join(snapshot_dir, "v1", name)) for name in os.listdir(os.path.join(snapshot_dir, "v1")))
+        print(f"Foto sintética: {manifest['count']} libros, {size / 2**20:.1f} MB, escrita en {time.perf_counter() - start:.2f}s.")
+        print(f"{'modo':<6} {'workers':>8} {'carga ms':>9} {'RSS MB/worker':>14} {'PSS MB total':>13}")
+        for mode in ("copia", "mmap"):
+            result = measure_memory(mode, args.workers, snapshot_dir, 1, args.dimension)
+            results.append(dict(result, bench="memory"))
+            pss = "n/d" if result["pss_mb_total"] is None else f"{result['pss_mb_total']:.1f}"
+            print(f"{mode:<6} {result['workers']:>8} {result['load_ms']:>9.1f} {result['rss_mb_per_worker']:>14.1f} {pss:>13}")
+        swap_ms = measure_swap(snapshot_dir, 1, args.rows, args.dimension)
+        results.append({"bench": "swap", "swap_ms": swap_ms})
+        print(f"\nCambio en caliente a la versión 2 (mapear y primera consulta): {swap_ms:.1f} ms.")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            for result in results:
+                output.write(json.dumps(result) + "\n")
@@ -0,0 +1,196 @@
+# Español: Carga masiva de libros con COPY. En vez de un INSERT (y un print) por fila, las filas
+# se envían a PostgreSQL por lotes en formato texto de COPY, con los embeddings serializados
+# directamente desde el array de NumPy. Las filas inválidas van a un fichero aparte en lugar de
+# abortar toda la carga.
+# English: Bulk book loading with COPY. Instead of one INSERT (and one print) per row, rows are
+# streamed to PostgreSQL in batches using COPY's text format, with the embeddings serialized
+# straight from the NumPy array. Invalid rows go to a side file instead of aborting the whole load.
+import csv
+import io
+import math
+import time
+
+import numpy as np
+import psycopg2
+
+from title_index import TITLE_KEY_DDL, normalize_title
+
+BOOK_FIELDS = ("id", "titolo", "autore", "anno", "synopsis", "collocazione")
+
+# Español: Columnas que las cargas añaden a `books` si aún no existen.
+# English: Columns the loads add to `books` if they don't exist yet.
+BOOK_EXTRA_COLUMNS = {
+    "row_hash": "ALTER TABLE books ADD COLUMN IF NOT EXISTS row_hash TEXT",
+    "titolo_key": TITLE_KEY_DDL,
+}
+
+
+# Español: Añade las columnas que falten en su propia transacción corta, antes de la carga. Un
+# ALTER TABLE toma un cerrojo ACCESS EXCLUSIVE que dura hasta el commit: dentro de la transacción
+# larga de la carga bloquearía las lecturas de la API todo ese tiempo. Si las columnas ya existen
+# (lo normal), no se ejecuta ningún ALTER.
+# English: Adds the missing columns in their own short transaction, before the load. An ALTER
+# TABLE takes an ACCESS EXCLUSIVE lock held until commit: inside the load's long transaction it
+# would block the API's reads all that time. If the columns already exist (the usual case), no
+# ALTER runs at all.
+def ensure_book_columns(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT column_name FROM information_schema.columns "
+                    "WHERE table_schema = current_schema() AND table_name = 'books'")
+        existing = {name for (name,) in cur.fetchall()}
+        for column, ddl in BOOK_EXTRA_COLUMNS.items():
+            if column not in existing:
+                cur.execute(ddl)
+    conn.commit()
+
+
+def _copy_text(value):
+    if value is None:
+        return r"\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+# Español: Convierte una fila del DataFrame en los valores que espera la tabla, o lanza
+# ValueError con el motivo del rechazo.
+# English: Turns a DataFrame row into the values the table expects, or raises ValueError with
+# the reason it was rejected.
+def clean_row(row, embedding):
+    if _is_missing(row["id"]):
+        raise ValueError("id vacío")
+    book_id = int(row["id"])
+    if _is_missing(row["titolo"]) or not str(row["titolo"]).strip():
+        raise ValueError("titolo vacío")
+    if not np.all(np.isfinite(embedding)):
+        raise ValueError("embedding con valores no finitos")
+    anno = None if _is_missing(row["anno"]) else int(row["anno"])
+    return (book_id, row["titolo"], None if _is_missing(row["autore"]) else row["autore"], anno,
+            row["synopsis"], None if _is_missing(row["collocazione"]) else row["collocazione"])
+
+
+# Español: Serializa un bloque de embeddings al formato de texto de pgvector ('[0.1,0.2,...]')
+# con np.savetxt, sin pasar por listas de Python.
+# English: Serializes a block of embeddings into pgvector's text format ('[0.1,0.2,...]') with
+# np.savetxt, without going through Python lists.
+def format_vectors(embeddings):
+    buffer = io.StringIO()
+    np.savetxt(buffer, np.asarray(embeddings, dtype=np.float32), fmt="%.8g", delimiter=",")
+    return ["[" + line + "]" for line in buffer.getvalue().splitlines()]
+
+
+class BulkLoadReport:
+    def __init__(self):
+        self.rows_loaded = 0
+        self.rows_rejected = 0
+        self.bytes_sent = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+
+    def summary(self):
+        seconds = max(self.seconds, 1e-9)
+        return (f"{self.rows_loaded} filas cargadas, {self.rows_rejected} rechazadas en {self.seconds:.2f}s "
+                f"({self.rows_loaded / seconds:.0f} filas/s, {self.bytes_sent / seconds / 1e6:.2f} MB/s)")
+
+
+class RejectWriter:
+    # Español: El fichero de rechazos solo se crea si de verdad hay alguna fila rechazada.
+    # English: The rejects file is only created if some row actually gets rejected.
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._writer = None
+
+    def write(self, row, error):
+        if self._writer is None:
+            self._file = open(self.path, mode="w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._file, delimiter="|", quoting=csv.QUOTE_ALL)
+            self._writer.writerow(list(BOOK_FIELDS) + ["error"])
+        self._writer.writerow([row.get(field) for field in BOOK_FIELDS] + [error])
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def _copy_batch(cur, copy_sql, lines):
+    payload = "".join(lines)
+    cur.copy_expert(copy_sql, io.StringIO(payload))
+    return len(payload.encode("utf-8"))
+
+
+# Español: Carga `df` y sus `embeddings` en la tabla books (o en `table`) dentro de la transacción en curso.
+# Cada lote va protegido por un SAVEPOINT: si PostgreSQL rechaza el lote, se reintenta fila a
+# fila para apartar solo las filas culpables. La clave normalizada del título (titolo_key) se
+# calcula aquí. Devuelve la máscara de filas cargadas y el informe.
+# English: Loads `df` and its `embeddings` into the books table (or `table`) inside the current transaction.
+# Each batch is guarded by a SAVEPOINT: if PostgreSQL rejects the batch, it is retried row by
+# row so only the offending rows are set aside. The title's normalized key (titolo_key) is
+# computed here. Returns the mask of loaded rows and the report.
+def bulk_load_books(cur, df, embeddings, batch_size=5000, rejects_path="rejected_rows.csv",
+                    table="books", row_hashes=None, rejects=None, verbose=True):
+    columns = list(BOOK_FIELDS) + ["titolo_key", "embedding"] + (["row_hash"] if row_hashes is not None else [])
+    copy_sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    report = BulkLoadReport()
+    # Español: Quien llama varias veces (p. ej. por trozos) puede pasar su propio RejectWriter.
+    # English: Callers that load several times (e.g. in chunks) can pass their own RejectWriter.
+    owns_rejects = rejects is None
+    if owns_rejects:
+        rejects = RejectWriter(rejects_path)
+    loaded = np.zeros(len(df), dtype=bool)
+    records = df[list(BOOK_FIELDS)].to_dict("records")
+
+    try:
+        for start in range(0, len(records), batch_size):
+            end = min(start + batch_size, len(records))
+            vectors = format_vectors(embeddings[start:end])
+            batch = []
+            for offset, (record, vector) in enumerate(zip(records[start:end], vectors)):
+                try:
+                    values = clean_row(record, embeddings[start + offset])
+                except (ValueError, TypeError) as e:
+                    rejects.write(record, str(e))
+                    report.rows_rejected += 1
+                    continue
+                line = "\t".join(_copy_text(value) for value in values + (normalize_title(values[1]),))
+                line += "\t" + vector
+                if row_hashes is not None:
+                    line += "\t" + row_hashes[start + offset]
+                line += "\n"
+                batch.append((start + offset, record, line))
+
+            if not batch:
+                continue
+            cur.execute("SAVEPOINT bulk_batch")
+            try:
+                report.bytes_sent += _copy_batch(cur, copy_sql, [line for _, _, line in batch])
+                cur.execute("RELEASE SAVEPOINT bulk_batch")
+                for index, _, _ in batch:
+                    loaded[index] = True
+                report.rows_loaded += len(batch)
+            except psycopg2.Error:
+                cur.execute("ROLLBACK TO SAVEPOINT bulk_batch")
+                for index, record, line in batch:
+                    cur.execute("SAVEPOINT bulk_row")
+                    try:
+                        report.bytes_sent += _copy_batch(cur, copy_sql, [line])
+                        cur.execute("RELEASE SAVEPOINT bulk_row")
+                        loaded[index] = True
+                        report.rows_loaded += 1
+                    except psycopg2.Error as e:
+                        cur.execute("ROLLBACK TO SAVEPOINT bulk_row")
+                        rejects.write(record, str(e).strip())
+                        report.rows_rejected += 1
+            if verbose:
+                print(f"  {end}/{len(records)} filas procesadas...")
+    finally:
+        if owns_rejects:
+            rejects.close()
+        report.finish()
+    return loaded, report
@@ -0,0 +1,249 @@
+# Español: Foto binaria y versionada del catálogo que los workers abren con memory-map de solo
+# lectura. Con VECTOR_ENGINE=memory cada worker de gunicorn copiaba en su memoria la matriz de
+# embeddings y un dict por libro; con CATALOG_SNAPSHOT_DIR todos mapean los mismos ficheros y el
+# sistema operativo guarda una sola copia física en la caché de páginas, la compartan 2 workers o 16.
+# English: Versioned binary snapshot of the catalog that workers open with a read-only memory map.
+# With VECTOR_ENGINE=memory every gunicorn worker copied the embedding matrix and a dict per book
+# into its own memory; with CATALOG_SNAPSHOT_DIR they all map the same files and the operating
+# system keeps a single physical copy in the page cache, whether 2 workers share it or 16.
+#
+# Español: Cada versión del catálogo (la de catalog_meta) vive en su carpeta `v<versión>/`:
+#   - embeddings.npy: matriz float32 normalizada, en el orden de ids.npy (por id);
+#   - embeddings.int8.npy: la misma matriz cuantizada a int8 (VECTOR_ENGINE_PRECISION=int8), con
+#     los parámetros del cuantizador en el manifest;
+#   - ids.npy, anno.npy, autore_codes.npy, collocazione_codes.npy: columnas de BookMetadata;
+#   - text.bin y text_spans.npy: los textos en UTF-8 seguidos y el (inicio, fin) de cada campo;
+#   - manifest.json: versión, tamaños y los valores distintos de autore y collocazione. Se escribe
+#     el último y la carpeta se publica con un rename, así una versión está completa o no existe.
+# populate_db.py la exporta en la misma transacción que sube la versión; si falta, el primer worker
+# que la necesita la construye desde la base de datos (con un cerrojo, los demás la esperan). Cuando
+# cambia la versión, cada worker mapea la nueva carpeta y la sustituye sin reiniciar.
+# English: Every catalog version (catalog_meta's) lives in its `v<version>/` folder:
+#   - embeddings.npy: normalized float32 matrix, in ids.npy's order (by id);
+#   - embeddings.int8.npy: the same matrix quantized to int8 (VECTOR_ENGINE_PRECISION=int8), with
+#     the quantizer's parameters in the manifest;
+#   - ids.npy, anno.npy, autore_codes.npy, collocazione_codes.npy: BookMetadata's columns;
+#   - text.bin and text_spans.npy: the texts in UTF-8 back to back and each field's (start, end);
+#   - manifest.json: version, sizes and the distinct values of autore and collocazione. It's written
+#     last and the folder is published with a rename, so a version is either complete or absent.
+# populate_db.py exports it in the same transaction that bumps the version; if it's missing, the
+# first worker that needs it builds it from the database (under a lock, the others wait for it).
+# When the version changes, each worker maps the new folder and swaps it in without a restart.
+import fcntl
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from filters import BookMetadata, metadata_key
+from quantization import ScalarQuantizer
+
+SNAPSHOT_FORMAT = 1
+TEXT_FIELDS = ("titolo", "autore", "synopsis", "collocazione")
+MANIFEST_FILE = "manifest.json"
+INT8_FILE = "embeddings.int8.npy"
+
+
+def catalog_snapshot_dir():
+    return os.getenv("CATALOG_SNAPSHOT_DIR") or None
+
+
+def snapshot_path(directory, version):
+    return os.path.join(directory, f"v{version}")
+
+
+class SnapshotBooks:
+    # Español: Los libros de la foto como una secuencia de dicts que se construyen al pedirlos, desde
+    # los ficheros mapeados. Solo ocupan memoria propia del worker los k de cada respuesta.
+    # English: The snapshot's books as a sequence of dicts built on request from the mapped files.
+    # Only the k of each response take up the worker's own memory.
+    def __init__(self, ids, anno, spans, text):
+        self.ids = ids
+        self.anno = anno
+        self.spans = spans
+        self.text = text
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if not -len(self) <= index < len(self):
+            raise IndexError(index)
+        book = {"id": int(self.ids[index])}
+        for field, (start, end) in zip(TEXT_FIELDS, self.spans[index]):
+            book[field] = None if start < 0 else self.text[start:end].tobytes().decode("utf-8")
+        anno = int(self.anno[index])
+        book["anno"] = None if anno == BookMetadata.MISSING_YEAR else anno
+        return book
+
+
+# Español: Solo un proceso escribe fotos a la vez en la carpeta (populate_db o un worker).
+# English: Only one process writes snapshots into the folder at a time (populate_db or a worker).
+@contextmanager
+def snapshot_lock(directory):
+    os.makedirs(directory, exist_ok=True)
+    fd = os.open(os.path.join(directory, ".lock"), os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def _versions(directory):
+    versions = []
+    for name in os.listdir(directory):
+        if name.startswith("v") and name[1:].isdigit():
+            versions.append(int(name[1:]))
+    return sorted(versions)
+
+
+# Español: Borra las versiones antiguas (se quedan las `keep` más recientes) y los restos de
+# exportaciones interrumpidas. Un worker que todavía tenga mapeada una versión borrada la sigue
+# leyendo sin problema: el fichero desaparece cuando se suelta el último mapeo.
+# English: Deletes old versions (the `keep` most recent ones stay) and leftovers of interrupted
+# exports. A worker that still has a deleted version mapped keeps reading it just fine: the file
+# goes away when the last mapping is released.
+def prune_snapshots(directory, keep=2):
+    for version in _versions(directory)[:-keep]:
+        shutil.rmtree(snapshot_path(directory, version), ignore_errors=True)
+    for name in os.listdir(directory):
+        if name.startswith(".v") and ".tmp-" in name:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+# Español: Escribe la foto de `version` a partir de `batches`, un iterable de (ids, matriz
+# normalizada, libros) por trozos, para no tener el catálogo entero en memoria. `count` es el total
+# de libros. Si se pasa `check`, se llama antes de publicar la carpeta y, si devuelve False, la foto
+# se descarta (p. ej. porque el catálogo cambió mientras se exportaba). Hay que llamarla con
+# snapshot_lock tomado.
+# English: Writes `version`'s snapshot from `batches`, an iterable of (ids, normalized matrix,
+# books) chunks, so the whole catalog isn't held in memory. `count` is the total number of books.
+# If `check` is given, it's called before publishing the folder and, if it returns False, the
+# snapshot is discarded (e.g. because the catalog changed during the export). It must be called
+# with snapshot_lock held.
+def write_catalog_snapshot(directory, version, count, batches, keep=2, check=None):
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, f".v{version}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    try:
+        def column(name, dtype, shape):
+            return np.lib.format.open_memmap(os.path.join(tmp, name), mode="w+", dtype=dtype, shape=shape)
+
+        ids = column("ids.npy", np.int64, (count,))
+        anno = column("anno.npy", np.int32, (count,))
+        autore_codes = column("autore_codes.npy", np.int32, (count,))
+        collocazione_codes = column("collocazione_codes.npy", np.int32, (count,))
+        spans = column("text_spans.npy", np.int64, (count, len(TEXT_FIELDS), 2))
+        matrix = None
+        dimension = 0
+        positions = {"autore": {}, "collocazione": {}}
+        row = offset = 0
+        with open(os.path.join(tmp, "text.bin"), "wb") as text:
+            for batch_ids, batch_matrix, books in batches:
+                if row + len(batch_ids) > count:
+                    raise ValueError("El catálogo tiene más libros de los contados al empezar la exportación.")
+                if matrix is None:
+                    dimension = batch_matrix.shape[1]
+                    matrix = column("embeddings.npy", np.float32, (count, dimension))
+                matrix[row:row + len(batch_ids)] = batch_matrix
+                ids[row:row + len(batch_ids)] = batch_ids
+                for book in books:
+                    for position, field in enumerate(TEXT_FIELDS):
+                        if book.get(field) is None:
+                            spans[row, position] = (-1, -1)
+                            continue
+                        data = str(book[field]).encode("utf-8")
+                        text.write(data)
+                        spans[row, position] = (offset, offset + len(data))
+                        offset += len(data)
+                    anno[row] = BookMetadata.MISSING_YEAR if book.get("anno") is None else int(book["anno"])
+                    for field, codes in (("autore", autore_codes), ("collocazione", collocazione_codes)):
+                        values = positions[field]
+                        codes[row] = values.setdefault(metadata_key(book.get(field)), len(values))
+                    row += 1
+        if row != count:
+            raise ValueError(f"Se esperaban {count} libros y se exportaron {row}.")
+
+        # Español: La versión int8 se ajusta sobre la matriz completa y se codifica por bloques,
+        # así los workers con VECTOR_ENGINE_PRECISION=int8 la mapean en vez de calcularla cada uno.
+        # English: The int8 version is fitted on the full matrix and encoded in blocks, so workers
+        # with VECTOR_ENGINE_PRECISION=int8 map it instead of each computing it.
+        quantizer = None
+        if matrix is not None:
+            quantizer = ScalarQuantizer.fit(matrix)
+            int8_codes = column(INT8_FILE, np.int8, (count, dimension))
+            for start in range(0, count, 16384):
+                int8_codes[start:start + 16384] = quantizer.encode(matrix[start:start + 16384])
+            int8_codes.flush()
+            del int8_codes
+        for array in (ids, anno, autore_codes, collocazione_codes, spans, matrix):
+            if array is not None:
+                array.flush()
+        del ids, anno, autore_codes, collocazione_codes, spans, matrix
+
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "version": version,
+            "count": count,
+            "dimension": dimension,
+            "text_bytes": offset,
+            "created_at": time.time(),
+            "autore_values": list(positions["autore"]),
+            "collocazione_values": list(positions["collocazione"]),
+            "int8": quantizer.to_dict() if quantizer is not None else None,
+        }
+        with open(os.path.join(tmp, MANIFEST_FILE), "w", encoding="utf-8") as file:
+            json.dump(manifest, file)
+        if check is not None and not check():
+            return None
+
+        path = snapshot_path(directory, version)
+        if os.path.exists(path):
+            old = os.path.join(directory, f".v{version}.tmp-old-{os.getpid()}")
+            os.rename(path, old)
+            shutil.rmtree(old, ignore_errors=True)
+        os.rename(tmp, path)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    prune_snapshots(directory, keep)
+    return manifest
+
+
+# Español: Abre la foto de `version` en modo solo lectura. Devuelve (ids, matriz, libros, metadatos,
+# int8), donde int8 es (códigos, cuantizador) o None si la foto no lo trae, o None si no existe,
+# está incompleta o está vacía.
+# English: Opens `version`'s snapshot read-only. Returns (ids, matrix, books, metadata, int8), where
+# int8 is (codes, quantizer) or None if the snapshot doesn't have it, or None if it doesn't exist,
+# is incomplete or is empty.
+def open_catalog_snapshot(directory, version):
+    path = snapshot_path(directory, version)
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("format") != SNAPSHOT_FORMAT or manifest.get("version") != version or not manifest.get("count"):
+        return None
+
+    def column(name):
+        return np.load(os.path.join(path, name), mmap_mode="r")
+
+    ids = column("ids.npy")
+    anno = column("anno.npy")
+    if manifest["text_bytes"]:
+        text = np.memmap(os.path.join(path, "text.bin"), dtype=np.uint8, mode="r")
+    else:
+        text = np.zeros(0, dtype=np.uint8)
+    books = SnapshotBooks(ids, anno, column("text_spans.npy"), text)
+    metadata = BookMetadata.from_arrays(anno, manifest["autore_values"], column("autore_codes.npy"),
+                                        manifest["collocazione_values"], column("collocazione_codes.npy"))
+    int8 = None
+    if manifest.get("int8") and os.path.exists(os.path.join(path, INT8_FILE)):
+        int8 = column(INT8_FILE), ScalarQuantizer.from_dict(manifest["int8"])
+    return ids, column("embeddings.npy"), books, metadata, int8
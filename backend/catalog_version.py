@@ -0,0 +1,95 @@
+# Español: Un número de versión del catálogo que populate_db.py incrementa en cada carga. Los
+# workers lo consultan para saber cuándo deben recargar sus estructuras en memoria.
+# English: A catalog version number that populate_db.py bumps on every load. Workers poll it
+# to know when they must reload their in-memory structures.
+import threading
+import time
+
+CATALOG_META_DDL = """
+    CREATE TABLE IF NOT EXISTS catalog_meta (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        version BIGINT NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+
+# Español: Se llama dentro de la misma transacción que carga los libros, así la nueva versión
+# solo es visible cuando los datos también lo son.
+# English: Called inside the same transaction that loads the books, so the new version only
+# becomes visible together with the data.
+def bump_catalog_version(cur):
+    cur.execute(CATALOG_META_DDL)
+    cur.execute("""
+        INSERT INTO catalog_meta (id, version) VALUES (TRUE, 1)
+        ON CONFLICT (id) DO UPDATE SET version = catalog_meta.version + 1, updated_at = now()
+        RETURNING version
+    """)
+    return cur.fetchone()[0]
+
+
+# Español: Devuelve 0 si la tabla todavía no existe (catálogo cargado con una versión antigua del script).
+# English: Returns 0 if the table does not exist yet (catalog loaded by an older version of the script).
+def read_catalog_version(cur):
+    cur.execute("SELECT to_regclass('catalog_meta') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return 0
+    cur.execute("SELECT version FROM catalog_meta WHERE id")
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+class CatalogCache:
+    # Español: Base para las estructuras en memoria que dependen del catálogo (motor vectorial,
+    # índice de títulos...). Las subclases implementan `_build(conn, version)`, que devuelve el nuevo
+    # estado ya construido; aquí solo decidimos cuándo recargar y lo sustituimos de una vez.
+    # English: Base for in-memory structures derived from the catalog (vector engine, title
+    # index...). Subclasses implement `_build(conn, version)`, which returns the new, fully built state;
+    # here we only decide when to reload and swap it in at once.
+    def __init__(self, refresh_interval=30.0):
+        self.refresh_interval = refresh_interval
+        self.version = None
+        self._state = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._state is not None
+
+    def _build(self, conn, version):
+        raise NotImplementedError
+
+    def load(self, conn):
+        with conn.cursor() as cur:
+            version = read_catalog_version(cur)
+        state = self._build(conn, version)
+        self._state, self.version = state, version
+        self._last_check = time.monotonic()
+        return state
+
+    # Español: Permite a las rutas no pedir una conexión al pool si todavía no toca comprobar.
+    # English: Lets routes skip checking out a pool connection when no check is due yet.
+    def refresh_due(self):
+        return self._state is None or time.monotonic() - self._last_check >= self.refresh_interval
+
+    # Español: Como mucho cada `refresh_interval` segundos miramos si populate_db.py ha cambiado
+    # la versión del catálogo y, si es así, recargamos.
+    # English: At most every `refresh_interval` seconds we check whether populate_db.py has
+    # changed the catalog version and, if so, reload.
+    def maybe_refresh(self, conn):
+        if not self.refresh_due():
+            return False
+        if not self._lock.acquire(blocking=self._state is None):
+            return False
+        try:
+            if self._state is not None:
+                with conn.cursor() as cur:
+                    version = read_catalog_version(cur)
+                self._last_check = time.monotonic()
+                if version == self.version:
+                    return False
+            self.load(conn)
+            return True
+        finally:
+            self._lock.release()
@@ -0,0 +1,224 @@
+# Español: Un pool de conexiones PostgreSQL que vive durante toda la vida del worker de gunicorn.
+# English: A PostgreSQL connection pool that lives for the whole lifetime of the gunicorn worker.
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+
+from ann_index import apply_search_settings
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    # Español: Se lanza cuando ninguna conexión queda libre dentro del tiempo de espera.
+    # English: Raised when no connection becomes free within the checkout timeout.
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, dsn, min_size=1, max_size=10, timeout=10.0, check_interval=5.0, configure=None):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Tamaño de pool inválido: min={min_size}, max={max_size}.")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        # Español: Función opcional que prepara cada conexión nueva (p. ej. parámetros de sesión).
+        # English: Optional function that prepares every new connection (e.g. session settings).
+        self.configure = configure
+
+        self._cond = threading.Condition()
+        # Español: Conexiones libres como pares (conexión, momento en que se devolvió).
+        # English: Idle connections as (connection, time it was returned) pairs.
+        self._idle = []
+        self._in_use = set()
+        self._pending = 0
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "timeouts": 0,
+            "connects": 0,
+            "discards": 0,
+            "health_check_failures": 0,
+        }
+
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        if self.configure is not None:
+            try:
+                self.configure(conn)
+            except Exception:
+                conn.close()
+                raise
+        with self._cond:
+            self._stats["connects"] += 1
+        return conn
+
+    def _discard(self, conn):
+        self._stats["discards"] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, idle_since):
+        # Español: Una conexión cerrada nunca vuelve a servir. Si lleva poco tiempo libre
+        # confiamos en ella; si no, hacemos un "SELECT 1" barato antes de entregarla.
+        # English: A closed connection is never reused. If it was idle only briefly we trust
+        # it; otherwise we run a cheap "SELECT 1" before handing it out.
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def _drop_idle(self):
+        # Español: Tras un failover todas las conexiones libres apuntan al servidor viejo.
+        # English: After a failover every idle connection points at the old server.
+        stale, self._idle = self._idle, []
+        for conn, _ in stale:
+            self._discard(conn)
+
+    def getconn(self):
+        start = time.monotonic()
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise psycopg2.InterfaceError("El pool de conexiones está cerrado.")
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    break
+                if len(self._in_use) + self._pending < self.max_size:
+                    conn, idle_since = None, None
+                    break
+
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"No hay conexiones libres en el pool tras {self.timeout:.1f}s "
+                        f"({len(self._in_use)}/{self.max_size} en uso).")
+                if not waited:
+                    waited = True
+                    self._stats["waits"] += 1
+                self._cond.wait(remaining)
+            # Español: Reservamos el hueco y hacemos la parte lenta (conectar o comprobar) sin el lock.
+            # English: We reserve the slot and do the slow part (connect or check) outside the lock.
+            self._pending += 1
+
+        try:
+            if conn is not None and not self._is_healthy(conn, idle_since):
+                with self._cond:
+                    self._stats["health_check_failures"] += 1
+                    self._discard(conn)
+                    self._drop_idle()
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._pending -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._pending -= 1
+            self._in_use.add(conn)
+            self._stats["checkouts"] += 1
+            if waited:
+                elapsed = time.monotonic() - start
+                self._stats["wait_time_total"] += elapsed
+                self._stats["wait_time_max"] = max(self._stats["wait_time_max"], elapsed)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            # Español: Dejamos la conexión limpia, sin transacción abierta, para el próximo uso.
+            # English: We leave the connection clean, with no open transaction, for its next user.
+            try:
+                conn.rollback()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                discard = True
+
+        with self._cond:
+            self._in_use.discard(conn)
+            if discard or conn.closed or self._closed or len(self._idle) >= self.max_size:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.putconn(conn, discard=True)
+            raise
+        else:
+            self.putconn(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "size": len(self._in_use) + len(self._idle),
+            })
+            return stats
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._drop_idle()
+            self._cond.notify_all()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+# Español: Devuelve el pool de este proceso. Se crea perezosamente para que cada worker de
+# gunicorn (que hace fork del maestro) tenga el suyo y nunca comparta sockets con otro.
+# English: Returns this process's pool. It is created lazily so that each gunicorn worker
+# (forked from the master) gets its own and never shares sockets with another process.
+def get_pool():
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            database_url = os.getenv("DATABASE_URL")
+            if not database_url:
+                raise ValueError("La variable de entorno DATABASE_URL no está configurada.")
+            _pool = ConnectionPool(
+                database_url,
+                min_size=int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+                max_size=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+                timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+                check_interval=float(os.getenv("DB_POOL_CHECK_INTERVAL", "5")),
+                configure=apply_search_settings,
+            )
+            _pool_pid = pid
+        return _pool
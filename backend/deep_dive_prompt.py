@@ -0,0 +1,74 @@
+# Español: El modelo de Gemini y el prompt de deep_dive, compartidos por app.py (WSGI) y
+# asgi_app.py (ASGI) para que las dos formas de servir la API den exactamente el mismo análisis.
+# English: The Gemini model and the deep_dive prompt, shared by app.py (WSGI) and asgi_app.py
+# (ASGI) so both ways of serving the API give exactly the same analysis.
+
+# Español: Le damos a Gemini sus instrucciones: es un experto y debe hablar siempre en italiano.
+# English: We give Gemini its instructions: it's an expert and must always speak Italian.
+GEMINI_MODEL_NAME = 'gemini-1.5-flash-latest'
+GEMINI_SYSTEM_INSTRUCTION = "Sei un critico letterario esperto. Rispondi sempre e solo in italiano."
+
+# Español: Versión de la plantilla del prompt de deep_dive. Hay que incrementarla al cambiar el
+# prompt, para que la caché de análisis no devuelva respuestas de la plantilla anterior.
+# English: Version of the deep_dive prompt template. Bump it when the prompt changes, so the
+# analysis cache doesn't serve answers from the previous template.
+DEEP_DIVE_PROMPT_VERSION = "1"
+
+# Español: Construye el prompt de deep_dive. Lo comparten la ruta normal, la de streaming y asgi_app.py.
+# English: Builds the deep_dive prompt. Shared by the regular route, the streaming one and asgi_app.py.
+def build_deep_dive_prompt(original_title, original_synopsis, recommendations):
+    # Español: Preparamos un texto con todas las recomendaciones para enviárselo a Gemini.
+    # English: We prepare a text with all the recommendations to send to Gemini.
+    recommendations_text = "\n".join(
+        [f" - Titolo: {rec['titolo']}, Sinossi: {rec['synopsis']}" for rec in recommendations]
+    )
+
+    # Español: Creamos el "prompt": las instrucciones detalladas para que la IA haga su análisis.
+    # English: We create the "prompt": the detailed instructions for the AI to perform its analysis.
+    prompt = f"""
+Libro di riferimento: '{original_title}'
+Sinossi di riferimento: {original_synopsis}
+
+Libri consigliati:
+{recommendations_text}
+
+Analizza la somiglianza di ciascun libro consigliato con el libro de referencia, considerando stile, genere, trama, ambientazione e tono.
+IMPORTANTE: Fornisci solo le analisi, separate dal delimitatore '|||'. Non includer los títulos de los libros en tu respuesta.
+"""
+    return prompt
+
+
+# Español: Los ids de las recomendaciones que manda el cliente. Las que traen id se analizan con el
+# título y la sinopsis guardados en `books`, no con los del cuerpo de la petición: así nadie puede
+# dejar en la caché compartida un análisis de sinopsis inventadas. Lanza ValueError si el cuerpo no
+# tiene la forma esperada.
+# English: The ids of the recommendations the client sends. Those that carry an id are analysed
+# with the title and synopsis stored in `books`, not the ones in the request body: that way nobody
+# can leave an analysis of made-up synopses in the shared cache. Raises ValueError if the body
+# doesn't have the expected shape.
+def recommendation_ids(recommendations):
+    if not isinstance(recommendations, list) or not all(isinstance(rec, dict) for rec in recommendations):
+        raise ValueError("El campo 'recommendations' debe ser una lista de libros.")
+    ids = []
+    for rec in recommendations:
+        if rec.get('id') is not None:
+            try:
+                ids.append(int(rec['id']))
+            except (TypeError, ValueError):
+                raise ValueError("El 'id' de cada recomendación debe ser un número entero.")
+    return ids
+
+
+# Español: Las recomendaciones tal como van al prompt: las que tienen id, con el título y la
+# sinopsis de `stored` ({id: (titolo, synopsis)}, leído de `books`).
+# English: The recommendations as they go into the prompt: those with an id, with the title and
+# synopsis from `stored` ({id: (titolo, synopsis)}, read from `books`).
+def prompt_recommendations(recommendations, stored):
+    trusted = []
+    for rec in recommendations:
+        if rec.get('id') is None:
+            trusted.append(rec)
+        else:
+            titolo, synopsis = stored[int(rec['id'])]
+            trusted.append(dict(rec, titolo=titolo, synopsis=synopsis))
+    return trusted
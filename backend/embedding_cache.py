@@ -0,0 +1,135 @@
+# Español: Caché persistente de embeddings indexada por hash de contenido. La clave de cada
+# vector es el hash de (modelo, sinopsis): si la sinopsis no cambia, no hace falta volver a
+# codificarla. Los vectores viven en un .npy que se abre con memory-map y los hashes en otro
+# .npy paralelo, así cargar la caché no copia la matriz entera en memoria.
+# English: Persistent embedding cache keyed by content hash. Each vector's key is the hash of
+# (model, synopsis): if the synopsis doesn't change, there's no need to encode it again. Vectors
+# live in a memory-mapped .npy and hashes in a parallel .npy, so loading the cache doesn't copy
+# the whole matrix into memory.
+import hashlib
+import os
+
+import numpy as np
+
+HASH_BYTES = 64
+
+
+# Español: Hash en hexadecimal (ASCII): el tipo "S" de NumPy recorta los bytes nulos finales,
+# así que un digest binario podría corromperse al guardarlo.
+# English: Hex (ASCII) hash: NumPy's "S" dtype strips trailing null bytes, so a binary digest
+# could get corrupted when saved.
+def synopsis_hash(model_name, synopsis):
+    return hashlib.sha256(f"{model_name}\0{synopsis}".encode("utf-8")).hexdigest().encode("ascii")
+
+
+# Español: Hash de la fila entera (y del modelo): si cambia cualquier campo, la fila se actualiza.
+# English: Hash of the whole row (and the model): if any field changes, the row is updated.
+def row_hash(model_name, record, fields):
+    payload = "\0".join([model_name] + [str(record[field]) for field in fields])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, directory, dimension=None):
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, "vectors.npy")
+        self.hashes_path = os.path.join(directory, "hashes.npy")
+        self._vectors = None
+        self._index = {}
+        self._new_hashes = []
+        self._new_vectors = []
+        self.dimension = dimension
+
+        if os.path.exists(self.vectors_path) and os.path.exists(self.hashes_path):
+            self._vectors = np.load(self.vectors_path, mmap_mode="r")
+            hashes = np.load(self.hashes_path)
+            self._index = {bytes(h): i for i, h in enumerate(hashes)}
+            self.dimension = self._vectors.shape[1]
+
+    def __len__(self):
+        return len(self._index) + len(self._new_hashes)
+
+    def get(self, key):
+        index = self._index.get(key)
+        if index is not None:
+            return np.asarray(self._vectors[index], dtype=np.float32)
+        return None
+
+    # Español: Devuelve una matriz con los vectores encontrados y una máscara de aciertos.
+    # English: Returns a matrix with the vectors found and a hit mask.
+    def lookup(self, keys):
+        hits = np.array([key in self._index for key in keys], dtype=bool)
+        vectors = np.zeros((len(keys), self.dimension or 0), dtype=np.float32)
+        if hits.any():
+            rows = [self._index[key] for key, hit in zip(keys, hits) if hit]
+            vectors[hits] = self._vectors[np.array(rows)]
+        return vectors, hits
+
+    def add(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dimension is None and len(vectors):
+            self.dimension = vectors.shape[1]
+        for key, vector in zip(keys, vectors):
+            if key not in self._index:
+                self._new_hashes.append(key)
+                self._new_vectors.append(vector)
+
+    # Español: Escribe la caché en ficheros temporales y los sustituye de forma atómica. Si se
+    # pasa `keep`, solo se conservan esos hashes (los del catálogo actual), para que la caché no
+    # crezca sin límite con sinopsis que ya no existen.
+    # English: Writes the cache to temporary files and swaps them in atomically. If `keep` is
+    # given, only those hashes (the current catalog's) are kept, so the cache doesn't grow without
+    # bounds with synopses that no longer exist.
+    def save(self, keep=None):
+        keys = list(self._index) + self._new_hashes
+        if keep is not None:
+            keep = set(keep)
+            keys = [key for key in keys if key in keep]
+        if not keys or self.dimension is None:
+            return 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        new_positions = {key: i for i, key in enumerate(self._new_hashes)}
+        vectors_tmp = self.vectors_path + ".tmp.npy"
+        out = np.lib.format.open_memmap(vectors_tmp, mode="w+", dtype=np.float32, shape=(len(keys), self.dimension))
+        for row, key in enumerate(keys):
+            index = self._index.get(key)
+            out[row] = self._vectors[index] if index is not None else self._new_vectors[new_positions[key]]
+        out.flush()
+        del out
+
+        hashes_tmp = self.hashes_path + ".tmp.npy"
+        np.save(hashes_tmp, np.array(keys, dtype=f"S{HASH_BYTES}"))
+        os.replace(vectors_tmp, self.vectors_path)
+        os.replace(hashes_tmp, self.hashes_path)
+
+        self._vectors = np.load(self.vectors_path, mmap_mode="r")
+        self._index = {key: i for i, key in enumerate(keys)}
+        self._new_hashes, self._new_vectors = [], []
+        return len(keys)
+
+    # Español: Sustituye la caché entera por `keys` -> `vectors`, copiando por bloques; `vectors`
+    # puede ser un np.memmap, así que no hace falta tener la matriz en memoria.
+    # English: Replaces the whole cache with `keys` -> `vectors`, copying in blocks; `vectors` may
+    # be an np.memmap, so the matrix doesn't need to fit in memory.
+    def rebuild(self, keys, vectors, block_size=65536):
+        if not len(keys):
+            return 0
+        os.makedirs(self.directory, exist_ok=True)
+        vectors_tmp = self.vectors_path + ".tmp.npy"
+        out = np.lib.format.open_memmap(vectors_tmp, mode="w+", dtype=np.float32, shape=vectors.shape)
+        for start in range(0, len(keys), block_size):
+            out[start:start + block_size] = vectors[start:start + block_size]
+        out.flush()
+        del out
+
+        hashes_tmp = self.hashes_path + ".tmp.npy"
+        np.save(hashes_tmp, np.array(keys, dtype=f"S{HASH_BYTES}"))
+        os.replace(vectors_tmp, self.vectors_path)
+        os.replace(hashes_tmp, self.hashes_path)
+
+        self._vectors = np.load(self.vectors_path, mmap_mode="r")
+        self._index = {key: i for i, key in enumerate(keys)}
+        self._new_hashes, self._new_vectors = [], []
+        self.dimension = vectors.shape[1]
+        return len(keys)
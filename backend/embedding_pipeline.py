@@ -0,0 +1,264 @@
+# Español: Pipeline de carga en streaming para catálogos grandes (POPULATE_MODE=stream). El CSV se
+# lee por trozos, cada trozo se codifica con un pool de procesos de sentence-transformers y se
+# entrega, a través de una cola acotada, a un hilo que lo escribe con COPY mientras se codifica el
+# siguiente. Los vectores cargados se van añadiendo a un fichero en disco para calcular los
+# vecinos al final, así la memoria se mantiene plana aunque el catálogo crezca.
+# English: Streaming load pipeline for large catalogs (POPULATE_MODE=stream). The CSV is read in
+# chunks, each chunk is encoded with a sentence-transformers process pool and handed, through a
+# bounded queue, to a thread that writes it with COPY while the next one is being encoded. Loaded
+# vectors are appended to an on-disk file to compute the neighbours at the end, so memory stays
+# flat as the catalog grows.
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from ann_index import drop_ann_index, ensure_ann_index
+from bulk_load import BOOK_FIELDS, RejectWriter, bulk_load_books, ensure_book_columns
+from catalog_snapshot import catalog_snapshot_dir, snapshot_lock
+from catalog_version import bump_catalog_version
+from embedding_cache import EmbeddingCache, row_hash, synopsis_hash
+from filters import METADATA_INDEXES_DDL
+from neighbors import rebuild_neighbors
+from title_index import TITLE_KEY_INDEX_DDL
+from vector_engine import export_catalog_snapshot
+
+
+class StageTimer:
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.seconds[stage] += seconds
+
+    def report(self):
+        return "\n".join(f"  {stage:<10} {seconds:8.2f}s" for stage, seconds in self.seconds.items())
+
+
+def read_chunks(csv_path, chunk_size):
+    for chunk in pd.read_csv(csv_path, sep='|', quotechar='"', doublequote=True,
+                             on_bad_lines='warn', chunksize=chunk_size):
+        chunk['anno'] = pd.to_numeric(chunk['anno'], errors='coerce')
+        chunk['synopsis'] = chunk['synopsis'].astype(str)
+        yield chunk.reset_index(drop=True)
+
+
+class Encoder:
+    # Español: Con workers > 1 usamos el pool multiproceso de sentence-transformers; con 1, el
+    # propio proceso. El modelo solo se carga la primera vez que hay algo que codificar.
+    # English: With workers > 1 we use sentence-transformers' multi-process pool; with 1, this
+    # same process. The model is only loaded the first time there is something to encode.
+    def __init__(self, model_name, workers=1, batch_size=64, max_seq_length=None):
+        self.model_name = model_name
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_seq_length = max_seq_length
+        self._model = None
+        self._pool = None
+
+    def _ensure_model(self):
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+
+            print("Cargando el modelo de sentence-transformers...")
+            self._model = SentenceTransformer(self.model_name)
+            if self.max_seq_length:
+                self._model.max_seq_length = self.max_seq_length
+            if self.workers > 1:
+                self._pool = self._model.start_multi_process_pool(target_devices=["cpu"] * self.workers)
+            print("Modelo cargado.")
+
+    def encode(self, texts):
+        self._ensure_model()
+        if self._pool is not None:
+            vectors = self._model.encode_multi_process(texts, self._pool, batch_size=self.batch_size)
+        else:
+            vectors = self._model.encode(texts, batch_size=self.batch_size)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def close(self):
+        if self._pool is not None:
+            self._model.stop_multi_process_pool(self._pool)
+            self._pool = None
+
+
+class Writer(threading.Thread):
+    # Español: Consume trozos ya codificados de la cola y los escribe con COPY. Es el único hilo
+    # que usa el cursor. Los vectores de las filas cargadas se añaden a `vectors_file`.
+    # English: Consumes already encoded chunks from the queue and writes them with COPY. It's the
+    # only thread that uses the cursor. Vectors of loaded rows are appended to `vectors_file`.
+    def __init__(self, cur, work, timer, batch_size, rejects, vectors_file):
+        super().__init__(name="populate-writer", daemon=True)
+        self.cur = cur
+        self.work = work
+        self.timer = timer
+        self.batch_size = batch_size
+        self.rejects = rejects
+        self.vectors_file = vectors_file
+        self.loaded_ids = []
+        self.loaded_keys = []
+        self.rows_loaded = 0
+        self.rows_rejected = 0
+        self.bytes_sent = 0
+        self.error = None
+
+    def run(self):
+        while True:
+            item = self.work.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue
+            chunk, embeddings, keys, hashes = item
+            start = time.perf_counter()
+            try:
+                loaded, report = bulk_load_books(self.cur, chunk, embeddings, batch_size=self.batch_size,
+                                                 row_hashes=hashes, rejects=self.rejects, verbose=False)
+            except Exception as e:
+                self.error = e
+                continue
+            embeddings[loaded].astype(np.float32).tofile(self.vectors_file)
+            self.loaded_ids.extend(int(book_id) for book_id in chunk['id'][loaded])
+            self.loaded_keys.extend(key for key, ok in zip(keys, loaded) if ok)
+            self.rows_loaded += report.rows_loaded
+            self.rows_rejected += report.rows_rejected
+            self.bytes_sent += report.bytes_sent
+            self.timer.add("write", time.perf_counter() - start)
+            print(f"  {self.rows_loaded} filas cargadas...")
+
+
+def populate_streaming(csv_path, model_name, cache_dir, rejects_path):
+    workers = int(os.getenv("EMBED_WORKERS", str(os.cpu_count() or 1)))
+    encode_batch_size = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+    max_seq_length = int(os.getenv("EMBED_MAX_SEQ_LENGTH", "0")) or None
+    chunk_size = int(os.getenv("CSV_CHUNK_SIZE", "10000"))
+    queue_size = int(os.getenv("PIPELINE_QUEUE_SIZE", "2"))
+    load_batch_size = int(os.getenv("LOAD_BATCH_SIZE", "5000"))
+    print(f"Pipeline en streaming: {workers} workers, lotes de {encode_batch_size}, trozos de {chunk_size} filas.")
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise ValueError("La variable de entorno DATABASE_URL no está configurada.")
+    conn = psycopg2.connect(database_url)
+    ensure_book_columns(conn)
+    cur = conn.cursor()
+
+    timer = StageTimer()
+    total_start = time.perf_counter()
+    encoder = Encoder(model_name, workers=workers, batch_size=encode_batch_size, max_seq_length=max_seq_length)
+    cache = EmbeddingCache(cache_dir)
+    rejects = RejectWriter(rejects_path)
+    rows_read = 0
+    encoded_count = 0
+    # Español: La cola acotada es la que mantiene la memoria plana: si la escritura va más lenta
+    # que la codificación, el lector espera en vez de acumular trozos.
+    # English: The bounded queue is what keeps memory flat: if writing is slower than encoding,
+    # the reader waits instead of piling up chunks.
+    work = queue.Queue(maxsize=queue_size)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        vectors_path = os.path.join(tmp_dir, "vectors.f32")
+        with open(vectors_path, "wb") as vectors_file:
+            print("Vaciando la tabla 'books'...")
+            cur.execute("TRUNCATE TABLE books RESTART IDENTITY CASCADE;")
+            drop_ann_index(cur)
+            writer = Writer(cur, work, timer, load_batch_size, rejects, vectors_file)
+            writer.start()
+            try:
+                chunks = read_chunks(csv_path, chunk_size)
+                while True:
+                    start = time.perf_counter()
+                    chunk = next(chunks, None)
+                    timer.add("read", time.perf_counter() - start)
+                    if chunk is None or writer.error is not None:
+                        break
+
+                    start = time.perf_counter()
+                    keys = [synopsis_hash(model_name, synopsis) for synopsis in chunk['synopsis']]
+                    hashes = [row_hash(model_name, record, BOOK_FIELDS)
+                              for record in chunk[list(BOOK_FIELDS)].to_dict('records')]
+                    embeddings, hits = cache.lookup(keys)
+                    rows_read += len(chunk)
+                    timer.add("cache", time.perf_counter() - start)
+
+                    if not hits.all():
+                        start = time.perf_counter()
+                        vectors = encoder.encode(chunk['synopsis'][~hits].tolist())
+                        if embeddings.shape[1] != vectors.shape[1]:
+                            embeddings = np.zeros((len(chunk), vectors.shape[1]), dtype=np.float32)
+                        embeddings[~hits] = vectors
+                        encoded_count += len(vectors)
+                        timer.add("encode", time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    work.put((chunk, embeddings, keys, hashes))
+                    timer.add("queue", time.perf_counter() - start)
+            finally:
+                work.put(None)
+                writer.join()
+                encoder.close()
+                rejects.close()
+
+        if writer.error is not None:
+            conn.rollback()
+            conn.close()
+            raise writer.error
+
+        print(f"{writer.rows_loaded} filas cargadas, {writer.rows_rejected} rechazadas, "
+              f"{rows_read - encoded_count} embeddings reutilizados, {encoded_count} codificados.")
+        if writer.rows_rejected:
+            print(f"Filas rechazadas guardadas en '{rejects_path}'.")
+
+        start = time.perf_counter()
+        ensure_ann_index(cur, rebuild=True)
+        cur.execute(METADATA_INDEXES_DDL)
+        cur.execute(TITLE_KEY_INDEX_DDL)
+        timer.add("ann_index", time.perf_counter() - start)
+
+        # Español: Los vecinos se calculan sobre el fichero en disco mapeado en memoria.
+        # English: Neighbours are computed over the memory-mapped on-disk file.
+        start = time.perf_counter()
+        ids = np.array(writer.loaded_ids, dtype=np.int64)
+        dimension = os.path.getsize(vectors_path) // 4 // len(ids) if len(ids) else 0
+        matrix = None
+        if dimension:
+            matrix = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(len(ids), dimension))
+            rebuild_neighbors(cur, ids, matrix,
+                              k=int(os.getenv("NEIGHBORS_K", "20")),
+                              block_size=int(os.getenv("NEIGHBORS_BLOCK_SIZE", "1024")))
+        timer.add("neighbors", time.perf_counter() - start)
+
+        version = bump_catalog_version(cur)
+        snapshot_dir = catalog_snapshot_dir()
+        if snapshot_dir:
+            start = time.perf_counter()
+            with snapshot_lock(snapshot_dir):
+                export_catalog_snapshot(conn, snapshot_dir, version, batch_size=chunk_size)
+            timer.add("snapshot", time.perf_counter() - start)
+        start = time.perf_counter()
+        conn.commit()
+        timer.add("commit", time.perf_counter() - start)
+        cur.close()
+        conn.close()
+
+        # Español: La nueva caché se escribe desde el fichero de vectores, sin acumularlos en memoria.
+        # English: The new cache is written from the vectors file, without accumulating them in memory.
+        if matrix is not None:
+            start = time.perf_counter()
+            cache.rebuild(writer.loaded_keys, matrix)
+            timer.add("cache", time.perf_counter() - start)
+            del matrix
+
+    total = time.perf_counter() - total_start
+    print(f"Versión del catálogo: {version}")
+    print(f"Tiempo por etapa (total {total:.2f}s, {writer.rows_loaded / max(total, 1e-9):.0f} filas/s, "
+          f"{writer.bytes_sent / max(total, 1e-9) / 1e6:.2f} MB/s):")
+    print(timer.report())
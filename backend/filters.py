@@ -0,0 +1,285 @@
+# Español: Filtros de metadatos para las recomendaciones: rango de `anno`, autores incluidos o
+# excluidos y prefijos de `collocazione` (p. ej. "GIALLI" para todas las estanterías de gialli).
+# Se aplican dentro de la búsqueda, no después: en el motor en memoria como una máscara booleana
+# sobre el catálogo (construida con columnas de códigos precalculadas), y en pgvector como
+# condiciones WHERE sobre columnas indexadas con escaneo iterativo del índice ANN. Así siempre
+# salen k resultados mientras haya k libros que cumplan el filtro.
+# English: Metadata filters for recommendations: `anno` range, included or excluded authors and
+# `collocazione` prefixes (e.g. "GIALLI" for every gialli shelf). They are applied inside the
+# search, not afterwards: in the in-memory engine as a boolean mask over the catalog (built from
+# precomputed code columns), and in pgvector as WHERE conditions on indexed columns with iterative
+# ANN index scans. That way k results always come back as long as k books match the filter.
+import numpy as np
+import psycopg2
+
+# Español: Índices de metadatos que usan los filtros en pgvector. populate_db.py los crea.
+# English: Metadata indexes used by the filters in pgvector. populate_db.py creates them.
+METADATA_INDEXES_DDL = """
+    CREATE INDEX IF NOT EXISTS books_anno_idx ON books (anno);
+    CREATE INDEX IF NOT EXISTS books_autore_key_idx ON books (LOWER(TRIM(autore)));
+    CREATE INDEX IF NOT EXISTS books_collocazione_key_idx ON books (LOWER(TRIM(collocazione)) text_pattern_ops);
+"""
+
+
+def metadata_key(value):
+    return None if value is None else str(value).strip().lower()
+
+
+def _as_list(value, field):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(item, str) and item.strip() for item in value):
+        raise ValueError(f"El filtro '{field}' debe ser un texto o una lista de textos.")
+    return [metadata_key(item) for item in value]
+
+
+def _as_year(value, field):
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"El filtro '{field}' debe ser un año (número entero).")
+
+
+def _like_prefix(prefix):
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+class BookFilter:
+    def __init__(self, anno_min=None, anno_max=None, autore=(), exclude_autore=(), collocazione=()):
+        self.anno_min = anno_min
+        self.anno_max = anno_max
+        self.autore = list(autore)
+        self.exclude_autore = list(exclude_autore)
+        self.collocazione = list(collocazione)
+
+    # Español: Lee el objeto "filters" del JSON de la petición. Devuelve None si no hay filtros.
+    # English: Reads the "filters" object from the request JSON. Returns None if there are no filters.
+    @classmethod
+    def from_json(cls, data):
+        if data is None:
+            return None
+        if not isinstance(data, dict):
+            raise ValueError("El campo 'filters' debe ser un objeto.")
+        unknown = set(data) - {"anno_min", "anno_max", "autore", "exclude_autore", "collocazione"}
+        if unknown:
+            raise ValueError(f"Filtros desconocidos: {', '.join(sorted(unknown))}.")
+        book_filter = cls(
+            anno_min=_as_year(data.get("anno_min"), "anno_min"),
+            anno_max=_as_year(data.get("anno_max"), "anno_max"),
+            autore=_as_list(data.get("autore"), "autore"),
+            exclude_autore=_as_list(data.get("exclude_autore"), "exclude_autore"),
+            collocazione=_as_list(data.get("collocazione"), "collocazione"),
+        )
+        if book_filter.anno_min is not None and book_filter.anno_max is not None \
+                and book_filter.anno_min > book_filter.anno_max:
+            raise ValueError("'anno_min' no puede ser mayor que 'anno_max'.")
+        return book_filter if book_filter.active else None
+
+    # Español: Clave estable del filtro (para agrupar peticiones idénticas).
+    # English: Stable key of the filter (to coalesce identical requests).
+    def key(self):
+        return (self.anno_min, self.anno_max, sorted(self.autore), sorted(self.exclude_autore),
+                sorted(self.collocazione))
+
+    @property
+    def active(self):
+        return (self.anno_min is not None or self.anno_max is not None or bool(self.autore)
+                or bool(self.exclude_autore) or bool(self.collocazione))
+
+    # Español: Condiciones SQL (unidas con AND) y sus parámetros. `placeholder(i)` da el marcador del
+    # parámetro i-ésimo: '%s' para psycopg2, '$n' para asyncpg.
+    # English: SQL conditions (joined with AND) and their parameters. `placeholder(i)` gives the marker
+    # for the i-th parameter: '%s' for psycopg2, '$n' for asyncpg.
+    def sql(self, placeholder=lambda index: "%s", start=0):
+        conditions, params = [], []
+
+        def param(value):
+            params.append(value)
+            return placeholder(start + len(params))
+
+        if self.anno_min is not None:
+            conditions.append(f"anno >= {param(self.anno_min)}")
+        if self.anno_max is not None:
+            conditions.append(f"anno <= {param(self.anno_max)}")
+        if self.autore:
+            conditions.append(f"LOWER(TRIM(autore)) = ANY({param(self.autore)})")
+        if self.exclude_autore:
+            conditions.append(f"(autore IS NULL OR NOT LOWER(TRIM(autore)) = ANY({param(self.exclude_autore)}))")
+        if self.collocazione:
+            patterns = [_like_prefix(prefix) for prefix in self.collocazione]
+            conditions.append(f"LOWER(TRIM(collocazione)) LIKE ANY({param(patterns)})")
+        return " AND ".join(conditions) or "TRUE", params
+
+    # Español: Máscara de los libros del catálogo que cumplen el filtro, a partir de los metadatos
+    # codificados de la foto del catálogo (ver BookMetadata).
+    # English: Mask of the catalog books that match the filter, from the catalog snapshot's encoded
+    # metadata (see BookMetadata).
+    def mask(self, metadata):
+        mask = np.ones(len(metadata.anno), dtype=bool)
+        if self.anno_min is not None:
+            mask &= metadata.anno >= self.anno_min
+        if self.anno_max is not None:
+            mask &= (metadata.anno <= self.anno_max) & (metadata.anno != metadata.MISSING_YEAR)
+        if self.autore:
+            mask &= np.isin(metadata.autore_codes, metadata.codes_for(metadata.autore_values, self.autore))
+        if self.exclude_autore:
+            mask &= ~np.isin(metadata.autore_codes, metadata.codes_for(metadata.autore_values, self.exclude_autore))
+        if self.collocazione:
+            codes = [code for code, value in enumerate(metadata.collocazione_values)
+                     if value is not None and value.startswith(tuple(self.collocazione))]
+            mask &= np.isin(metadata.collocazione_codes, codes)
+        return mask
+
+
+class BookMetadata:
+    # Español: Columnas de metadatos del catálogo como arrays de NumPy: el año (con un valor
+    # centinela para los que faltan) y autor y collocazione como códigos enteros sobre sus valores
+    # distintos. Filtrar es entonces comparar arrays, sin recorrer los libros en Python.
+    # English: Catalog metadata columns as NumPy arrays: the year (with a sentinel for missing ones)
+    # and author and collocazione as integer codes over their distinct values. Filtering is then
+    # comparing arrays, without looping over the books in Python.
+    MISSING_YEAR = np.iinfo(np.int32).min
+
+    def __init__(self, books):
+        self.anno = np.array([self.MISSING_YEAR if book.get("anno") is None else int(book["anno"])
+                              for book in books], dtype=np.int32)
+        self.autore_values, self.autore_codes = self._encode([book.get("autore") for book in books])
+        self.collocazione_values, self.collocazione_codes = self._encode([book.get("collocazione") for book in books])
+
+    # Español: Los mismos metadatos ya codificados, p. ej. los arrays mapeados de catalog_snapshot.py.
+    # English: The same metadata already encoded, e.g. catalog_snapshot.py's mapped arrays.
+    @classmethod
+    def from_arrays(cls, anno, autore_values, autore_codes, collocazione_values, collocazione_codes):
+        metadata = cls.__new__(cls)
+        metadata.anno = anno
+        metadata.autore_values, metadata.autore_codes = list(autore_values), autore_codes
+        metadata.collocazione_values, metadata.collocazione_codes = list(collocazione_values), collocazione_codes
+        return metadata
+
+    @staticmethod
+    def _encode(values):
+        positions = {}
+        codes = np.array([positions.setdefault(metadata_key(value), len(positions)) for value in values],
+                         dtype=np.int32)
+        return list(positions), codes
+
+    @staticmethod
+    def codes_for(values, wanted):
+        wanted = set(wanted)
+        return [code for code, value in enumerate(values) if value in wanted]
+
+
+# Español: Ajustes de sesión del escaneo iterativo (hnsw conserva el orden exacto; ivfflat solo
+# admite el orden relajado). Los comparte asgi_app.py.
+# English: Session settings for iterative scans (hnsw keeps the exact order; ivfflat only supports
+# relaxed ordering). Shared with asgi_app.py.
+ITERATIVE_SCAN_SETTINGS = (
+    "SET LOCAL hnsw.iterative_scan = strict_order",
+    "SET LOCAL ivfflat.iterative_scan = relaxed_order",
+)
+
+_iterative_scan_supported = None
+
+
+# Español: pgvector >= 0.8 puede seguir recorriendo el índice ANN hasta reunir `LIMIT` filas que
+# cumplan el WHERE (escaneo iterativo); sin eso, un filtro selectivo devuelve menos de k filas. En
+# versiones anteriores el SET falla: lo recordamos y no lo volvemos a intentar.
+# English: pgvector >= 0.8 can keep walking the ANN index until it gathers `LIMIT` rows that match
+# the WHERE (iterative scan); without it, a selective filter returns fewer than k rows. On older
+# versions the SET fails: we remember that and don't try again.
+def enable_iterative_scan(cur):
+    global _iterative_scan_supported
+    if _iterative_scan_supported is False:
+        return False
+    cur.execute("SAVEPOINT iterative_scan")
+    try:
+        for statement in ITERATIVE_SCAN_SETTINGS:
+            cur.execute(statement)
+        cur.execute("RELEASE SAVEPOINT iterative_scan")
+        _iterative_scan_supported = True
+    except psycopg2.Error:
+        cur.execute("ROLLBACK TO SAVEPOINT iterative_scan")
+        _iterative_scan_supported = False
+    return _iterative_scan_supported
+
+
+# Español: Los k vecinos de `book_id` que cumplen el filtro (con `book_id` None, los de un vector
+# cualquiera, p. ej. el de una búsqueda de texto). El CTE materializado vuelve a ordenar por
+# distancia, porque ivfflat solo admite el escaneo iterativo con orden relajado.
+# English: The k neighbours of `book_id` that match the filter (with `book_id` None, those of any
+# vector, e.g. a text search's). The materialized CTE sorts by distance again, because ivfflat
+# only supports iterative scans with relaxed ordering.
+def filtered_neighbors(cur, book_id, book_vector, book_filter, k=5):
+    enable_iterative_scan(cur)
+    where, params = book_filter.sql()
+    cur.execute(f"""
+        WITH candidates AS MATERIALIZED (
+            SELECT id, titolo, autore, synopsis, collocazione, anno, embedding <=> %s::vector AS distance
+            FROM books
+            WHERE id IS DISTINCT FROM %s AND {where}
+            ORDER BY embedding <=> %s::vector
+            LIMIT %s
+        )
+        SELECT id, titolo, autore, synopsis, collocazione, anno
+        FROM candidates
+        ORDER BY distance
+    """, [book_vector, book_id] + params + [book_vector, k])
+    return cur.fetchall()
+
+
+# Español: Versión por lotes para /api/recomend_batch con VECTOR_ENGINE=pgvector: los k vecinos de
+# cada libro de `book_ids` (sin él mismo) en una sola consulta, con un LATERAL por libro que usa el
+# índice ANN. Devuelve una lista por libro, en el orden de `book_ids`, con la similitud coseno en
+# `score` como el motor en memoria.
+# English: Batch version for /api/recomend_batch with VECTOR_ENGINE=pgvector: the k neighbours of
+# every book in `book_ids` (without itself) in a single query, with one LATERAL per book that uses
+# the ANN index. Returns one list per book, in `book_ids`' order, with the cosine similarity in
+# `score` like the in-memory engine.
+def batch_neighbors(cur, book_ids, book_filter=None, k=5):
+    if not book_ids:
+        return []
+    where, params = "TRUE", []
+    if book_filter is not None:
+        enable_iterative_scan(cur)
+        where, params = book_filter.sql()
+    cur.execute(f"""
+        SELECT q.idx, n.id, n.titolo, n.autore, n.synopsis, n.collocazione, n.anno, 1 - n.distance AS score
+        FROM unnest(%s::bigint[]) WITH ORDINALITY AS q(book_id, idx)
+        JOIN books source ON source.id = q.book_id
+        CROSS JOIN LATERAL (
+            SELECT id, titolo, autore, synopsis, collocazione, anno, embedding <=> source.embedding AS distance
+            FROM books
+            WHERE id != source.id AND {where}
+            ORDER BY embedding <=> source.embedding
+            LIMIT %s
+        ) n
+        ORDER BY q.idx, n.distance
+    """, [list(book_ids)] + params + [k])
+    results = [[] for _ in book_ids]
+    for row in cur.fetchall():
+        book = dict(row)
+        results[book.pop("idx") - 1].append(book)
+    return results
+
+
+# Español: Los k vecinos de un vector cualquiera (p. ej. el vector medio de una lista), sin los
+# libros de `exclude_ids`, con la similitud coseno en `score`.
+# English: The k neighbours of any vector (e.g. a list's mean vector), without the books in
+# `exclude_ids`, with the cosine similarity in `score`.
+def vector_neighbors(cur, vector, exclude_ids=(), book_filter=None, k=5):
+    where, params = "TRUE", []
+    if book_filter is not None:
+        enable_iterative_scan(cur)
+        where, params = book_filter.sql()
+    cur.execute(f"""
+        SELECT id, titolo, autore, synopsis, collocazione, anno, 1 - (embedding <=> %s::vector) AS score
+        FROM books
+        WHERE NOT (id = ANY(%s::bigint[])) AND {where}
+        ORDER BY embedding <=> %s::vector
+        LIMIT %s
+    """, [vector, list(exclude_ids)] + params + [vector, k])
+    return [dict(row) for row in cur.fetchall()]
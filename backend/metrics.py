@@ -0,0 +1,180 @@
+# Español: Instrumentación de la ruta caliente. RequestTimings acumula el tiempo de cada etapa de
+# una petición (verificación de Firebase, conexión, búsqueda por título, consulta vectorial,
+# Gemini) y lo formatea como cabecera Server-Timing. Counter e Histogram son un registro mínimo
+# que se exporta en formato de texto de Prometheus para /metrics, sin dependencias extra.
+# English: Hot-path instrumentation. RequestTimings accumulates the time of every stage of a
+# request (Firebase verification, connection, title lookup, vector query, Gemini) and formats it
+# as a Server-Timing header. Counter and Histogram are a minimal registry exported in Prometheus
+# text format for /metrics, with no extra dependencies.
+#
+# Español: Cada worker de gunicorn tiene su propio registro, así que los valores son por proceso
+# (la etiqueta `pid` permite distinguirlos o sumarlos en Prometheus).
+# English: Each gunicorn worker has its own registry, so values are per process (the `pid` label
+# lets Prometheus tell them apart or sum them).
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total=None):
+        parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        parts.append(f"total;dur={(self.total() if total is None else total) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self, extra=()):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_labels(self.labelnames, key, extra)} {_number(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self, extra=()):
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = (("le", _number(bound)),)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, tuple(extra) + le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key, extra)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key, extra)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    # Español: `snapshots` son estadísticas leídas en el momento (pool, caché de tokens):
+    # (prefijo, diccionario, claves acumulativas). Las acumulativas se exportan como counter y el
+    # resto como gauge.
+    # English: `snapshots` are statistics read on the spot (pool, token cache): (prefix,
+    # dictionary, cumulative keys). Cumulative keys are exported as counters and the rest as gauges.
+    def render(self, snapshots=()):
+        extra = (("pid", os.getpid()),)
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples(extra))
+        for prefix, stats, cumulative in snapshots:
+            for key, value in sorted(stats.items()):
+                if not isinstance(value, (int, float)):
+                    continue
+                # Español: Los contadores acaban en _total, sin duplicarlo si la clave ya lo lleva.
+                # English: Counters end in _total, without doubling it if the key already has it.
+                name = f"{prefix}_{key}"
+                if key in cumulative and not name.endswith("_total"):
+                    name += "_total"
+                lines.append(f"# TYPE {name} {'counter' if key in cumulative else 'gauge'}")
+                lines.append(f"{name}{_labels((), (), extra)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Duración de las peticiones HTTP por ruta.", ("route", "method", "status"))
+STAGE_SECONDS = REGISTRY.histogram(
+    "request_stage_duration_seconds", "Duración de cada etapa de la petición.", ("route", "stage"))
+REQUEST_ERRORS = REGISTRY.counter(
+    "http_request_errors_total", "Peticiones con estado >= 400 por ruta y tipo de error.", ("route", "status", "error"))
+DEEP_DIVE_MISMATCHES = REGISTRY.counter(
+    "deep_dive_delimiter_mismatch_total",
+    "Respuestas de Gemini cuyo número de análisis separados por '|||' no coincide con las recomendaciones.",
+    ("route",))
@@ -0,0 +1,137 @@
+# Español: Tabla de vecinos precalculada. El catálogo solo cambia cuando se ejecuta
+# populate_db.py, así que calculamos allí, de una vez, los K vecinos de cada libro y
+# /api/recomend los lee con una única búsqueda por índice.
+# English: Precomputed neighbour table. The catalog only changes when populate_db.py runs, so we
+# compute every book's K neighbours there, once, and /api/recomend reads them with a single
+# index lookup.
+import os
+import time
+
+import numpy as np
+import psycopg2.errors
+import psycopg2.extras
+
+NEIGHBORS_DDL = """
+    CREATE TABLE IF NOT EXISTS book_neighbors (
+        book_id BIGINT NOT NULL REFERENCES books (id) ON DELETE CASCADE,
+        rank SMALLINT NOT NULL,
+        neighbor_id BIGINT NOT NULL REFERENCES books (id) ON DELETE CASCADE,
+        score REAL NOT NULL,
+        PRIMARY KEY (book_id, rank)
+    )
+"""
+
+
+def _normalize(block):
+    block = np.asarray(block, dtype=np.float32)
+    norms = np.linalg.norm(block, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return block / norms
+
+
+# Español: Recorre la matriz en bloques de filas y de columnas: cada paso multiplica un bloque de
+# consultas por un bloque del catálogo y fusiona el resultado con el top-k que lleva acumulado.
+# Así la memoria depende solo de `block_size`, no del tamaño del catálogo, y `embeddings` puede
+# ser un np.memmap más grande que la RAM. Devuelve tuplas (book_id, rank, neighbor_id, score).
+# English: Walks the matrix in row and column blocks: every step multiplies a block of queries by
+# a block of the catalog and merges the result into the running top-k. Memory therefore depends
+# only on `block_size`, not on catalog size, and `embeddings` may be an np.memmap larger than
+# RAM. Yields (book_id, rank, neighbor_id, score) tuples.
+def compute_neighbors(ids, embeddings, k=20, block_size=1024):
+    ids = np.asarray(ids, dtype=np.int64)
+    n = len(ids)
+    k = min(k, n - 1)
+    if k <= 0:
+        return
+
+    for row_start in range(0, n, block_size):
+        row_end = min(row_start + block_size, n)
+        queries = _normalize(embeddings[row_start:row_end])
+        best_scores = np.full((row_end - row_start, k), -np.inf, dtype=np.float32)
+        best_index = np.zeros((row_end - row_start, k), dtype=np.int64)
+
+        for col_start in range(0, n, block_size):
+            col_end = min(col_start + block_size, n)
+            scores = queries @ _normalize(embeddings[col_start:col_end]).T
+
+            # Español: Un libro nunca es vecino de sí mismo (el `WHERE id != %s` de la consulta en vivo).
+            # English: A book is never its own neighbour (the live query's `WHERE id != %s`).
+            overlap_start, overlap_end = max(row_start, col_start), min(row_end, col_end)
+            if overlap_start < overlap_end:
+                diagonal = np.arange(overlap_start, overlap_end)
+                scores[diagonal - row_start, diagonal - col_start] = -np.inf
+
+            merged_scores = np.concatenate([best_scores, scores], axis=1)
+            merged_index = np.concatenate(
+                [best_index, np.broadcast_to(np.arange(col_start, col_end), scores.shape)], axis=1)
+            keep = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(merged_scores, keep, axis=1)
+            best_index = np.take_along_axis(merged_index, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_index = np.take_along_axis(best_index, order, axis=1)
+        for offset in range(row_end - row_start):
+            book_id = int(ids[row_start + offset])
+            for rank in range(k):
+                yield book_id, rank + 1, int(ids[best_index[offset, rank]]), float(best_scores[offset, rank])
+
+
+# Español: Reconstruye la tabla dentro de la transacción de populate_db.py, así la API nunca ve
+# una tabla a medias.
+# English: Rebuilds the table inside populate_db.py's transaction, so the API never sees a
+# half-written table.
+def rebuild_neighbors(cur, ids, embeddings, k=20, block_size=1024, page_size=5000):
+    cur.execute(NEIGHBORS_DDL)
+    cur.execute("DELETE FROM book_neighbors")
+    rows = compute_neighbors(ids, embeddings, k=k, block_size=block_size)
+    total = 0
+    while True:
+        page = [row for _, row in zip(range(page_size), rows)]
+        if not page:
+            break
+        psycopg2.extras.execute_values(
+            cur, "INSERT INTO book_neighbors (book_id, rank, neighbor_id, score) VALUES %s", page,
+            page_size=page_size)
+        total += len(page)
+    return total
+
+
+_missing_since = None
+
+
+def neighbors_table_enabled():
+    return os.getenv("NEIGHBORS_TABLE", "on").strip().lower() not in ("off", "0", "false")
+
+
+# Español: Los k vecinos precalculados de un libro, o None si el libro no está en la tabla (y hay
+# que usar la consulta en vivo). Si la tabla aún no existe, no lo volvemos a intentar durante un
+# minuto para no pagar un error en cada petición.
+# English: A book's k precomputed neighbours, or None if the book is not in the table (and the
+# live query must be used). If the table doesn't exist yet, we don't try again for a minute so we
+# don't pay for an error on every request.
+def fetch_neighbors(conn, book_id, k=5, retry_seconds=60.0):
+    global _missing_since
+    if _missing_since is not None and time.monotonic() - _missing_since < retry_seconds:
+        return None
+    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        cur.execute("""
+            SELECT b.id, b.titolo, b.autore, b.synopsis, b.collocazione, b.anno
+            FROM book_neighbors n
+            JOIN books b ON b.id = n.neighbor_id
+            WHERE n.book_id = %s
+            ORDER BY n.rank
+            LIMIT %s
+        """, (book_id, k))
+        rows = cur.fetchall()
+    except psycopg2.errors.UndefinedTable:
+        conn.rollback()
+        _missing_since = time.monotonic()
+        return None
+    finally:
+        cur.close()
+    _missing_since = None
+    if len(rows) < k:
+        return None
+    return [dict(row) for row in rows]
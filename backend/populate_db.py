@@ -4,6 +4,15 @@ from sentence_transformers import SentenceTransformer
 import numpy as np
 from dotenv import load_dotenv
 import os
+from catalog_version import bump_catalog_version
+from neighbors import rebuild_neighbors
+from bulk_load import BOOK_FIELDS, bulk_load_books, ensure_book_columns
+from embedding_cache import EmbeddingCache, row_hash, synopsis_hash
+from vector_engine import export_catalog_snapshot, parse_vector
+from catalog_snapshot import catalog_snapshot_dir, snapshot_lock
+from ann_index import drop_ann_index, ensure_ann_index, index_settings_from_env
+from filters import METADATA_INDEXES_DDL
+from title_index import TITLE_KEY_INDEX_DDL, backfill_title_keys
 
 # English: Load environment variables from the .env file
 # Español: Cargar variables de entorno desde el archivo .env
@@ -16,6 +25,34 @@ load_dotenv()
 script_dir = os.path.dirname(os.path.abspath(__file__))
 csv_file_path = os.path.join(script_dir, 'catalogo_cuveglio_estructurado.csv')
 
+MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+
+# English: POPULATE_MODE=full empties and reloads the table; POPULATE_MODE=incremental only writes what changed;
+# POPULATE_MODE=stream is a full reload that processes the CSV in chunks
+# Español: POPULATE_MODE=full vacía y recarga la tabla; POPULATE_MODE=incremental solo escribe lo que cambió;
+# POPULATE_MODE=stream es una recarga completa que procesa el CSV por trozos
+# Italiano: POPULATE_MODE=full svuota e ricarica la tabella; POPULATE_MODE=incremental scrive solo ciò che è cambiato;
+# POPULATE_MODE=stream è un ricaricamento completo che elabora il CSV a blocchi
+populate_mode = os.getenv("POPULATE_MODE", "full").strip().lower()
+# English: An unknown mode stops here, before touching the database: it must not fall back to a full reload
+# Español: Un modo desconocido se detiene aquí, antes de tocar la base de datos: no debe acabar en una recarga completa
+# Italiano: Una modalità sconosciuta si ferma qui, prima di toccare il database: non deve finire in un ricaricamento completo
+POPULATE_MODES = ('full', 'incremental', 'stream')
+if populate_mode not in POPULATE_MODES:
+    print(f"Error: POPULATE_MODE='{populate_mode}' no es válido. Usa uno de: {', '.join(POPULATE_MODES)}.")
+    exit(1)
+embedding_cache_dir = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(script_dir, 'embedding_cache'))
+rejects_path = os.getenv("LOAD_REJECTS_PATH", os.path.join(script_dir, 'rejected_rows.csv'))
+
+# English: POPULATE_MODE=stream reads, encodes and writes the CSV in chunks for large catalogs (see embedding_pipeline.py)
+# Español: POPULATE_MODE=stream lee, codifica y escribe el CSV por trozos para catálogos grandes (ver embedding_pipeline.py)
+# Italiano: POPULATE_MODE=stream legge, codifica e scrive il CSV a blocchi per cataloghi grandi (vedi embedding_pipeline.py)
+if populate_mode == 'stream':
+    from embedding_pipeline import populate_streaming
+    populate_streaming(csv_file_path, MODEL_NAME, embedding_cache_dir, rejects_path)
+    print("\n¡Éxito! La base de datos 'recommender' ha sido poblada con los datos de los libros.")
+    exit()
+
 # English: 1. Load the data
 # Español: 1. Cargar los datos
 # Italiano: 1. Caricare i dati
@@ -39,27 +76,21 @@ except FileNotFoundError:
 # Convert 'anno' to numeric, coercing errors to NaN (which will be NULL in DB)
 df['anno'] = pd.to_numeric(df['anno'], errors='coerce')
 
-# English: 2. Load the sentence-transformers model
-# Español: 2. Cargar el modelo de sentence-transformers
-# Italiano: 2. Caricare il modello sentence-transformers
-print("Cargando el modelo de sentence-transformers...")
-model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-print("Modelo cargado.")
-
-# English: 3. Generate the vectors for the synopses
-# Español: 3. Generar los vectores para las sinopsis
-# Italiano: 3. Generare i vettori per le sinossi
-print("Generando vectores para las sinopsis...")
 # English: Ensure the synopsis is a string
 # Español: Asegurarse de que la sinopsis sea un string
 # Italiano: Assicurarsi che la sinossi sia una stringa
 df['synopsis'] = df['synopsis'].astype(str)
-embeddings = model.encode(df['synopsis'].tolist(), show_progress_bar=True)
-print(f"Se generaron {len(embeddings)} vectores.")
 
-# English: 4. Connect to the database using the DATABASE_URL environment variable
-# Español: 4. Conectarse a la base de datos usando la variable de entorno DATABASE_URL
-# Italiano: 4. Connettersi al database utilizzando la variabile d'ambiente DATABASE_URL
+# English: Content hashes: one per synopsis (embedding cache key) and one per whole row (change detection)
+# Español: Hashes de contenido: uno por sinopsis (clave de la caché de embeddings) y otro por fila entera (detección de cambios)
+# Italiano: Hash di contenuto: uno per sinossi (chiave della cache degli embedding) e uno per riga intera (rilevamento modifiche)
+records = df[list(BOOK_FIELDS)].to_dict('records')
+synopsis_hashes = [synopsis_hash(MODEL_NAME, synopsis) for synopsis in df['synopsis']]
+row_hashes = [row_hash(MODEL_NAME, record, BOOK_FIELDS) for record in records]
+
+# English: 2. Connect to the database using the DATABASE_URL environment variable
+# Español: 2. Conectarse a la base de datos usando la variable de entorno DATABASE_URL
+# Italiano: 2. Connettersi al database utilizzando la variabile d'ambiente DATABASE_URL
 try:
     database_url = os.getenv("DATABASE_URL")
     if not database_url:
@@ -71,45 +102,158 @@ except psycopg2.OperationalError as e:
     print(f"Error al conectar a la base de datos: {e}")
     exit()
 
-# English: Clear the table before populating to ensure a clean state
-# Español: Vaciar la tabla antes de poblarla para asegurar un estado limpio
-# Italiano: Svuotare la tabella prima di popolarla per garantire uno stato pulito
-print("Vaciando la tabla 'books'...")
-cur.execute("TRUNCATE TABLE books RESTART IDENTITY CASCADE;")
-print("Tabla 'books' vaciada.")
-
-# English: 5. Iterate and insert the data into the 'books' table
-# Español: 5. Iterar e insertar los datos en la tabla 'books'
-# Italiano: 5. Iterare e inserire i dati nella tabella 'books'
-print("Insertando libros en la base de datos...")
-for index, row in df.iterrows():
-    book_id = row['id']
-    title = row['titolo']
-    author = row['autore']
-    year = row['anno']
-    synopsis = row['synopsis']
-    collocazione = row['collocazione']
-    # English: Convert to a list for psycopg2
-    # Español: Convertir a lista para psycopg2
-    # Italiano: Convertire in una lista per psycopg2
-    embedding = embeddings[index].tolist() 
-
-    try:
-        cur.execute(
-            """INSERT INTO books (id, titolo, autore, anno, synopsis, collocazione, embedding) VALUES (%s, %s, %s, %s, %s, %s, %s)""",
-            (book_id, title, author, year, synopsis, collocazione, embedding)
-
-        )
-        print(f"Insertado: '{title}'")
-    except Exception as e:
-        print(f"Error al insertar '{title}': {e}")
-        # English: Roll back the transaction in case of an error
-        # Español: Revertir la transacción en caso de error
-        # Italiano: Annullare la transazione in caso di errore
-        conn.rollback() 
-        cur.close()
-        conn.close()
-        exit()
+ensure_book_columns(conn)
+
+# English: In incremental mode, only rows whose hash changed are written, and rows missing from the CSV are deleted
+# Español: En modo incremental solo se escriben las filas cuyo hash cambió, y se borran las que ya no están en el CSV
+# Italiano: In modalità incrementale si scrivono solo le righe il cui hash è cambiato, e si cancellano quelle assenti dal CSV
+print(f"Modo de carga: {populate_mode}")
+changed = np.ones(len(df), dtype=bool)
+deleted_ids = []
+if populate_mode == 'incremental':
+    cur.execute("SELECT id, row_hash FROM books")
+    existing = dict(cur.fetchall())
+    csv_ids = set()
+    for i, record in enumerate(records):
+        try:
+            book_id = int(record['id'])
+        except (TypeError, ValueError):
+            continue
+        csv_ids.add(book_id)
+        changed[i] = existing.get(book_id) != row_hashes[i]
+    deleted_ids = sorted(set(existing) - csv_ids)
+    print(f"{int(changed.sum())} filas nuevas o modificadas, {len(df) - int(changed.sum())} sin cambios, {len(deleted_ids)} a borrar.")
+
+# English: 3. Get the vectors: from the embedding cache, from the database (unchanged rows), or by encoding them
+# Español: 3. Obtener los vectores: de la caché de embeddings, de la base de datos (filas sin cambios) o codificándolos
+# Italiano: 3. Ottenere i vettori: dalla cache degli embedding, dal database (righe invariate) o codificandoli
+embedding_cache = EmbeddingCache(embedding_cache_dir)
+if populate_mode == 'incremental':
+    embeddings, have_vector = embedding_cache.lookup(synopsis_hashes)
+    missing_unchanged = ~have_vector & ~changed
+    if missing_unchanged.any():
+        cur.execute("SELECT id, embedding FROM books WHERE id = ANY(%s)",
+                    ([int(book_id) for book_id in df['id'][missing_unchanged]],))
+        stored = {book_id: parse_vector(vector) for book_id, vector in cur.fetchall() if vector is not None}
+        for i in np.flatnonzero(missing_unchanged):
+            vector = stored.get(int(records[i]['id']))
+            if vector is not None:
+                if embeddings.shape[1] == 0:
+                    embeddings = np.zeros((len(df), len(vector)), dtype=np.float32)
+                embeddings[i] = vector
+                have_vector[i] = True
+        embedding_cache.add([synopsis_hashes[i] for i in np.flatnonzero(missing_unchanged & have_vector)],
+                            embeddings[missing_unchanged & have_vector])
+    to_encode = ~have_vector
+else:
+    embeddings = None
+    to_encode = np.ones(len(df), dtype=bool)
+
+encoded_count = int(to_encode.sum())
+if encoded_count:
+    # English: Load the sentence-transformers model only if there is something to encode
+    # Español: Cargar el modelo de sentence-transformers solo si hay algo que codificar
+    # Italiano: Caricare il modello sentence-transformers solo se c'è qualcosa da codificare
+    print("Cargando el modelo de sentence-transformers...")
+    model = SentenceTransformer(MODEL_NAME)
+    print("Modelo cargado.")
+
+    print(f"Generando vectores para {encoded_count} sinopsis...")
+    new_vectors = model.encode(df['synopsis'][to_encode].tolist(), show_progress_bar=True)
+    if embeddings is None or embeddings.shape[1] == 0:
+        embeddings = np.zeros((len(df), new_vectors.shape[1]), dtype=np.float32)
+    embeddings[to_encode] = new_vectors
+    embedding_cache.add([synopsis_hashes[i] for i in np.flatnonzero(to_encode)], new_vectors)
+    print(f"Se generaron {len(new_vectors)} vectores.")
+embedding_cache.save(keep=synopsis_hashes)
+
+batch_size = int(os.getenv("LOAD_BATCH_SIZE", "5000"))
+if populate_mode == 'incremental':
+    # English: 4. Upsert the changed rows through a staging table and delete the removed ones, without emptying 'books'
+    # Español: 4. Actualizar las filas cambiadas a través de una tabla de staging y borrar las eliminadas, sin vaciar 'books'
+    # Italiano: 4. Aggiornare le righe modificate tramite una tabella di staging e cancellare quelle rimosse, senza svuotare 'books'
+    cur.execute("CREATE TEMP TABLE books_staging (LIKE books INCLUDING DEFAULTS) ON COMMIT DROP")
+    changed_rows = np.flatnonzero(changed)
+    print(f"Cargando {len(changed_rows)} filas en la tabla de staging (lotes de {batch_size})...")
+    loaded_changed, load_report = bulk_load_books(
+        cur, df.iloc[changed_rows], embeddings[changed_rows], batch_size=batch_size,
+        rejects_path=rejects_path, table='books_staging', row_hashes=[row_hashes[i] for i in changed_rows])
+    columns = ', '.join(list(BOOK_FIELDS) + ['titolo_key', 'embedding', 'row_hash'])
+    updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in list(BOOK_FIELDS)[1:] + ['titolo_key', 'embedding', 'row_hash'])
+    cur.execute(f"INSERT INTO books ({columns}) SELECT {columns} FROM books_staging ON CONFLICT (id) DO UPDATE SET {updates}")
+    if deleted_ids:
+        cur.execute("DELETE FROM books WHERE id = ANY(%s)", (deleted_ids,))
+    loaded = ~changed
+    loaded[changed_rows[loaded_changed]] = True
+else:
+    # English: 4. Clear the table before populating to ensure a clean state
+    # Español: 4. Vaciar la tabla antes de poblarla para asegurar un estado limpio
+    # Italiano: 4. Svuotare la tabella prima di popolarla per garantire uno stato pulito
+    print("Vaciando la tabla 'books'...")
+    cur.execute("TRUNCATE TABLE books RESTART IDENTITY CASCADE;")
+    drop_ann_index(cur)
+    print("Tabla 'books' vaciada.")
+
+    # English: 5. Bulk load the rows with COPY; rejected rows go to a side file
+    # Español: 5. Cargar las filas en bloque con COPY; las filas rechazadas van a un fichero aparte
+    # Italiano: 5. Caricare le righe in blocco con COPY; le righe rifiutate vanno in un file a parte
+    print(f"Cargando libros en la base de datos (lotes de {batch_size})...")
+    loaded, load_report = bulk_load_books(cur, df, embeddings, batch_size=batch_size,
+                                          rejects_path=rejects_path, row_hashes=row_hashes)
+print(load_report.summary())
+if load_report.rows_rejected:
+    print(f"Filas rechazadas guardadas en '{rejects_path}'.")
+print(f"Embeddings reutilizados: {len(df) - encoded_count}, recodificados: {encoded_count}, filas borradas: {len(deleted_ids)}.")
+
+# English: Create (or rebuild after a full reload) the ANN index on the embeddings, configured with ANN_INDEX, HNSW_* and IVFFLAT_LISTS
+# Español: Crear (o reconstruir tras una recarga completa) el índice ANN de los embeddings, configurado con ANN_INDEX, HNSW_* e IVFFLAT_LISTS
+# Italiano: Creare (o ricostruire dopo un ricaricamento completo) l'indice ANN degli embedding, configurato con ANN_INDEX, HNSW_* e IVFFLAT_LISTS
+ann_settings = index_settings_from_env()
+print(f"Preparando el índice ANN ({ann_settings['method']})...")
+ann_seconds = ensure_ann_index(cur, ann_settings, rebuild=populate_mode != 'incremental')
+print(f"Índice ANN listo en {ann_seconds:.2f}s.")
+
+# English: Indexes on anno, autore and collocazione for the filtered recommendations
+# Español: Índices sobre anno, autore y collocazione para las recomendaciones con filtros
+# Italiano: Indici su anno, autore e collocazione per le raccomandazioni con filtri
+cur.execute(METADATA_INDEXES_DDL)
+
+# English: Normalized title key (case-folded, trimmed, without accents) for the indexed title lookup of
+# /api/recomend and /api/deep_dive; rows loaded before the column existed get it here
+# Español: Clave normalizada del título (minúsculas, sin espacios sobrantes ni acentos) para la búsqueda
+# indexada de títulos de /api/recomend y /api/deep_dive; las filas cargadas antes de que existiera la columna la reciben aquí
+# Italiano: Chiave normalizzata del titolo (minuscole, senza spazi superflui né accenti) per la ricerca
+# indicizzata dei titoli di /api/recomend e /api/deep_dive; le righe caricate prima che esistesse la colonna la ricevono qui
+backfilled = backfill_title_keys(cur)
+cur.execute(TITLE_KEY_INDEX_DDL)
+print(f"Claves de título listas ({backfilled} filas completadas).")
+
+# English: 6. Precompute the top-K neighbours of every book for /api/recomend
+# Español: 6. Precalcular los K vecinos más cercanos de cada libro para /api/recomend
+# Italiano: 6. Precalcolare i K vicini più prossimi di ogni libro per /api/recomend
+neighbors_k = int(os.getenv("NEIGHBORS_K", "20"))
+neighbors_block_size = int(os.getenv("NEIGHBORS_BLOCK_SIZE", "1024"))
+print(f"Calculando los {neighbors_k} vecinos de cada libro...")
+neighbor_rows = rebuild_neighbors(cur, df['id'].to_numpy()[loaded], embeddings[loaded], k=neighbors_k, block_size=neighbors_block_size)
+print(f"Tabla 'book_neighbors' reconstruida con {neighbor_rows} filas.")
+
+# English: Bump the catalog version so the API workers reload their in-memory data
+# Español: Incrementar la versión del catálogo para que los workers de la API recarguen sus datos en memoria
+# Italiano: Incrementare la versione del catalogo affinché i worker dell'API ricarichino i dati in memoria
+catalog_version = bump_catalog_version(cur)
+print(f"Versión del catálogo: {catalog_version}")
+
+# English: With CATALOG_SNAPSHOT_DIR, export the new version's binary snapshot (embeddings and compact metadata) that the
+# API workers memory-map and share; it's written before the commit, so it's ready when the workers see the new version
+# Español: Con CATALOG_SNAPSHOT_DIR, exportar la foto binaria de la nueva versión (embeddings y metadatos compactos) que los
+# workers de la API mapean en memoria y comparten; se escribe antes del commit, así está lista cuando los workers ven la nueva versión
+# Italiano: Con CATALOG_SNAPSHOT_DIR, esportare la foto binaria della nuova versione (embedding e metadati compatti) che i
+# worker dell'API mappano in memoria e condividono; si scrive prima del commit, così è pronta quando i worker vedono la nuova versione
+snapshot_dir = catalog_snapshot_dir()
+if snapshot_dir:
+    with snapshot_lock(snapshot_dir):
+        manifest = export_catalog_snapshot(conn, snapshot_dir, catalog_version)
+    print(f"Foto del catálogo exportada en '{snapshot_dir}' ({manifest['count']} libros).")
 
 # English: Commit the changes and close the connection
 # Español: Confirmar los cambios y cerrar la conexión
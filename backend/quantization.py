@@ -0,0 +1,115 @@
+# Español: Representaciones compactas de los embeddings para el motor en memoria: float16 (la
+# mitad de bytes) e int8 con cuantización escalar por dimensión (la cuarta parte). Las consultas
+# eligen candidatos con la matriz compacta y después vuelven a puntuar una lista corta con los
+# vectores float32 originales, así el resultado final apenas cambia respecto a la búsqueda exacta.
+# English: Compact embedding representations for the in-memory engine: float16 (half the bytes)
+# and int8 with per-dimension scalar quantization (a quarter). Queries pick candidates with the
+# compact matrix and then rescore a short list with the original float32 vectors, so the final
+# result barely changes compared to exact search.
+import numpy as np
+
+PRECISIONS = ("float32", "float16", "int8")
+
+
+class ScalarQuantizer:
+    # Español: Cada dimensión se reparte en 256 niveles entre su mínimo y su máximo en el
+    # catálogo: x ≈ (código + 128) * scale + lo. `lo` y `scale` son los parámetros que se guardan
+    # junto a los códigos (en el manifest de la foto del catálogo, ver catalog_snapshot.py).
+    # English: Every dimension is split into 256 levels between its catalog minimum and maximum:
+    # x ≈ (code + 128) * scale + lo. `lo` and `scale` are the parameters stored next to the codes
+    # (in the catalog snapshot's manifest, see catalog_snapshot.py).
+    def __init__(self, lo, scale):
+        self.lo = np.asarray(lo, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def fit(cls, matrix):
+        lo = matrix.min(axis=0)
+        hi = matrix.max(axis=0)
+        scale = (hi - lo) / 255.0
+        scale[scale == 0] = 1.0
+        return cls(lo, scale)
+
+    def encode(self, matrix):
+        codes = np.rint((matrix - self.lo) / self.scale) - 128
+        return np.clip(codes, -128, 127).astype(np.int8)
+
+    def decode(self, codes):
+        return (codes.astype(np.float32) + 128) * self.scale + self.lo
+
+    def to_dict(self):
+        return {"lo": self.lo.tolist(), "scale": self.scale.tolist()}
+
+    @classmethod
+    def from_dict(cls, params):
+        return cls(params["lo"], params["scale"])
+
+
+class CompactMatrix:
+    def __init__(self, matrix, precision="int8", block_size=16384):
+        if precision not in ("float16", "int8"):
+            raise ValueError(f"Precisión compacta desconocida: '{precision}'.")
+        self.precision = precision
+        self.block_size = block_size
+        self.quantizer = None
+        if precision == "float16":
+            self.codes = np.ascontiguousarray(matrix, dtype=np.float16)
+        else:
+            self.quantizer = ScalarQuantizer.fit(matrix)
+            self.codes = np.ascontiguousarray(self.quantizer.encode(matrix))
+
+    # Español: Códigos int8 ya calculados (p. ej. los mapeados de la foto del catálogo) con sus
+    # parámetros: no hay que volver a ajustar ni a codificar la matriz en cada worker.
+    # English: Already computed int8 codes (e.g. the catalog snapshot's mapped ones) with their
+    # parameters: the matrix doesn't have to be refitted and re-encoded in every worker.
+    @classmethod
+    def from_codes(cls, codes, quantizer, block_size=16384):
+        compact = cls.__new__(cls)
+        compact.precision = "int8"
+        compact.block_size = block_size
+        compact.quantizer = quantizer
+        compact.codes = codes
+        return compact
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes
+
+    # Español: Puntuaciones aproximadas de `query` contra todo el catálogo. Se convierte por bloques
+    # a float32 para no crear una copia float32 entera en cada consulta. Con int8 la parte constante
+    # de la cuantización sale del producto: c·(scale*q) + (128*scale + lo)·q.
+    # English: Approximate scores of `query` against the whole catalog. Blocks are converted to
+    # float32 so a full float32 copy isn't created on every query. With int8 the constant part of
+    # the quantization comes out of the product: c·(scale*q) + (128*scale + lo)·q.
+    def scores(self, query):
+        query = np.asarray(query, dtype=np.float32)
+        if self.quantizer is not None:
+            weights = self.quantizer.scale * query
+            bias = float((128 * self.quantizer.scale + self.quantizer.lo) @ query)
+        else:
+            weights, bias = query, 0.0
+        out = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), self.block_size):
+            block = self.codes[start:start + self.block_size].astype(np.float32)
+            out[start:start + self.block_size] = block @ weights + bias
+        return out
+
+
+# Español: Vuelve a puntuar con los vectores completos los `len(candidates)` mejores candidatos y
+# devuelve los k mejores (índices y puntuaciones exactas). `full_matrix` puede ser un np.memmap:
+# solo se leen las filas de los candidatos.
+# English: Rescores the `len(candidates)` best candidates with the full vectors and returns the
+# best k (indices and exact scores). `full_matrix` may be an np.memmap: only the candidate rows
+# are read.
+def rescore(full_matrix, query, candidates, k):
+    candidates = np.sort(candidates)
+    exact = np.asarray(full_matrix[candidates], dtype=np.float32) @ np.asarray(query, dtype=np.float32)
+    k = min(k, len(candidates))
+    if k <= 0:
+        return candidates[:0], exact[:0]
+    best = np.argpartition(-exact, k - 1)[:k]
+    best = best[np.argsort(-exact[best], kind="stable")]
+    return candidates[best], exact[best]
@@ -0,0 +1,514 @@
+# Español: Codificador de consultas de texto libre para /api/search ("libros sobre..."). Hasta ahora
+# el modelo de sentence-transformers solo vivía en populate_db.py, así que solo se podía buscar a
+# partir de un título existente. Aquí cada worker carga el modelo una sola vez y lo precalienta;
+# las peticiones simultáneas se agrupan en una sola llamada al modelo (micro-lotes dentro de una
+# ventana de pocos milisegundos) y las consultas repetidas salen de una caché LRU.
+# English: Free-text query encoder for /api/search ("books about..."). Until now the
+# sentence-transformers model only lived in populate_db.py, so searches could only start from an
+# existing title. Here each worker loads the model once and warms it up; concurrent requests are
+# grouped into a single model call (micro-batches within a window of a few milliseconds) and
+# repeated queries come from an LRU cache.
+#
+# Español: El modelo corre en un runtime de CPU optimizado (QUERY_ENCODER_RUNTIME):
+#   - onnx-int8 (por defecto): exportación ONNX con pesos cuantizados a int8, en onnxruntime;
+#   - onnx: la misma exportación en float32;
+#   - torch-int8: el modelo original con las capas lineales cuantizadas dinámicamente;
+#   - torch: el modelo original, tal cual.
+# Los runtimes ONNX solo necesitan onnxruntime y tokenizers, no torch. La exportación se hace una
+# vez, donde esté instalado sentence-transformers, y --check compara cada runtime con el original:
+#   python query_encoder.py --export query_encoder_onnx
+#   python query_encoder.py --check --runtimes onnx-int8,onnx,torch-int8
+# English: The model runs on an optimized CPU runtime (QUERY_ENCODER_RUNTIME):
+#   - onnx-int8 (default): ONNX export with int8-quantized weights, on onnxruntime;
+#   - onnx: the same export in float32;
+#   - torch-int8: the original model with dynamically quantized linear layers;
+#   - torch: the original model, as is.
+# The ONNX runtimes only need onnxruntime and tokenizers, not torch. The export is done once,
+# wherever sentence-transformers is installed, and --check compares every runtime with the original.
+# Español: La búsqueda semántica se activa con SEMANTIC_SEARCH=on; la imagen de Docker construida
+# con --build-arg SEMANTIC_SEARCH=on ya trae la exportación (requirements-export.txt) y la activa.
+# English: Semantic search is enabled with SEMANTIC_SEARCH=on; the Docker image built with
+# --build-arg SEMANTIC_SEARCH=on already ships the export (requirements-export.txt) and enables it.
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+from vector_engine import normalize_rows
+
+MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
+RUNTIMES = ("onnx-int8", "onnx", "torch-int8", "torch")
+DEFAULT_ONNX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "query_encoder_onnx")
+ONNX_METADATA_FILE = "query_encoder.json"
+ONNX_MODEL_FILES = {"onnx": "model.onnx", "onnx-int8": "model.int8.onnx"}
+
+
+# Español: La clave de una consulta: sin espacios sobrantes. No se pasa a minúsculas: el
+# tokenizador del modelo distingue mayúsculas y el vector podría cambiar.
+# English: A query's key: without extra whitespace. It isn't lowercased: the model's tokenizer is
+# case-sensitive and the vector could change.
+def normalize_query(text):
+    return " ".join((text or "").split())
+
+
+# Español: El pooling de sentence-transformers sobre los estados ocultos del transformer.
+# English: sentence-transformers' pooling over the transformer's hidden states.
+def pool_embeddings(hidden_states, attention_mask, pooling="mean", normalize=False):
+    if pooling == "cls":
+        vectors = hidden_states[:, 0]
+    else:
+        mask = attention_mask[..., None].astype(hidden_states.dtype)
+        vectors = (hidden_states * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return normalize_rows(vectors) if normalize else vectors
+
+
+class OnnxEncoder:
+    def __init__(self, model_dir=DEFAULT_ONNX_DIR, runtime="onnx-int8", threads=1):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, ONNX_METADATA_FILE), encoding="utf-8") as file:
+            self.metadata = json.load(file)
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, ONNX_MODEL_FILES[runtime]), options,
+                                                    providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+        # Español: El mismo troceado que sentence-transformers: relleno al más largo del lote y
+        # corte en max_seq_length (contando los tokens especiales).
+        # English: The same tokenization as sentence-transformers: padding to the longest in the
+        # batch and truncation at max_seq_length (special tokens included).
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.metadata["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.metadata["pad_token_id"], pad_token=self.metadata["pad_token"])
+        self.name = runtime
+
+    def encode(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        hidden_states = self.session.run(["last_hidden_state"], feeds)[0]
+        return pool_embeddings(hidden_states, attention_mask, self.metadata["pooling"], self.metadata["normalize"])
+
+
+class TorchEncoder:
+    def __init__(self, model_name=MODEL_NAME, quantize=True, threads=1):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        torch.set_num_threads(threads)
+        model = SentenceTransformer(model_name, device="cpu")
+        if quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        self.name = "torch-int8" if quantize else "torch"
+
+    def encode(self, texts):
+        vectors = self.model.encode(texts, batch_size=max(len(texts), 1), convert_to_numpy=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+# Español: Carga el runtime pedido. Si es ONNX y falta la exportación, se usa torch-int8 en su lugar.
+# English: Loads the requested runtime. If it's ONNX and the export is missing, torch-int8 is used instead.
+def load_encoder(runtime, model_dir=DEFAULT_ONNX_DIR, threads=1, model_name=MODEL_NAME):
+    if runtime not in RUNTIMES:
+        raise ValueError(f"Runtime de codificación desconocido: '{runtime}'. Opciones: {', '.join(RUNTIMES)}.")
+    if runtime in ONNX_MODEL_FILES:
+        if os.path.exists(os.path.join(model_dir, ONNX_MODEL_FILES[runtime])):
+            return OnnxEncoder(model_dir, runtime=runtime, threads=threads)
+        print(f"No se encontró la exportación ONNX en '{model_dir}'; se usa torch-int8. "
+              f"Expórtala con: python query_encoder.py --export {model_dir}")
+        runtime = "torch-int8"
+    return TorchEncoder(model_name, quantize=runtime == "torch-int8", threads=threads)
+
+
+class QueryCache:
+    # Español: LRU de vectores por consulta normalizada. Los vectores se guardan de solo lectura
+    # porque se comparten entre peticiones.
+    # English: LRU of vectors per normalized query. Vectors are stored read-only because they are
+    # shared between requests.
+    def __init__(self, max_size=2048):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return vector
+
+    def put(self, key, vector):
+        if self.max_size <= 0:
+            return
+        vector.setflags(write=False)
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+            stats["max_size"] = self.max_size
+            return stats
+
+
+class MicroBatcher:
+    # Español: Un hilo recoge las consultas que llegan durante `window` segundos desde la primera
+    # (o hasta `max_batch`) y las codifica en una sola llamada. Mientras el modelo trabaja, las
+    # nuevas se acumulan en la cola y forman el lote siguiente, así que con carga los lotes crecen
+    # solos y sin carga una consulta solo espera la ventana. Las consultas repetidas dentro de un
+    # lote se codifican una vez.
+    # English: A thread collects the queries that arrive within `window` seconds of the first one
+    # (or up to `max_batch`) and encodes them in a single call. While the model is working, new ones
+    # pile up in the queue and form the next batch, so under load batches grow on their own and
+    # without load a query only waits for the window. Repeated queries within a batch are encoded once.
+    def __init__(self, encode_batch, window=0.002, max_batch=32):
+        self.encode_batch = encode_batch
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+        self._stats = {"batches": 0, "queries": 0, "encoded": 0, "errors": 0,
+                       "encode_seconds": 0.0, "max_batch_size": 0}
+
+    def submit(self, text):
+        self._ensure_thread()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    # Español: Los hilos no sobreviven al fork de gunicorn: cada worker arranca el suyo.
+    # English: Threads don't survive gunicorn's fork: each worker starts its own.
+    def _ensure_thread(self):
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name="query-encoder", daemon=True)
+                self._thread.start()
+                self._thread_pid = os.getpid()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            start = time.perf_counter()
+            try:
+                vectors = self.encode_batch(texts)
+            except Exception as e:
+                with self._lock:
+                    self._stats["errors"] += 1
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self._stats["batches"] += 1
+                self._stats["queries"] += len(batch)
+                self._stats["encoded"] += len(texts)
+                self._stats["encode_seconds"] += seconds
+                self._stats["max_batch_size"] = max(self._stats["max_batch_size"], len(texts))
+            vectors_by_text = dict(zip(texts, vectors))
+            for text, future in batch:
+                future.set_result(vectors_by_text[text])
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["queue_size"] = self._queue.qsize()
+            return stats
+
+
+class QueryEncoder:
+    def __init__(self, runtime="onnx-int8", model_dir=DEFAULT_ONNX_DIR, threads=1, window=0.002, max_batch=32,
+                 cache_size=2048, timeout=10.0, encoder=None):
+        self.runtime = runtime
+        self.model_dir = model_dir
+        self.threads = threads
+        self.timeout = timeout
+        self.cache = QueryCache(cache_size)
+        self.batcher = MicroBatcher(self._encode_batch, window=window, max_batch=max_batch)
+        # Español: `encoder` permite pasar uno ya cargado (p. ej. para compartirlo en bench_query_encoder.py).
+        # English: `encoder` allows passing an already loaded one (e.g. to share it in bench_query_encoder.py).
+        self._encoder = encoder
+        self._load_lock = threading.Lock()
+        self.load_seconds = None
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            with self._load_lock:
+                if self._encoder is None:
+                    start = time.perf_counter()
+                    encoder = load_encoder(self.runtime, self.model_dir, self.threads)
+                    # Español: La primera inferencia reserva memoria y prepara el grafo; que no la pague un usuario.
+                    # English: The first inference allocates memory and prepares the graph; no user should pay for it.
+                    encoder.encode(["warm up"])
+                    self.load_seconds = time.perf_counter() - start
+                    print(f"Codificador de consultas '{encoder.name}' listo en {self.load_seconds:.2f}s.")
+                    self._encoder = encoder
+        return self._encoder
+
+    def _encode_batch(self, texts):
+        return self.encoder.encode(texts)
+
+    def warm(self):
+        return self.encoder
+
+    def encode(self, text):
+        key = normalize_query(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.batcher.submit(key).result(self.timeout)
+            self.cache.put(key, vector)
+        return vector
+
+    # Español: Para asgi_app.py: se espera el mismo Future del micro-lote sin bloquear el bucle de eventos.
+    # English: For asgi_app.py: the micro-batch's same Future is awaited without blocking the event loop.
+    async def encode_async(self, text):
+        key = normalize_query(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = await asyncio.wait_for(asyncio.wrap_future(self.batcher.submit(key)), self.timeout)
+            self.cache.put(key, vector)
+        return vector
+
+    def stats(self):
+        stats = self.batcher.stats()
+        stats["loaded"] = int(self._encoder is not None)
+        stats["load_seconds"] = round(self.load_seconds or 0.0, 3)
+        return stats
+
+
+_encoder = None
+_encoder_pid = None
+_warmer_pid = None
+
+
+# Español: Desactivada por defecto: necesita la exportación ONNX (ver el Dockerfile, --build-arg
+# SEMANTIC_SEARCH=on). Sin SEMANTIC_SEARCH=on, /api/search responde 503 y no se carga el modelo.
+# English: Disabled by default: it needs the ONNX export (see the Dockerfile, --build-arg
+# SEMANTIC_SEARCH=on). Without SEMANTIC_SEARCH=on, /api/search answers 503 and the model isn't loaded.
+def semantic_search_enabled():
+    return os.getenv("SEMANTIC_SEARCH", "off").strip().lower() in ("on", "1", "true")
+
+
+def get_query_encoder():
+    global _encoder, _encoder_pid
+    if _encoder is None or _encoder_pid != os.getpid():
+        _encoder = QueryEncoder(
+            runtime=os.getenv("QUERY_ENCODER_RUNTIME", "onnx-int8").strip().lower(),
+            model_dir=os.getenv("QUERY_ENCODER_DIR", DEFAULT_ONNX_DIR),
+            threads=int(os.getenv("QUERY_ENCODER_THREADS", "2")),
+            window=float(os.getenv("QUERY_BATCH_WINDOW_MS", "2")) / 1000,
+            max_batch=int(os.getenv("QUERY_BATCH_MAX", "32")),
+            cache_size=int(os.getenv("QUERY_CACHE_SIZE", "2048")),
+            timeout=float(os.getenv("QUERY_ENCODER_TIMEOUT_SECONDS", "10")))
+        _encoder_pid = os.getpid()
+    return _encoder
+
+
+# Español: Cada worker carga y precalienta el modelo en segundo plano en cuanto arranca, para que la
+# primera búsqueda no espere a la carga.
+# English: Each worker loads and warms up the model in the background as soon as it starts, so the
+# first search doesn't wait for the load.
+def ensure_query_encoder_warm():
+    global _warmer_pid
+    if _warmer_pid == os.getpid() or not semantic_search_enabled():
+        return
+    _warmer_pid = os.getpid()
+
+    def warm():
+        try:
+            get_query_encoder().warm()
+        except Exception as e:
+            print(f"No se pudo cargar el codificador de consultas: {e}")
+
+    threading.Thread(target=warm, name="query-encoder-warmer", daemon=True).start()
+
+
+# --- Exportación y comprobación de equivalencia ---
+# --- Export and equivalence check ---
+
+# Español: Exporta el transformer del modelo a ONNX (y una copia con pesos int8), junto con el
+# tokenizador y los datos de pooling que necesita OnnxEncoder. Requiere sentence-transformers,
+# torch, onnx y onnxruntime; solo se ejecuta una vez, no en los workers.
+# English: Exports the model's transformer to ONNX (and a copy with int8 weights), along with the
+# tokenizer and the pooling data OnnxEncoder needs. Requires sentence-transformers, torch, onnx
+# and onnxruntime; it only runs once, not in the workers.
+def export_onnx(output_dir=DEFAULT_ONNX_DIR, model_name=MODEL_NAME, opset=17, quantize=True):
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling, Transformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    modules = list(model)
+    if (len(modules) < 2 or not isinstance(modules[0], Transformer) or not isinstance(modules[1], Pooling)
+            or not all(isinstance(module, Normalize) for module in modules[2:])):
+        raise ValueError(f"El modelo '{model_name}' no es Transformer + Pooling (+ Normalize); no se puede exportar.")
+    pooling = modules[1].get_pooling_mode_str()
+    if pooling not in ("mean", "cls"):
+        raise ValueError(f"Pooling '{pooling}' no soportado; solo 'mean' y 'cls'.")
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = model.tokenizer
+    tokenizer.save_pretrained(output_dir)
+    sample = tokenizer(["Un romanzo giallo ambientato sul lago"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+
+    class HiddenStates(torch.nn.Module):
+        def __init__(self, transformer):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, *inputs):
+            return self.transformer(**dict(zip(input_names, inputs))).last_hidden_state
+
+    model_path = os.path.join(output_dir, ONNX_MODEL_FILES["onnx"])
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    with torch.no_grad():
+        torch.onnx.export(HiddenStates(modules[0].auto_model.eval()), tuple(sample[name] for name in input_names),
+                          model_path, input_names=input_names, output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic_axes, opset_version=opset)
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(model_path, os.path.join(output_dir, ONNX_MODEL_FILES["onnx-int8"]),
+                         weight_type=QuantType.QInt8)
+
+    metadata = {
+        "model_name": model_name,
+        "pooling": pooling,
+        "normalize": len(modules) > 2,
+        "max_seq_length": model.max_seq_length,
+        "pad_token_id": tokenizer.pad_token_id,
+        "pad_token": tokenizer.pad_token,
+        "dimension": model.get_sentence_embedding_dimension(),
+    }
+    with open(os.path.join(output_dir, ONNX_METADATA_FILE), "w", encoding="utf-8") as file:
+        json.dump(metadata, file, indent=2)
+    return metadata
+
+
+# Español: Consultas de ejemplo como las que escribiría un usuario, en los idiomas del catálogo.
+# English: Sample queries like the ones a user would type, in the catalog's languages.
+SAMPLE_QUERIES = [
+    "libri sul mare", "un giallo ambientato a Milano", "romanzo storico sulla seconda guerra mondiale",
+    "storie di amicizia tra ragazzi", "fantascienza con viaggi nel tempo", "biografia di un musicista",
+    "novela de misterio con un detective", "libros sobre la familia y la memoria", "poesia d'amore",
+    "a thriller about a missing child", "Resistenza partigiana", "viaggio in India", "ricette della nonna",
+]
+
+
+# Español: Compara cada runtime con el modelo original en float32: similitud coseno entre los
+# vectores de cada texto y coincidencia del top-k de cada consulta sobre el catálogo (codificado
+# con el original). Devuelve un informe por runtime.
+# English: Compares each runtime with the original float32 model: cosine similarity between each
+# text's vectors and top-k agreement of each query over the catalog (encoded with the original).
+# Returns a report per runtime.
+def check_equivalence(runtimes, texts, catalog_texts, model_dir=DEFAULT_ONNX_DIR, k=10):
+    reference = TorchEncoder(quantize=False)
+    expected = reference.encode(texts)
+    catalog = normalize_rows(reference.encode(catalog_texts)) if catalog_texts else None
+    k = min(k, len(catalog_texts))
+
+    def top_k(vectors):
+        scores = normalize_rows(vectors) @ catalog.T
+        return np.argsort(-scores, axis=1)[:, :k]
+
+    reports = []
+    for runtime in runtimes:
+        encoder = load_encoder(runtime, model_dir)
+        got = encoder.encode(texts)
+        cosines = np.sum(normalize_rows(expected) * normalize_rows(got), axis=1)
+        report = {
+            "runtime": encoder.name,
+            "texts": len(texts),
+            "min_cosine": round(float(cosines.min()), 5),
+            "mean_cosine": round(float(cosines.mean()), 5),
+            "max_abs_diff": round(float(np.abs(expected - got).max()), 5),
+        }
+        if catalog is not None and k:
+            overlaps = [len(set(a) & set(b)) / k for a, b in zip(top_k(expected), top_k(got))]
+            report[f"top{k}_overlap"] = round(float(np.mean(overlaps)), 4)
+            report[f"min_top{k}_overlap"] = round(float(np.min(overlaps)), 4)
+        reports.append(report)
+    return reports
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Exporta el codificador de consultas y lo compara con el original.")
+    parser.add_argument("--export", metavar="DIR", default=None, help="Exporta el modelo a ONNX en esta carpeta.")
+    parser.add_argument("--no-quantize", action="store_true", help="Con --export, no genera model.int8.onnx.")
+    parser.add_argument("--check", action="store_true", help="Compara los runtimes con el modelo original.")
+    parser.add_argument("--model-dir", default=DEFAULT_ONNX_DIR)
+    parser.add_argument("--runtimes", default="onnx-int8,onnx,torch-int8")
+    parser.add_argument("--csv", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                      "catalogo_cuveglio_estructurado.csv"),
+                        help="Catálogo cuyas sinopsis sirven de textos de prueba y de catálogo para el top-k.")
+    parser.add_argument("--limit", type=int, default=200, help="Sinopsis del catálogo usadas en la comprobación.")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--min-cosine", type=float, default=0.98,
+                        help="Similitud mínima con el original para dar un runtime por equivalente.")
+    args = parser.parse_args()
+
+    if args.export:
+        metadata = export_onnx(args.export, quantize=not args.no_quantize)
+        print(f"Modelo exportado en '{args.export}': {json.dumps(metadata)}")
+        args.model_dir = args.export
+    if not args.check:
+        sys.exit(0)
+
+    import pandas as pd
+
+    synopses = []
+    if args.csv and os.path.exists(args.csv):
+        df = pd.read_csv(args.csv, sep='|', quotechar='"', doublequote=True, on_bad_lines='skip')
+        synopses = df['synopsis'].dropna().astype(str).head(args.limit).tolist()
+    reports = check_equivalence([runtime.strip() for runtime in args.runtimes.split(",") if runtime.strip()],
+                                SAMPLE_QUERIES + synopses, synopses, model_dir=args.model_dir, k=args.k)
+    equivalent = True
+    for report in reports:
+        print(json.dumps(report))
+        equivalent &= report["min_cosine"] >= args.min_cosine
+    sys.exit(0 if equivalent else 1)
@@ -0,0 +1,151 @@
+# Español: Carga de los SDK pesados (firebase_admin y google.generativeai). Importarlos e
+# inicializarlos cuesta cerca de un segundo y cada worker de gunicorn lo paga por separado al
+# importar app.py. Con SDK_INIT=lazy la importación y la inicialización se aplazan hasta el primer
+# uso (o hasta el hilo que las precarga tras la primera petición del worker), así el worker empieza
+# a atender enseguida. Con SDK_INIT=eager (por defecto) se cargan al importar, como siempre.
+# En ambos modos cada etapa queda medida: sale en una línea de log JSON y en /metrics (startup_*).
+# English: Loading of the heavy SDKs (firebase_admin and google.generativeai). Importing and
+# initializing them costs about a second and every gunicorn worker pays it separately when importing
+# app.py. With SDK_INIT=lazy the import and initialization are deferred until first use (or until
+# the thread that preloads them after the worker's first request), so the worker starts serving
+# right away. With SDK_INIT=eager (default) they are loaded on import, as always.
+# In both modes every stage is timed: it goes out in a JSON log line and in /metrics (startup_*).
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from deep_dive_prompt import GEMINI_MODEL_NAME, GEMINI_SYSTEM_INSTRUCTION
+from token_cache import ensure_public_keys_warm
+
+_timings = {}
+_timings_lock = threading.Lock()
+_warmer_pid = None
+
+
+def lazy_sdk_enabled():
+    return os.getenv("SDK_INIT", "eager").strip().lower() == "lazy"
+
+
+def record_startup(stage, seconds):
+    with _timings_lock:
+        _timings[stage] = seconds
+
+
+@contextmanager
+def startup_stage(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_startup(stage, time.perf_counter() - start)
+
+
+def startup_timings():
+    with _timings_lock:
+        return dict(_timings)
+
+
+# Español: Para el snapshot de /metrics: una galga por etapa, en segundos.
+# English: For /metrics' snapshot: one gauge per stage, in seconds.
+def startup_stats():
+    stats = {f"{stage}_seconds": seconds for stage, seconds in startup_timings().items()}
+    stats["lazy_sdk"] = int(lazy_sdk_enabled())
+    return stats
+
+
+def log_startup(event, **fields):
+    print(json.dumps({
+        "event": event,
+        "pid": os.getpid(),
+        "sdk_init": "lazy" if lazy_sdk_enabled() else "eager",
+        **fields,
+        "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in startup_timings().items()},
+    }), flush=True)
+
+
+class LazySDK:
+    # Español: Un SDK que se carga una sola vez, la primera vez que alguien lo pide. Si la carga
+    # falla, no se guarda nada y el siguiente uso lo vuelve a intentar.
+    # English: An SDK that is loaded only once, the first time someone asks for it. If loading
+    # fails, nothing is stored and the next use tries again.
+    def __init__(self, name, loader):
+        self.name = name
+        self._loader = loader
+        self._value = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._value is not None
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self._loader()
+                    if lazy_sdk_enabled():
+                        log_startup("sdk_loaded", sdk=self.name)
+        return self._value
+
+
+def firebase_credentials_path():
+    return os.getenv("FIREBASE_CREDENTIALS_PATH") or os.path.join(os.path.dirname(__file__), "firebase_credentials.json")
+
+
+def _load_firebase():
+    with startup_stage("firebase_import"):
+        import firebase_admin
+        from firebase_admin import auth, credentials
+    with startup_stage("firebase_init"):
+        firebase_admin.initialize_app(credentials.Certificate(firebase_credentials_path()))
+    print("Firebase Admin SDK initialized successfully.")
+    return auth
+
+
+def _load_gemini():
+    with startup_stage("gemini_import"):
+        import google.generativeai as genai
+    with startup_stage("gemini_init"):
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        model = genai.GenerativeModel(GEMINI_MODEL_NAME, system_instruction=GEMINI_SYSTEM_INSTRUCTION)
+    return model
+
+
+FIREBASE = LazySDK("firebase", _load_firebase)
+GEMINI = LazySDK("gemini", _load_gemini)
+
+
+# Español: El módulo `firebase_admin.auth`, con la app de Firebase ya inicializada.
+# English: The `firebase_admin.auth` module, with the Firebase app already initialized.
+def get_firebase_auth():
+    return FIREBASE.get()
+
+
+def get_gemini_model():
+    return GEMINI.get()
+
+
+# Español: Con SDK_INIT=lazy, cada worker carga los SDK en segundo plano tras su primera petición,
+# para que la primera que los necesite (normalmente un login o un deep_dive) no espere.
+# English: With SDK_INIT=lazy, each worker loads the SDKs in the background after its first request,
+# so the first one that needs them (usually a login or a deep_dive) doesn't wait.
+def ensure_sdks_warm():
+    global _warmer_pid
+    if _warmer_pid == os.getpid() or not lazy_sdk_enabled():
+        return
+    _warmer_pid = os.getpid()
+
+    def warm():
+        for sdk in (FIREBASE, GEMINI):
+            try:
+                sdk.get()
+            except Exception as e:
+                print(f"No se pudo cargar el SDK '{sdk.name}': {e}")
+        # Español: Con Firebase ya cargado, arranca también la precarga de sus claves públicas.
+        # English: With Firebase loaded, the prefetch of its public keys starts too.
+        if FIREBASE.loaded:
+            ensure_public_keys_warm()
+
+    threading.Thread(target=warm, name="sdk-warmer", daemon=True).start()
@@ -0,0 +1,218 @@
+# Español: Agrupación de peticiones idénticas simultáneas ("single flight"). Cuando se comparte un
+# título popular, muchos usuarios piden a la vez /api/recomend y después /api/deep_dive del mismo
+# libro: sin esto cada petición abre su conexión, repite la consulta vectorial y, sobre todo, lanza
+# su propia llamada a Gemini. Con SingleFlight la primera petición de una clave hace el trabajo y
+# las demás que llegan mientras tanto esperan y comparten su resultado.
+# English: Coalescing of identical concurrent requests ("single flight"). When a popular title is
+# shared, many users hit /api/recomend and then /api/deep_dive for the same book at once: without
+# this every request opens its connection, repeats the vector query and, worst of all, fires its
+# own Gemini call. With SingleFlight the first request for a key does the work and the others that
+# arrive meanwhile wait and share its result.
+#
+# Español: Dentro de un worker se agrupa en memoria. Entre workers (opcional, SINGLEFLIGHT_LOCK_DIR)
+# el líder de cada worker toma un cerrojo de fichero por clave; quien lo consigue después de otro
+# worker vuelve a mirar un almacén compartido (la caché de análisis) antes de repetir el trabajo.
+# English: Within a worker requests are coalesced in memory. Across workers (optional,
+# SINGLEFLIGHT_LOCK_DIR) each worker's leader takes a per-key file lock; whoever gets it after
+# another worker looks at a shared store again (the analysis cache) before repeating the work.
+import asyncio
+import fcntl
+import hashlib
+import os
+import threading
+import time
+
+
+def singleflight_enabled():
+    return os.getenv("SINGLEFLIGHT", "on").strip().lower() not in ("off", "0", "false")
+
+
+class KeyFileLock:
+    # Español: flock sobre `<dir>/<sha256 de la clave>.lock`. El fichero se borra al soltarlo; quien
+    # lo abrió justo antes del borrado comprueba que su descriptor sigue siendo el fichero de la
+    # ruta y, si no, vuelve a empezar.
+    # English: flock on `<dir>/<sha256 of the key>.lock`. The file is removed on release; whoever
+    # opened it right before the removal checks that their descriptor is still the file at the path
+    # and, if not, starts over.
+    def __init__(self, lock_dir, key):
+        self.path = os.path.join(lock_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".lock")
+        self._fd = None
+
+    # Español: Devuelve (conseguido, hubo_espera). Si pasa `timeout`, seguimos sin cerrojo: mejor
+    # una llamada duplicada que una petición colgada.
+    # English: Returns (acquired, waited). If `timeout` passes, we go on without the lock: better
+    # a duplicate call than a hung request.
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        waited = False
+        while True:
+            fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                waited = True
+                if time.monotonic() >= deadline:
+                    return False, waited
+                time.sleep(0.05)
+                continue
+            try:
+                same_file = os.fstat(fd).st_ino == os.stat(self.path).st_ino
+            except FileNotFoundError:
+                same_file = False
+            if same_file:
+                self._fd = fd
+                return True, waited
+            os.close(fd)
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        os.close(self._fd)
+        self._fd = None
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name, lock_dir=None, lock_timeout=120.0):
+        self.name = name
+        self.lock_dir = lock_dir
+        self.lock_timeout = lock_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"executions": 0, "coalesced": 0, "coalesced_cross_worker": 0}
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    # Español: Ejecuta `fn()` una sola vez por clave entre las llamadas simultáneas y devuelve
+    # (valor, compartido). Las excepciones del líder también llegan a quienes esperaban.
+    # `shared_lookup()` (opcional) lee el resultado que otro worker haya dejado en un almacén
+    # compartido; `fn` debe guardarlo ahí antes de terminar para que el cerrojo de fichero sirva.
+    # English: Runs `fn()` once per key among concurrent calls and returns (value, shared). The
+    # leader's exceptions reach the waiters too. `shared_lookup()` (optional) reads the result
+    # another worker left in a shared store; `fn` must save it there before returning for the file
+    # lock to be useful.
+    def do(self, key, fn, shared_lookup=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            self._count("coalesced")
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value, shared = self._run(key, fn, shared_lookup)
+            return call.value, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run(self, key, fn, shared_lookup):
+        if self.lock_dir is None or shared_lookup is None:
+            self._count("executions")
+            return fn(), False
+        file_lock = KeyFileLock(self.lock_dir, f"{self.name}:{key}")
+        _, waited = file_lock.acquire(self.lock_timeout)
+        try:
+            if waited:
+                value = shared_lookup()
+                if value is not None:
+                    self._count("coalesced_cross_worker")
+                    return value, True
+            self._count("executions")
+            return fn(), False
+        finally:
+            file_lock.release()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+            return stats
+
+
+class AsyncSingleFlight(SingleFlight):
+    # Español: La misma agrupación para asgi_app.py: quienes esperan comparten un asyncio.Future y
+    # el cerrojo de fichero se espera en un hilo para no bloquear el bucle de eventos.
+    # English: The same coalescing for asgi_app.py: waiters share an asyncio.Future and the file
+    # lock is waited for in a thread so the event loop isn't blocked.
+    async def do(self, key, fn, shared_lookup=None):
+        future = self._calls.get(key)
+        if future is not None:
+            self._count("coalesced")
+            return await asyncio.shield(future), True
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            value, shared = await self._run(key, fn, shared_lookup)
+            future.set_result(value)
+            return value, shared
+        except Exception as e:
+            future.set_exception(e)
+            # Español: Marca la excepción como leída si nadie esperaba, para que asyncio no avise.
+            # English: Marks the exception as retrieved if nobody was waiting, so asyncio doesn't warn.
+            future.exception()
+            raise
+        finally:
+            # Español: Si el líder se cancela, quienes esperaban reciben también la cancelación.
+            # English: If the leader is cancelled, the waiters get the cancellation too.
+            if not future.done():
+                future.cancel()
+            del self._calls[key]
+
+    async def _run(self, key, fn, shared_lookup):
+        if self.lock_dir is None or shared_lookup is None:
+            self._count("executions")
+            return await fn(), False
+        file_lock = KeyFileLock(self.lock_dir, f"{self.name}:{key}")
+        _, waited = await asyncio.to_thread(file_lock.acquire, self.lock_timeout)
+        try:
+            if waited:
+                value = await shared_lookup()
+                if value is not None:
+                    self._count("coalesced_cross_worker")
+                    return value, True
+            self._count("executions")
+            return await fn(), False
+        finally:
+            file_lock.release()
+
+
+_flights = {}
+
+
+# Español: Un SingleFlight por nombre y proceso, configurado con SINGLEFLIGHT_LOCK_DIR y
+# SINGLEFLIGHT_LOCK_TIMEOUT_SECONDS.
+# English: One SingleFlight per name and process, configured with SINGLEFLIGHT_LOCK_DIR and
+# SINGLEFLIGHT_LOCK_TIMEOUT_SECONDS.
+def get_singleflight(name, flight_class=SingleFlight):
+    flight = _flights.get(name)
+    if flight is None:
+        lock_dir = os.getenv("SINGLEFLIGHT_LOCK_DIR") or None
+        if lock_dir is not None:
+            os.makedirs(lock_dir, exist_ok=True)
+        flight = _flights[name] = flight_class(
+            name, lock_dir=lock_dir,
+            lock_timeout=float(os.getenv("SINGLEFLIGHT_LOCK_TIMEOUT_SECONDS", "120")))
+    return flight
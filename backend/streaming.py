@@ -0,0 +1,43 @@
+# Español: Utilidades para transmitir el análisis de deep_dive por Server-Sent Events a medida
+# que Gemini lo genera, en vez de esperar a la respuesta completa.
+# English: Helpers to stream the deep_dive analysis over Server-Sent Events while Gemini
+# generates it, instead of waiting for the complete response.
+import json
+
+DELIMITER = "|||"
+
+
+class DelimitedStreamParser:
+    # Español: Recibe el texto en trozos arbitrarios y devuelve cada segmento en cuanto aparece el
+    # delimitador que lo cierra. Un delimitador partido entre dos trozos ("||" + "|") se queda en
+    # el búfer hasta completarse. Al final, `finish()` devuelve el último segmento, igual que
+    # `texto.split('|||')`, así el número de segmentos coincide con el de la ruta sin streaming.
+    # English: Receives text in arbitrary chunks and returns each segment as soon as the delimiter
+    # closing it shows up. A delimiter split across two chunks ("||" + "|") stays in the buffer
+    # until it is complete. At the end, `finish()` returns the last segment, just like
+    # `text.split('|||')`, so the segment count matches the non-streaming route.
+    def __init__(self, delimiter=DELIMITER):
+        self.delimiter = delimiter
+        self.count = 0
+        self._buffer = ""
+
+    def feed(self, text):
+        self._buffer += text
+        segments = []
+        while True:
+            position = self._buffer.find(self.delimiter)
+            if position < 0:
+                break
+            segments.append(self._buffer[:position])
+            self._buffer = self._buffer[position + len(self.delimiter):]
+        self.count += len(segments)
+        return segments
+
+    def finish(self):
+        segment, self._buffer = self._buffer, ""
+        self.count += 1
+        return segment
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
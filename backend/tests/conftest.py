@@ -0,0 +1,8 @@
+# Español: Los módulos del backend se importan como hermanos (igual que hace app.py), así que la
+# carpeta backend/ va al principio del path. Ejecutar desde backend/: python -m pytest -q tests
+# English: The backend modules import each other as siblings (like app.py does), so the backend/
+# folder goes first on the path. Run from backend/: python -m pytest -q tests
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
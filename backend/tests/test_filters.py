@@ -0,0 +1,77 @@
+# Español: BookFilter.mask (motor en memoria) debe elegir los mismos libros que las condiciones de
+# BookFilter.sql (pgvector), con la semántica de NULL de SQL. La referencia es la traducción
+# directa de cada condición SQL a Python.
+# English: BookFilter.mask (in-memory engine) must pick the same books as BookFilter.sql's
+# conditions (pgvector), with SQL's NULL semantics. The reference is the direct translation of
+# each SQL condition into Python.
+import numpy as np
+import pytest
+
+from filters import BookFilter, BookMetadata
+
+BOOKS = [
+    {"anno": 1950, "autore": "Calvino, Italo", "collocazione": "GIALLI 001"},
+    {"anno": None, "autore": " calvino, italo ", "collocazione": "gialli 002"},
+    {"anno": 1990, "autore": None, "collocazione": "NARRATIVA 010"},
+    {"anno": 2001, "autore": "Eco, Umberto", "collocazione": None},
+    {"anno": 1875, "autore": "Verga, Giovanni", "collocazione": "CLASSICI 1"},
+    {"anno": 1990, "autore": "Eco, Umberto", "collocazione": "GIALLI_X"},
+]
+
+
+def key(value):
+    return None if value is None else value.strip().lower()
+
+
+def sql_reference(book_filter, book):
+    anno, autore, collocazione = book["anno"], key(book["autore"]), key(book["collocazione"])
+    if book_filter.anno_min is not None and not (anno is not None and anno >= book_filter.anno_min):
+        return False
+    if book_filter.anno_max is not None and not (anno is not None and anno <= book_filter.anno_max):
+        return False
+    if book_filter.autore and autore not in book_filter.autore:
+        return False
+    if book_filter.exclude_autore and autore is not None and autore in book_filter.exclude_autore:
+        return False
+    if book_filter.collocazione and not (collocazione is not None
+                                         and collocazione.startswith(tuple(book_filter.collocazione))):
+        return False
+    return True
+
+
+FILTERS = [
+    {"anno_min": 1900},
+    {"anno_max": 1990},
+    {"anno_min": 1900, "anno_max": 1995},
+    {"autore": "CALVINO, ITALO"},
+    {"exclude_autore": ["Eco, Umberto"]},
+    {"collocazione": "gialli"},
+    {"collocazione": ["gialli_", "classici"]},
+    {"autore": ["Eco, Umberto", "Verga, Giovanni"], "anno_min": 1990},
+]
+
+
+@pytest.mark.parametrize("data", FILTERS)
+def test_mask_matches_sql_semantics(data):
+    book_filter = BookFilter.from_json(data)
+    expected = [sql_reference(book_filter, book) for book in BOOKS]
+    assert list(book_filter.mask(BookMetadata(BOOKS))) == expected
+
+
+def test_sql_placeholders_and_params():
+    book_filter = BookFilter.from_json({"anno_min": 1900, "autore": "Eco", "collocazione": "100%_"})
+    where, params = book_filter.sql(lambda index: f"${index}", start=2)
+    assert where == "anno >= $3 AND LOWER(TRIM(autore)) = ANY($4) AND LOWER(TRIM(collocazione)) LIKE ANY($5)"
+    assert params == [1900, ["eco"], ["100\\%\\_%"]]
+
+
+@pytest.mark.parametrize("data", [{"anno_min": "x"}, {"anno_min": 2000, "anno_max": 1990}, {"colore": "rosso"},
+                                  {"autore": [""]}, "gialli"])
+def test_invalid_filters_raise(data):
+    with pytest.raises(ValueError):
+        BookFilter.from_json(data)
+
+
+def test_empty_filter_is_none():
+    assert BookFilter.from_json({}) is None
+    assert BookFilter.from_json(None) is None
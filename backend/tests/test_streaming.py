@@ -0,0 +1,51 @@
+# Español: DelimitedStreamParser debe dar los mismos segmentos que `texto.split('|||')` lo corte
+# como lo corte Gemini en trozos, incluido un delimitador partido entre dos trozos.
+# English: DelimitedStreamParser must give the same segments as `text.split('|||')` however Gemini
+# cuts it into chunks, including a delimiter split across two chunks.
+import random
+
+import pytest
+
+from streaming import DelimitedStreamParser, sse_event
+
+TEXTS = [
+    "Primo ||| Secondo ||| Terzo",
+    "||| inizio vuoto",
+    "fine vuota |||",
+    "solo un segmento",
+    "",
+    "a||||||b",
+    "barre | singole || doppie ||| vere",
+]
+
+
+def parse_in_chunks(text, cuts):
+    parser = DelimitedStreamParser()
+    segments = []
+    start = 0
+    for end in cuts + [len(text)]:
+        segments.extend(parser.feed(text[start:end]))
+        start = end
+    segments.append(parser.finish())
+    return segments, parser.count
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_any_chunking_matches_split(text):
+    rng = random.Random(text)
+    for _ in range(50):
+        cuts = sorted(rng.sample(range(len(text) + 1), rng.randint(0, min(len(text) + 1, 8))))
+        segments, count = parse_in_chunks(text, cuts)
+        assert segments == text.split("|||")
+        assert count == len(segments)
+
+
+def test_delimiter_split_across_chunks_waits_for_completion():
+    parser = DelimitedStreamParser()
+    assert parser.feed("uno ||") == []
+    assert parser.feed("| due") == ["uno "]
+    assert parser.finish() == " due"
+
+
+def test_sse_event_format():
+    assert sse_event("done", {"count": 2, "titolo": "Però"}) == 'event: done\ndata: {"count": 2, "titolo": "Però"}\n\n'
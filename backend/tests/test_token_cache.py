@@ -0,0 +1,47 @@
+# Español: Caducidad por `exp`, expulsión LRU y que el token nunca se guarde en claro.
+# English: Expiry by `exp`, LRU eviction and that the token is never stored in the clear.
+import time
+
+from token_cache import TokenCache
+
+
+def decoded(seconds_left):
+    return {"email": "lettore@example.com", "exp": time.time() + seconds_left}
+
+
+def test_hit_until_expiry(monkeypatch):
+    cache = TokenCache()
+    token = decoded(60)
+    cache.put("tok", token)
+    assert cache.get("tok") is token
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert cache.get("tok") is None
+    assert cache.stats()["expired"] == 1
+    assert cache.stats()["size"] == 0
+
+
+def test_expired_or_missing_exp_is_not_stored():
+    cache = TokenCache()
+    cache.put("old", decoded(-1))
+    cache.put("no-exp", {"email": "lettore@example.com"})
+    assert cache.stats()["size"] == 0
+
+
+def test_lru_eviction_keeps_recently_used():
+    cache = TokenCache(max_size=2)
+    cache.put("a", decoded(60))
+    cache.put("b", decoded(60))
+    assert cache.get("a") is not None
+    cache.put("c", decoded(60))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_tokens_are_stored_hashed():
+    cache = TokenCache()
+    cache.put("secret-token", decoded(60))
+    assert "secret-token" not in cache._entries
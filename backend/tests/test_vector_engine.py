@@ -0,0 +1,141 @@
+# Español: Paridad del motor vectorial en memoria con la búsqueda exacta por coseno. Los casos
+# sintéticos no necesitan base de datos; el de pgvector (check_parity contra la tabla `books`) solo
+# corre si PGVECTOR_TEST_DSN apunta a una base de datos poblada.
+# English: Parity of the in-memory vector engine with exact cosine search. The synthetic cases need
+# no database; the pgvector one (check_parity against the `books` table) only runs if
+# PGVECTOR_TEST_DSN points to a populated database.
+import os
+
+import numpy as np
+import pytest
+
+from filters import BookFilter
+from quantization import CompactMatrix
+from vector_engine import CatalogSnapshot, VectorEngine, check_parity, normalize_rows, top_k_indices
+
+ROWS = 500
+DIMENSION = 32
+
+
+def make_snapshot(rows=ROWS, dimension=DIMENSION, precision="float32", seed=0):
+    rng = np.random.default_rng(seed)
+    matrix = normalize_rows(rng.normal(size=(rows, dimension)).astype(np.float32))
+    ids = np.arange(rows, dtype=np.int64) * 3 + 10
+    books = [{"id": int(book_id), "titolo": f"Titolo {book_id}", "autore": f"Autore {book_id % 7}",
+              "synopsis": "", "collocazione": f"SCAFFALE {book_id % 5}", "anno": 1900 + int(book_id) % 100}
+             for book_id in ids]
+    compact = CompactMatrix(matrix, precision) if precision != "float32" else None
+    return CatalogSnapshot(ids, matrix, books, version=1, compact=compact)
+
+
+def make_engine(snapshot, precision="float32"):
+    engine = VectorEngine(precision=precision)
+    engine._state, engine.version = snapshot, snapshot.version
+    return engine
+
+
+# Español: La referencia: coseno contra todo el catálogo, sin el libro de la consulta, ordenado.
+# English: The reference: cosine against the whole catalog, without the query's book, sorted.
+def brute_force(snapshot, book_id, k, keep=None):
+    query = snapshot.matrix[snapshot.index_by_id[book_id]]
+    scores = snapshot.matrix @ query
+    candidates = [i for i in np.argsort(-scores, kind="stable")
+                  if int(snapshot.ids[i]) != book_id and (keep is None or keep(snapshot.books[i]))]
+    return [int(snapshot.ids[i]) for i in candidates[:k]], [float(scores[i]) for i in candidates[:k]]
+
+
+def test_top_k_indices_matches_full_sort():
+    scores = np.random.default_rng(1).normal(size=1000).astype(np.float32)
+    for k in (1, 5, 50, 1000, 2000):
+        assert list(top_k_indices(scores, k)) == list(np.argsort(-scores, kind="stable")[:k])
+
+
+@pytest.mark.parametrize("book_id", [10, 13, 10 + 3 * 250, 10 + 3 * 499])
+def test_recommend_matches_brute_force_and_excludes_query(book_id):
+    snapshot = make_snapshot()
+    results = make_engine(snapshot).recommend(book_id, k=5)
+    expected_ids, expected_scores = brute_force(snapshot, book_id, 5)
+    assert [book["id"] for book in results] == expected_ids
+    assert book_id not in [book["id"] for book in results]
+    np.testing.assert_allclose([book["score"] for book in results], expected_scores, atol=1e-5)
+
+
+def test_recommend_unknown_book_returns_none():
+    assert make_engine(make_snapshot()).recommend(999999, k=5) is None
+
+
+def test_top_k_many_matches_single_queries():
+    snapshot = make_snapshot()
+    engine = make_engine(snapshot)
+    book_ids = [10, 40, 70]
+    vectors = [engine.vector_for(book_id) for book_id in book_ids]
+    batch = engine.top_k_many(vectors, k=5, exclude_ids=[[book_id] for book_id in book_ids])
+    for book_id, results in zip(book_ids, batch):
+        assert [book["id"] for book in results] == [book["id"] for book in engine.recommend(book_id, k=5)]
+
+
+def test_filtered_recommend_matches_brute_force():
+    snapshot = make_snapshot()
+    book_filter = BookFilter(anno_min=1930, anno_max=1970, exclude_autore=["autore 3"], collocazione=["scaffale 2"])
+    results = make_engine(snapshot).recommend(10, k=5, book_filter=book_filter)
+
+    def keep(book):
+        return (1930 <= book["anno"] <= 1970 and book["autore"].lower() != "autore 3"
+                and book["collocazione"].lower().startswith("scaffale 2"))
+
+    expected_ids, _ = brute_force(snapshot, 10, 5, keep=keep)
+    assert len(expected_ids) == 5
+    assert [book["id"] for book in results] == expected_ids
+
+
+# Español: Con matriz compacta y reordenación en float32, el top-5 debe coincidir casi siempre.
+# English: With a compact matrix and float32 rescoring, the top-5 should almost always match.
+@pytest.mark.parametrize("precision", ["float16", "int8"])
+def test_compact_precision_keeps_top_k(precision):
+    snapshot = make_snapshot(precision=precision)
+    engine = make_engine(snapshot, precision=precision)
+    overlaps = []
+    for book_id in [int(book_id) for book_id in snapshot.ids[:50]]:
+        expected_ids, _ = brute_force(snapshot, book_id, 5)
+        got_ids = [book["id"] for book in engine.recommend(book_id, k=5)]
+        assert book_id not in got_ids
+        overlaps.append(len(set(expected_ids) & set(got_ids)) / 5)
+    assert np.mean(overlaps) >= 0.98
+
+
+@pytest.mark.skipif(not os.getenv("PGVECTOR_TEST_DSN"), reason="PGVECTOR_TEST_DSN no está configurada.")
+def test_parity_with_pgvector():
+    import psycopg2
+
+    conn = psycopg2.connect(os.environ["PGVECTOR_TEST_DSN"])
+    try:
+        checked, mismatches = check_parity(conn, k=5, limit=int(os.getenv("PGVECTOR_TEST_LIMIT", "200")))
+    finally:
+        conn.close()
+    assert checked
+    assert mismatches == []
+
+
+# Español: La foto del catálogo guarda los códigos int8 y los parámetros del cuantizador: el motor
+# los mapea y da lo mismo que cuantizando en memoria.
+# English: The catalog snapshot stores the int8 codes and the quantizer parameters: the engine maps
+# them and gets the same as quantizing in memory.
+def test_mapped_int8_matches_in_memory_quantization(tmp_path):
+    from catalog_snapshot import write_catalog_snapshot
+    from vector_engine import map_snapshot
+
+    source = make_snapshot()
+    write_catalog_snapshot(str(tmp_path), 1, len(source), [(source.ids, source.matrix, source.books)])
+    mapped = map_snapshot(str(tmp_path), 1, precision="int8")
+    assert isinstance(mapped.compact.codes, np.memmap)
+
+    in_memory = CompactMatrix(np.asarray(mapped.matrix), "int8")
+    np.testing.assert_array_equal(mapped.compact.codes, in_memory.codes)
+    np.testing.assert_array_equal(mapped.compact.quantizer.lo, in_memory.quantizer.lo)
+    np.testing.assert_array_equal(mapped.compact.quantizer.scale, in_memory.quantizer.scale)
+
+    memory_engine = make_engine(CatalogSnapshot(source.ids, source.matrix, source.books, 1, in_memory), "int8")
+    mapped_engine = make_engine(mapped, "int8")
+    for book_id in [int(book_id) for book_id in source.ids[:20]]:
+        assert ([book["id"] for book in mapped_engine.recommend(book_id, k=5)]
+                == [book["id"] for book in memory_engine.recommend(book_id, k=5)])
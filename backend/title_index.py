@@ -0,0 +1,181 @@
+# Español: Índice de títulos en memoria para el autocompletado. Sustituye el
+# `TRIM(titolo) ILIKE '%q%'` (que no puede usar ningún índice B-tree) por un índice de n-gramas
+# que conserva la semántica de "subcadena", ignora mayúsculas y acentos, y pone primero los
+# títulos que empiezan por lo que el usuario ha escrito.
+# English: In-memory title index for autocomplete. It replaces `TRIM(titolo) ILIKE '%q%'`
+# (which can't use any B-tree index) with an n-gram index that keeps the "substring" semantics,
+# ignores case and accents, and puts titles that start with what the user typed first.
+import bisect
+import os
+import unicodedata
+
+import psycopg2.extras
+
+from catalog_version import CatalogCache
+
+NGRAM = 3
+
+
+# Español: La clave normalizada de un título: sin espacios sobrantes, sin acentos y en minúsculas.
+# English: A title's normalized key: no extra whitespace, no accents and case-folded.
+def normalize_title(title):
+    decomposed = unicodedata.normalize("NFKD", title or "")
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().split())
+
+
+# Español: Columna con la clave normalizada de cada título y su índice B-tree. El índice no es único:
+# el catálogo tiene títulos repetidos (varias ediciones o copias del mismo libro). Con
+# text_pattern_ops sirve tanto para la igualdad como para los prefijos (LIKE 'clave%').
+# populate_db.py la rellena al cargar los libros.
+# English: Column with each title's normalized key and its B-tree index. The index isn't unique:
+# the catalog has repeated titles (several editions or copies of the same book). With
+# text_pattern_ops it serves both equality and prefixes (LIKE 'key%'). populate_db.py fills it
+# in when loading the books.
+TITLE_KEY_DDL = "ALTER TABLE books ADD COLUMN IF NOT EXISTS titolo_key TEXT"
+TITLE_KEY_INDEX_DDL = "CREATE INDEX IF NOT EXISTS books_titolo_key_idx ON books (titolo_key text_pattern_ops)"
+
+
+# Español: Rellena la clave de las filas que aún no la tienen (p. ej. las que ya estaban antes de
+# añadir la columna). Devuelve cuántas filas actualizó.
+# English: Fills in the key of the rows that don't have it yet (e.g. those that were there before
+# the column was added). Returns how many rows it updated.
+def backfill_title_keys(cur, page_size=5000):
+    cur.execute("SELECT id, titolo FROM books WHERE titolo_key IS NULL AND titolo IS NOT NULL")
+    rows = [(book_id, normalize_title(title)) for book_id, title in cur.fetchall()]
+    if rows:
+        psycopg2.extras.execute_values(
+            cur, "UPDATE books SET titolo_key = v.titolo_key FROM (VALUES %s) AS v(id, titolo_key) "
+                 "WHERE books.id = v.id", rows, page_size=page_size)
+    return len(rows)
+
+
+# Español: Resolución de un título en una sola consulta: primero la igualdad exacta de la clave
+# (por el índice), que es lo que llega desde el autocompletado; solo si no hay ninguna, la búsqueda
+# por subcadena de siempre. `key_param` y `pattern_param` son los marcadores del driver (%(key)s
+# en psycopg2, $1 en asyncpg).
+# English: Title resolution in a single query: first exact key equality (through the index), which
+# is what comes from autocomplete; only if there is none, the usual substring search. `key_param`
+# and `pattern_param` are the driver's placeholders (%(key)s in psycopg2, $1 in asyncpg).
+def resolve_title_query(key_param, pattern_param):
+    return f"""
+        WITH exact AS (
+            SELECT id, titolo, autore, anno FROM books WHERE titolo_key = {key_param}
+        )
+        SELECT id, titolo, autore, anno FROM exact
+        UNION ALL
+        SELECT id, titolo, autore, anno FROM books
+        WHERE NOT EXISTS (SELECT 1 FROM exact) AND titolo_key LIKE {pattern_param}
+        ORDER BY titolo, id
+    """
+
+
+# Español: La clave y el patrón LIKE de subcadena (con % y _ escapados) de lo que escribió el usuario.
+# English: The key and the substring LIKE pattern (with % and _ escaped) of what the user typed.
+def title_lookup_params(title):
+    key = normalize_title(title)
+    escaped = key.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return key, f"%{escaped}%"
+
+
+# Español: Las opciones cuando un título coincide con varios libros. Los ids permiten elegir entre
+# libros con el mismo título.
+# English: The options when a title matches several books. The ids allow choosing between books
+# with the same title.
+def title_options(matching_books):
+    return {
+        "message": "Trovati più libri. Seleziona quello corretto.",
+        "options": [book['titolo'] for book in matching_books],
+        "books": [{"id": book['id'], "titolo": book['titolo'], "autore": book['autore'], "anno": book['anno']}
+                  for book in matching_books],
+    }
+
+
+class TitleIndexState:
+    def __init__(self, titles):
+        # Español: Títulos distintos, en el mismo orden que el `ORDER BY titolo` de la consulta SQL.
+        # English: Distinct titles, in the same order as the SQL query's `ORDER BY titolo`.
+        self.titles = sorted(set(titles))
+        self.keys = [normalize_title(title) for title in self.titles]
+
+        # Español: Las claves ordenadas permiten encontrar los prefijos con una búsqueda binaria.
+        # English: Sorted keys let us find prefix matches with a binary search.
+        self.sorted_keys = sorted((key, i) for i, key in enumerate(self.keys))
+
+        # Español: Listas de apariciones de cada n-grama de 1 a NGRAM caracteres.
+        # English: Posting lists for every n-gram of 1 to NGRAM characters.
+        self.postings = {}
+        for i, key in enumerate(self.keys):
+            grams = {key[start:start + size]
+                     for size in range(1, NGRAM + 1)
+                     for start in range(len(key) - size + 1)}
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(i)
+
+    def __len__(self):
+        return len(self.titles)
+
+    def _prefix_matches(self, query):
+        start = bisect.bisect_left(self.sorted_keys, (query, -1))
+        matches = []
+        for key, i in self.sorted_keys[start:]:
+            if not key.startswith(query):
+                break
+            matches.append(i)
+        return matches
+
+    def _substring_candidates(self, query):
+        if len(query) <= NGRAM:
+            return self.postings.get(query, [])
+        grams = {query[start:start + NGRAM] for start in range(len(query) - NGRAM + 1)}
+        lists = sorted((self.postings.get(gram, []) for gram in grams), key=len)
+        if not lists[0]:
+            return []
+        candidates = set(lists[0])
+        for posting in lists[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                break
+        # Español: Los trigramas solo filtran; comprobamos que la consulta entera sea una subcadena.
+        # English: Trigrams only filter; we check that the whole query really is a substring.
+        return [i for i in candidates if query in self.keys[i]]
+
+    def search(self, query, limit=10):
+        query = normalize_title(query)
+        if not query:
+            return []
+        prefix = self._prefix_matches(query)
+        ranked = sorted(prefix)
+        if len(ranked) < limit:
+            seen = set(prefix)
+            ranked += sorted(i for i in self._substring_candidates(query) if i not in seen)
+        return [self.titles[i] for i in ranked[:limit]]
+
+
+class TitleIndex(CatalogCache):
+    def _build(self, conn, version):
+        with conn.cursor() as cur:
+            cur.execute("SELECT DISTINCT titolo FROM books WHERE titolo IS NOT NULL")
+            titles = [row[0] for row in cur.fetchall()]
+        return TitleIndexState(titles)
+
+    def search(self, query, limit=10):
+        return self._state.search(query, limit=limit)
+
+
+_index = None
+_index_pid = None
+
+
+# Español: Activo por defecto; SUGGEST_INDEX=sql vuelve a la consulta ILIKE original.
+# English: Enabled by default; SUGGEST_INDEX=sql goes back to the original ILIKE query.
+def title_index_enabled():
+    return os.getenv("SUGGEST_INDEX", "memory").strip().lower() == "memory"
+
+
+def get_title_index():
+    global _index, _index_pid
+    if _index is None or _index_pid != os.getpid():
+        _index = TitleIndex(refresh_interval=float(os.getenv("SUGGEST_INDEX_REFRESH_SECONDS", "30")))
+        _index_pid = os.getpid()
+    return _index
@@ -0,0 +1,134 @@
+# Español: Caché de tokens de Firebase ya verificados. Una sesión del frontend repite el mismo
+# token en muchas peticiones; verificarlo una vez basta hasta que caduque (`exp`).
+# English: Cache of already verified Firebase tokens. A frontend session repeats the same
+# token across many requests; verifying it once is enough until it expires (`exp`).
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenCache:
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    # Español: Guardamos solo el hash del token, nunca el token en sí.
+    # English: We only keep the token's hash, never the token itself.
+    @staticmethod
+    def _key(id_token):
+        return hashlib.sha256(id_token.encode("utf-8")).hexdigest()
+
+    def get(self, id_token):
+        key = self._key(id_token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            decoded_token, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return decoded_token
+
+    def put(self, id_token, decoded_token):
+        expires_at = decoded_token.get("exp")
+        if not expires_at or time.time() >= expires_at:
+            return
+        key = self._key(id_token)
+        with self._lock:
+            self._entries[key] = (decoded_token, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+            stats["max_size"] = self.max_size
+            return stats
+
+
+# Español: Las claves públicas de Google que firman los tokens se descargan con caché HTTP; cuando
+# caducan, la siguiente verificación se bloquea descargándolas. Un hilo en segundo plano las
+# vuelve a pedir (saltándose la caché) antes de que eso ocurra. Usa el verificador interno de
+# firebase_admin, así que si su estructura cambia simplemente no hacemos nada.
+# English: Google's public keys that sign the tokens are downloaded with an HTTP cache; when
+# they expire, the next verification blocks downloading them. A background thread fetches them
+# again (bypassing the cache) before that happens. It uses firebase_admin's internal verifier,
+# so if its structure changes we simply do nothing.
+def keep_public_keys_warm(interval_seconds=600.0):
+    from firebase_admin import auth
+
+    try:
+        verifier = auth._get_client(None)._token_verifier
+        request = verifier.request
+        cert_url = verifier.id_token_verifier.cert_url
+    except Exception as e:
+        print(f"No se pueden precargar las claves públicas de Firebase: {e}")
+        return None
+
+    def refresh():
+        while True:
+            try:
+                request(cert_url, headers={"Cache-Control": "no-cache"})
+            except Exception as e:
+                print(f"Error al refrescar las claves públicas de Firebase: {e}")
+            time.sleep(interval_seconds)
+
+    thread = threading.Thread(target=refresh, name="firebase-keys-warmer", daemon=True)
+    thread.start()
+    return thread
+
+
+_cache = None
+_cache_pid = None
+_warmer_pid = None
+_warmer_lock = threading.Lock()
+
+
+def get_token_cache():
+    global _cache, _cache_pid
+    if _cache is None or _cache_pid != os.getpid():
+        _cache = TokenCache(max_size=int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "1024")))
+        _cache_pid = os.getpid()
+    return _cache
+
+
+def _firebase_app_initialized():
+    import firebase_admin
+
+    try:
+        firebase_admin.get_app()
+        return True
+    except ValueError:
+        return False
+
+
+# Español: Los hilos no sobreviven al fork de gunicorn, así que cada worker arranca el suyo en su
+# primera petición. Se intenta una sola vez por worker, salga bien o mal; solo se espera a otra
+# llamada mientras la app de Firebase no esté inicializada (SDK_INIT=lazy). El cerrojo evita que
+# dos peticiones simultáneas arranquen dos hilos.
+# English: Threads don't survive gunicorn's fork, so each worker starts its own on its first
+# request. It's attempted once per worker, whether it works or not; it only waits for another call
+# while the Firebase app isn't initialized (SDK_INIT=lazy). The lock keeps two concurrent requests
+# from starting two threads.
+def ensure_public_keys_warm():
+    global _warmer_pid
+    if _warmer_pid == os.getpid():
+        return
+    with _warmer_lock:
+        if _warmer_pid == os.getpid() or not _firebase_app_initialized():
+            return
+        _warmer_pid = os.getpid()
+        keep_public_keys_warm(float(os.getenv("FIREBASE_KEYS_REFRESH_SECONDS", "600")))
@@ -0,0 +1,423 @@
+# Español: Motor de vecinos más cercanos en memoria. Cada worker carga todos los embeddings en
+# una matriz NumPy contigua y normalizada, y responde a las consultas de similitud coseno con
+# un único producto matriz-vector, sin ir a pgvector.
+# English: In-memory nearest-neighbour engine. Each worker loads every embedding into a
+# contiguous, normalized NumPy matrix and answers cosine similarity queries with a single
+# matrix-vector product, without going to pgvector.
+import os
+import tempfile
+import time
+
+import numpy as np
+import psycopg2.extras
+
+from catalog_snapshot import catalog_snapshot_dir, open_catalog_snapshot, snapshot_lock, write_catalog_snapshot
+from catalog_version import CatalogCache, read_catalog_version
+from filters import BookMetadata
+from quantization import PRECISIONS, CompactMatrix, rescore
+
+BOOK_COLUMNS = ("id", "titolo", "autore", "synopsis", "collocazione", "anno")
+
+
+# Español: psycopg2 devuelve las columnas `vector` como texto ('[0.1,0.2,...]') si no se
+# registra el adaptador de pgvector; aceptamos ambas formas.
+# English: psycopg2 returns `vector` columns as text ('[0.1,0.2,...]') unless the pgvector
+# adapter is registered; we accept both forms.
+def parse_vector(value):
+    if isinstance(value, str):
+        return np.array(value.strip()[1:-1].split(","), dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class CatalogSnapshot:
+    # Español: Una foto inmutable del catálogo. Al recargar se crea otra y se sustituye de una
+    # vez, así las consultas en curso nunca ven una matriz a medio construir.
+    # English: An immutable picture of the catalog. Reloading builds a new one and swaps it in
+    # at once, so in-flight queries never see a half-built matrix.
+    def __init__(self, ids, matrix, books, version, compact=None, metadata=None, mapped=False):
+        self.ids = ids
+        self.matrix = matrix
+        self.books = books
+        self.version = version
+        # Español: Con VECTOR_ENGINE_PRECISION=float16/int8, `compact` es la matriz que se recorre
+        # entera y `matrix` (en disco) solo se lee para volver a puntuar los candidatos.
+        # English: With VECTOR_ENGINE_PRECISION=float16/int8, `compact` is the matrix that gets
+        # fully scanned and `matrix` (on disk) is only read to rescore the candidates.
+        self.compact = compact
+        # Español: `mapped`: la matriz, los libros y los metadatos salen de la foto en disco
+        # (catalog_snapshot.py), compartida con los demás workers.
+        # English: `mapped`: the matrix, books and metadata come from the on-disk snapshot
+        # (catalog_snapshot.py), shared with the other workers.
+        self.mapped = mapped
+        self.index_by_id = {int(book_id): i for i, book_id in enumerate(ids)}
+        self._metadata = metadata
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Español: Metadatos codificados para los filtros; se construyen la primera vez que hacen falta.
+    # English: Encoded metadata for the filters; built the first time they are needed.
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            self._metadata = BookMetadata(self.books)
+        return self._metadata
+
+
+# Español: Pasa la matriz float32 a un fichero mapeado en memoria. El fichero se borra en cuanto
+# se mapea: el mapeo lo mantiene vivo y desaparece con la foto del catálogo.
+# English: Moves the float32 matrix to a memory-mapped file. The file is deleted as soon as it's
+# mapped: the mapping keeps it alive and it goes away with the catalog snapshot.
+def spill_to_disk(matrix, directory=None):
+    fd, path = tempfile.mkstemp(prefix="vector_engine_", suffix=".f32", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            matrix.astype(np.float32).tofile(f)
+        return np.memmap(path, dtype=np.float32, mode="r", shape=matrix.shape)
+    finally:
+        os.unlink(path)
+
+
+CATALOG_QUERY = f"SELECT {', '.join(BOOK_COLUMNS)}, embedding FROM books WHERE embedding IS NOT NULL ORDER BY id"
+
+
+def load_snapshot(conn, version=0, precision="float32", spill_dir=None):
+    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+        cur.execute(CATALOG_QUERY)
+        rows = cur.fetchall()
+
+    books = [{column: row[column] for column in BOOK_COLUMNS} for row in rows]
+    ids = np.array([row["id"] for row in rows], dtype=np.int64)
+    if rows:
+        matrix = np.vstack([parse_vector(row["embedding"]) for row in rows])
+    else:
+        matrix = np.zeros((0, 0), dtype=np.float32)
+    matrix = np.ascontiguousarray(normalize_rows(matrix), dtype=np.float32)
+    compact = None
+    if precision != "float32" and len(matrix):
+        compact = CompactMatrix(matrix, precision)
+        matrix = spill_to_disk(matrix, spill_dir)
+    return CatalogSnapshot(ids, matrix, books, version, compact)
+
+
+# Español: La foto mapeada de `version`, o None si no hay. La matriz ya está en disco, así que con
+# una precisión compacta no hace falta volcarla. Con int8 también se mapean los códigos y los
+# parámetros del cuantizador guardados en la foto; float16 se construye en memoria.
+# English: `version`'s mapped snapshot, or None if there is none. The matrix is already on disk, so
+# with a compact precision there's no need to spill it. With int8 the codes and the quantizer
+# parameters stored in the snapshot are mapped too; float16 is built in memory.
+def map_snapshot(directory, version, precision="float32"):
+    opened = open_catalog_snapshot(directory, version)
+    if opened is None:
+        return None
+    ids, matrix, books, metadata, int8 = opened
+    if precision == "int8" and int8 is not None:
+        compact = CompactMatrix.from_codes(*int8)
+    else:
+        compact = CompactMatrix(matrix, precision) if precision != "float32" else None
+    return CatalogSnapshot(ids, matrix, books, version, compact, metadata=metadata, mapped=True)
+
+
+# Español: El catálogo por trozos de `batch_size` libros, con un cursor del lado del servidor, para
+# exportarlo sin tenerlo entero en memoria: (ids, matriz normalizada, libros) por trozo.
+# English: The catalog in chunks of `batch_size` books, with a server-side cursor, to export it
+# without holding it all in memory: (ids, normalized matrix, books) per chunk.
+def iter_catalog(conn, batch_size=10000):
+    with conn.cursor(name="catalog_export", cursor_factory=psycopg2.extras.DictCursor) as cur:
+        cur.itersize = batch_size
+        cur.execute(CATALOG_QUERY)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                return
+            ids = np.array([row["id"] for row in rows], dtype=np.int64)
+            matrix = normalize_rows(np.vstack([parse_vector(row["embedding"]) for row in rows]))
+            yield ids, matrix, [{column: row[column] for column in BOOK_COLUMNS} for row in rows]
+
+
+# Español: Exporta la foto de `version` con los libros que ve `conn`. Dentro de la transacción de
+# populate_db.py son los recién cargados; desde un worker, se comprueba al final que la versión no
+# haya cambiado mientras tanto (si cambió, los datos podrían ser de la siguiente y se descarta).
+# English: Exports `version`'s snapshot with the books `conn` sees. Inside populate_db.py's
+# transaction they're the freshly loaded ones; from a worker, it checks at the end that the version
+# hasn't changed meanwhile (if it did, the data could belong to the next one and it's discarded).
+def export_catalog_snapshot(conn, directory, version, batch_size=10000, keep=2):
+    with conn.cursor() as cur:
+        cur.execute("SELECT count(*) FROM books WHERE embedding IS NOT NULL")
+        count = cur.fetchone()[0]
+
+    def unchanged():
+        with conn.cursor() as cur:
+            return read_catalog_version(cur) == version
+
+    return write_catalog_snapshot(directory, version, count, iter_catalog(conn, batch_size), keep=keep,
+                                  check=unchanged)
+
+
+# Español: Los índices de las k puntuaciones más altas, ordenados de mayor a menor. argpartition
+# es O(n); solo ordenamos los k elegidos.
+# English: Indices of the k highest scores, sorted from highest to lowest. argpartition is
+# O(n); we only sort the k chosen ones.
+def top_k_indices(scores, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class VectorEngine(CatalogCache):
+    # Español: `rescore_factor` es cuántos candidatos por resultado se vuelven a puntuar con
+    # float32 cuando el motor trabaja con una matriz compacta.
+    # English: `rescore_factor` is how many candidates per result are rescored with float32 when
+    # the engine works on a compact matrix.
+    def __init__(self, refresh_interval=30.0, precision="float32", rescore_factor=4, spill_dir=None,
+                 snapshot_dir=None):
+        super().__init__(refresh_interval)
+        if precision not in PRECISIONS:
+            raise ValueError(f"Precisión desconocida: '{precision}'. Usa una de {', '.join(PRECISIONS)}.")
+        self.precision = precision
+        self.rescore_factor = rescore_factor
+        self.spill_dir = spill_dir
+        self.snapshot_dir = snapshot_dir
+
+    @property
+    def snapshot(self):
+        return self._state
+
+    def _build(self, conn, version):
+        start = time.perf_counter()
+        snapshot = self._map(conn, version) if self.snapshot_dir else None
+        if snapshot is not None:
+            resident = 0
+            if snapshot.compact is not None and not isinstance(snapshot.compact.codes, np.memmap):
+                resident = snapshot.compact.nbytes
+            print(f"Motor vectorial: {len(snapshot)} libros mapeados de '{self.snapshot_dir}' (versión {version}, "
+                  f"{self.precision}, {snapshot.matrix.nbytes / 1e6:.1f} MB compartidos, {resident / 1e6:.1f} MB "
+                  f"propios) en {time.perf_counter() - start:.2f}s.")
+            return snapshot
+        snapshot = load_snapshot(conn, version, precision=self.precision, spill_dir=self.spill_dir)
+        resident = snapshot.compact.nbytes if snapshot.compact is not None else snapshot.matrix.nbytes
+        print(f"Motor vectorial: {len(snapshot)} libros cargados (versión {snapshot.version}, {self.precision}, "
+              f"{resident / 1e6:.1f} MB en memoria) en {time.perf_counter() - start:.2f}s.")
+        return snapshot
+
+    # Español: Mapea la foto de la versión; si todavía no existe, la exporta este worker con el
+    # cerrojo tomado (los demás esperan y luego la mapean). Si algo falla, se carga desde la base de
+    # datos como siempre.
+    # English: Maps the version's snapshot; if it doesn't exist yet, this worker exports it with the
+    # lock held (the others wait and then map it). If anything fails, it loads from the database as always.
+    def _map(self, conn, version):
+        try:
+            snapshot = map_snapshot(self.snapshot_dir, version, self.precision)
+            if snapshot is None:
+                with snapshot_lock(self.snapshot_dir):
+                    snapshot = map_snapshot(self.snapshot_dir, version, self.precision)
+                    if snapshot is None and export_catalog_snapshot(conn, self.snapshot_dir, version) is not None:
+                        snapshot = map_snapshot(self.snapshot_dir, version, self.precision)
+            return snapshot
+        except Exception as e:
+            print(f"No se pudo usar la foto del catálogo en '{self.snapshot_dir}': {e}")
+            # Español: Una exportación a medias puede dejar la transacción abortada.
+            # English: A half-done export can leave the transaction aborted.
+            conn.rollback()
+            return None
+
+    def vector_for(self, book_id):
+        snapshot = self._state
+        index = snapshot.index_by_id.get(int(book_id))
+        return None if index is None else np.asarray(snapshot.matrix[index])
+
+    # Español: Índices y puntuaciones de los k mejores para una consulta ya normalizada. Con matriz
+    # compacta: candidatos aproximados y luego puntuación exacta de la lista corta. `mask` (de un
+    # BookFilter) deja fuera los libros que no cumplen el filtro antes de elegir los k mejores.
+    # English: Indices and scores of the best k for an already normalized query. With a compact
+    # matrix: approximate candidates and then exact scoring of the short list. `mask` (from a
+    # BookFilter) leaves out the books that don't match the filter before picking the best k.
+    def _search(self, snapshot, query, k, excluded=(), mask=None):
+        if snapshot.compact is None:
+            scores = snapshot.matrix @ query
+        else:
+            scores = snapshot.compact.scores(query)
+        for index in excluded:
+            scores[index] = -np.inf
+        if mask is not None:
+            scores[~mask] = -np.inf
+        available = int(np.count_nonzero(scores != -np.inf))
+        k = min(k, available)
+        if snapshot.compact is None:
+            indices = top_k_indices(scores, k)
+            return indices, scores[indices]
+        candidates = top_k_indices(scores, min(k * self.rescore_factor, available))
+        return rescore(snapshot.matrix, query, candidates, k)
+
+    # Español: Recibe la foto ya leída para que la máscara y la matriz sean siempre de la misma versión.
+    # English: Takes the snapshot already read so the mask and the matrix always come from the same version.
+    @staticmethod
+    def _filter_mask(snapshot, book_filter):
+        if book_filter is None:
+            return None
+        return book_filter.mask(snapshot.metadata)
+
+    # Español: Los k libros más parecidos a `query_vector`, excluyendo `exclude_id` igual que el
+    # `WHERE id != %s` de la consulta SQL. Cada resultado lleva su similitud coseno en `score`.
+    # English: The k books most similar to `query_vector`, excluding `exclude_id` just like the
+    # SQL query's `WHERE id != %s`. Each result carries its cosine similarity in `score`.
+    def top_k(self, query_vector, k=5, exclude_id=None, book_filter=None):
+        snapshot = self._state
+        if snapshot is None or len(snapshot) == 0:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        excluded = snapshot.index_by_id.get(int(exclude_id)) if exclude_id is not None else None
+        indices, scores = self._search(snapshot, query, k, () if excluded is None else (excluded,),
+                                       mask=self._filter_mask(snapshot, book_filter))
+
+        results = []
+        for index, score in zip(indices, scores):
+            book = dict(snapshot.books[index])
+            book["score"] = float(score)
+            results.append(book)
+        return results
+
+    # Español: Versión por lotes: puntúa todas las consultas contra el catálogo con un único
+    # producto de matrices. `exclude_ids[i]` son los ids excluidos de la fila i.
+    # English: Batch version: scores every query against the catalog with a single matrix
+    # product. `exclude_ids[i]` are the ids excluded from row i.
+    def top_k_many(self, query_matrix, k=5, exclude_ids=None, book_filter=None):
+        snapshot = self._state
+        if snapshot is None or len(snapshot) == 0 or len(query_matrix) == 0:
+            return [[] for _ in range(len(query_matrix))]
+        queries = normalize_rows(np.asarray(query_matrix, dtype=np.float32))
+        mask = self._filter_mask(snapshot, book_filter)
+        if snapshot.compact is not None:
+            results = []
+            for row, query in enumerate(queries):
+                excluded = {snapshot.index_by_id.get(int(book_id))
+                            for book_id in (exclude_ids[row] if exclude_ids else ())}
+                excluded.discard(None)
+                indices, scores = self._search(snapshot, query, k, tuple(excluded), mask=mask)
+                results.append([dict(snapshot.books[index], score=float(score)) for index, score in zip(indices, scores)])
+            return results
+        scores = queries @ snapshot.matrix.T
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+
+        results = []
+        for row, row_scores in enumerate(scores):
+            for book_id in (exclude_ids[row] if exclude_ids else ()):
+                excluded = snapshot.index_by_id.get(int(book_id))
+                if excluded is not None:
+                    row_scores[excluded] = -np.inf
+            row_k = min(k, int(np.isfinite(row_scores).sum()))
+            books = []
+            for index in top_k_indices(row_scores, row_k):
+                book = dict(snapshot.books[index])
+                book["score"] = float(row_scores[index])
+                books.append(book)
+            results.append(books)
+        return results
+
+    def recommend(self, book_id, k=5, book_filter=None):
+        vector = self.vector_for(book_id)
+        if vector is None:
+            return None
+        return self.top_k(vector, k=k, exclude_id=book_id, book_filter=book_filter)
+
+
+_engine = None
+_engine_pid = None
+
+
+# Español: El motor es opcional: se activa con VECTOR_ENGINE=memory. Igual que el pool, hay uno por proceso.
+# VECTOR_ENGINE_PRECISION=float16/int8 guarda en memoria la matriz compacta y vuelve a puntuar
+# VECTOR_ENGINE_RESCORE_FACTOR candidatos por resultado con float32.
+# English: The engine is optional: it is enabled with VECTOR_ENGINE=memory. Like the pool, there is one per process.
+# VECTOR_ENGINE_PRECISION=float16/int8 keeps the compact matrix in memory and rescores
+# VECTOR_ENGINE_RESCORE_FACTOR candidates per result with float32.
+# Español: Con CATALOG_SNAPSHOT_DIR los workers mapean la misma foto del catálogo en vez de copiarla cada uno.
+# English: With CATALOG_SNAPSHOT_DIR the workers map the same catalog snapshot instead of each copying it.
+def vector_engine_enabled():
+    return os.getenv("VECTOR_ENGINE", "pgvector").strip().lower() == "memory"
+
+
+def get_vector_engine():
+    global _engine, _engine_pid
+    if _engine is None or _engine_pid != os.getpid():
+        _engine = VectorEngine(
+            refresh_interval=float(os.getenv("VECTOR_ENGINE_REFRESH_SECONDS", "30")),
+            precision=os.getenv("VECTOR_ENGINE_PRECISION", "float32").strip().lower(),
+            rescore_factor=int(os.getenv("VECTOR_ENGINE_RESCORE_FACTOR", "4")),
+            spill_dir=os.getenv("VECTOR_ENGINE_SPILL_DIR") or None,
+            snapshot_dir=catalog_snapshot_dir())
+        _engine_pid = os.getpid()
+    return _engine
+
+
+# Español: Comprobación de paridad: para cada libro compara el top-k del motor con el de la
+# consulta pgvector que usa /api/recomend. Uso: python vector_engine.py [--k 5] [--limit N] [--precision int8]
+# English: Parity check: for every book compares the engine's top-k with the pgvector query
+# used by /api/recomend. Usage: python vector_engine.py [--k 5] [--limit N] [--precision int8]
+def check_parity(conn, k=5, limit=None, tolerance=1e-5, precision="float32"):
+    engine = VectorEngine(precision=precision)
+    snapshot = engine.load(conn)
+    book_ids = [int(book_id) for book_id in snapshot.ids[:limit]]
+    mismatches = []
+    with conn.cursor() as cur:
+        for book_id in book_ids:
+            cur.execute("""
+                SELECT id, 1 - (embedding <=> (SELECT embedding FROM books WHERE id = %s)) AS score
+                FROM books
+                WHERE id != %s
+                ORDER BY embedding <=> (SELECT embedding FROM books WHERE id = %s)
+                LIMIT %s
+            """, (book_id, book_id, book_id, k))
+            expected = cur.fetchall()
+            got = engine.recommend(book_id, k=k)
+            expected_ids = [row[0] for row in expected]
+            got_ids = [book["id"] for book in got]
+            if expected_ids == got_ids:
+                continue
+            # Español: Un intercambio entre empates (misma puntuación) no es un error.
+            # English: A swap between ties (same score) is not an error.
+            expected_scores = [float(row[1]) for row in expected]
+            got_scores = [book["score"] for book in got]
+            if len(expected_scores) == len(got_scores) and np.allclose(expected_scores, got_scores, atol=tolerance):
+                continue
+            mismatches.append((book_id, expected_ids, got_ids))
+    return book_ids, mismatches
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    import psycopg2
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Compara el motor en memoria con pgvector.")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--precision", choices=PRECISIONS, default="float32")
+    args = parser.parse_args()
+
+    load_dotenv()
+    conn = psycopg2.connect(os.getenv("DATABASE_URL"))
+    try:
+        checked, mismatches = check_parity(conn, k=args.k, limit=args.limit, precision=args.precision)
+    finally:
+        conn.close()
+
+    for book_id, expected_ids, got_ids in mismatches:
+        print(f"Libro {book_id}: pgvector={expected_ids} motor={got_ids}")
+    print(f"{len(checked) - len(mismatches)}/{len(checked)} libros con el mismo top-{args.k}.")
+    sys.exit(1 if mismatches else 0)
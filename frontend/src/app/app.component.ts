@@ -21,6 +21,7 @@ export class AppComponent implements OnInit {
 
   titleSearching: string = '';
   results: any[] = [];
+  bookId: string | null = null;
   loading: boolean = false;
   error: string | null = null;
   comparison: string | null = null;
@@ -87,14 +88,17 @@ export class AppComponent implements OnInit {
     this.loading = true;
     this.error = null;
     this.results = [];
+    this.bookId = null;
     this.showSuggestions = false; // Hide suggestions when searching
     this.isDeepDiveButtonDisabled = true; // Disable deep dive button on new search
 
     try {
       const headers = await this.getAuthHeaders();
-            this.http.post<any[]>(`${environment.apiUrl}/api/recomend`, { titolo: this.titleSearching }, { headers }).subscribe({
-        next: (data) => {
-          this.results = data;
+            this.http.post<any[]>(`${environment.apiUrl}/api/recomend`, { titolo: this.titleSearching }, { headers, observe: 'response' }).subscribe({
+        next: (response) => {
+          this.results = response.body ?? [];
+          // The id of the resolved book lets deep dive skip the title lookup
+          this.bookId = response.headers.get('X-Book-Id');
           this.loading = false;
           this.isDeepDiveButtonDisabled = this.results.length !== 5;
         },
@@ -144,7 +148,7 @@ export class AppComponent implements OnInit {
 
     try {
       const headers = await this.getAuthHeaders();
-            this.http.post<any>(`${environment.apiUrl}/api/deep_dive`, { titolo: this.titleSearching, recommendations: this.results }, { headers }).subscribe({
+            this.http.post<any>(`${environment.apiUrl}/api/deep_dive`, { titolo: this.titleSearching, book_id: this.bookId, recommendations: this.results }, { headers }).subscribe({
         next: (data) => {
           console.log("Datos recibidos de deepDive:", data);
           this.results.forEach(book => {
@@ -0,0 +1,183 @@
+import argparse
+import gc
+import glob
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+from fixture_server import pagina_detalle, pagina_resultados
+from opac_parser import PARSERS, lxml, parse_next_link, parse_results_page, parse_synopsis
+
+# Compara los parsers de opac_parser.py sobre un corpus de páginas del OPAC:
+#   1. comprueba que todos devuelven exactamente los mismos registros que el original ("bs4");
+#   2. mide cada uno en un proceso aparte: páginas por segundo, pico de memoria residente del
+#      proceso (incluye la de lxml, que no pasa por el allocator de Python) y pico de tracemalloc.
+#
+# El corpus puede ser una carpeta de páginas guardadas (--pages-dir; las de resultados se
+# reconocen por 'record-title', el resto se leen como fichas de detalle) o un catálogo sintético
+# con el marcado del OPAC. Por defecto las páginas sintéticas se insertan dentro de una página
+# real guardada (debug_page.html), para que tengan el tamaño y el ruido de las de verdad.
+#
+#   python bench_parser.py --sintetico 10 --repeticiones 2
+#   python bench_parser.py --pages-dir paginas_guardadas/
+
+BASE_URL = "https://retebibliotecaria.provincia.va.it/opac/search/lst?q=letteratura"
+PLANTILLA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "debug_page.html")
+
+
+def con_plantilla(html, plantilla):
+    if not plantilla:
+        return html
+    body = html.split("<body>", 1)[1].rsplit("</body>", 1)[0]
+    # El último </body>: la página guardada tiene otro dentro del atributo srcdoc de un iframe.
+    antes, despues = plantilla.rsplit("</body>", 1)
+    return antes + body + "</body>" + despues
+
+
+def cargar_corpus(args):
+    """Lista de (tipo, html) con tipo 'resultados' o 'detalle'."""
+    if args.pages_dir:
+        corpus = []
+        for path in sorted(glob.glob(os.path.join(args.pages_dir, "**", "*.htm*"), recursive=True)):
+            with open(path, encoding="utf-8", errors="replace") as file:
+                html = file.read()
+            corpus.append(("resultados" if "record-title" in html else "detalle", html))
+        return corpus
+
+    plantilla = None
+    if args.plantilla and os.path.exists(args.plantilla):
+        with open(args.plantilla, encoding="utf-8") as file:
+            plantilla = file.read()
+    total = args.sintetico * args.por_pagina
+    corpus = []
+    for page in range(args.sintetico):
+        corpus.append(("resultados", con_plantilla(pagina_resultados(page * args.por_pagina, total, args.por_pagina), plantilla)))
+    for book_id in range(1, total + 1, max(1, args.por_pagina // args.detalles_por_pagina)):
+        corpus.append(("detalle", con_plantilla(pagina_detalle(book_id), plantilla)))
+    return corpus
+
+
+def extraer(tipo, html, parser):
+    if tipo == "resultados":
+        return parse_results_page(html, BASE_URL, parser), parse_next_link(html, BASE_URL, parser)
+    return parse_synopsis(html, parser)
+
+
+def rss_actual_mb():
+    """Memoria residente actual del proceso (Linux); None si /proc no está disponible."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / (1024 * 1024)
+    except OSError:
+        return None
+
+
+class MuestreoRSS(threading.Thread):
+    """Mide el pico de memoria residente durante la prueba, por encima de la del inicio. Con
+    ru_maxrss no basta: su máximo ya lo marca la carga del corpus."""
+
+    def __init__(self, intervalo=0.002):
+        super().__init__(daemon=True)
+        self.intervalo = intervalo
+        self.inicial = rss_actual_mb()
+        self.pico = self.inicial
+        self.parar = threading.Event()
+
+    def run(self):
+        while not self.parar.is_set():
+            self.pico = max(self.pico, rss_actual_mb())
+            time.sleep(self.intervalo)
+
+    def terminar(self):
+        self.parar.set()
+        self.join()
+        return self.pico - self.inicial
+
+
+def medir(parser, args, cola):
+    corpus = cargar_corpus(args)
+    gc.collect()
+    rss_inicial = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    muestreo = MuestreoRSS() if rss_actual_mb() is not None else None
+    if muestreo is not None:
+        muestreo.start()
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    for _ in range(args.repeticiones):
+        for tipo, html in corpus:
+            extraer(tipo, html, parser)
+    segundos = time.perf_counter() - inicio
+    _, pico_python = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if muestreo is not None:
+        pico_rss = muestreo.terminar()
+    else:
+        # ru_maxrss está en KB en Linux (en bytes en macOS).
+        pico_rss = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_inicial) / (
+            1024 * 1024 if sys.platform == "darwin" else 1024)
+    paginas = len(corpus) * args.repeticiones
+    cola.put({
+        "parser": parser,
+        "paginas": paginas,
+        "paginas_por_segundo": round(paginas / segundos, 2),
+        "ms_por_pagina": round(segundos / paginas * 1000, 3),
+        "pico_rss_mb": round(pico_rss, 2),
+        "pico_tracemalloc_mb": round(pico_python / 1e6, 2),
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rendimiento y equivalencia de los parsers del OPAC.")
+    parser.add_argument("--pages-dir", default=None, help="Carpeta con páginas del OPAC guardadas.")
+    parser.add_argument("--sintetico", type=int, default=10, help="Páginas de resultados sintéticas (sin --pages-dir).")
+    parser.add_argument("--por-pagina", type=int, default=20)
+    parser.add_argument("--detalles-por-pagina", type=int, default=5,
+                        help="Fichas de detalle sintéticas por página de resultados.")
+    parser.add_argument("--plantilla", default=PLANTILLA, help="Página real en la que se insertan las sintéticas ('' = ninguna).")
+    parser.add_argument("--parsers", default=",".join(p for p in PARSERS if p != "lxml" or lxml is not None))
+    parser.add_argument("--repeticiones", type=int, default=1)
+    parser.add_argument("--output", default=None, help="Fichero JSON lines con los resultados.")
+    args = parser.parse_args()
+
+    parsers = [p.strip() for p in args.parsers.split(",") if p.strip()]
+    corpus = cargar_corpus(args)
+    resultados_pag = sum(1 for tipo, _ in corpus if tipo == "resultados")
+    tamano = sum(len(html) for _, html in corpus) / max(len(corpus), 1) / 1024
+    print(f"Corpus: {resultados_pag} páginas de resultados y {len(corpus) - resultados_pag} fichas de detalle "
+          f"({tamano:.0f} KB de media).")
+
+    # Equivalencia: todos los parsers deben dar exactamente lo mismo que el original.
+    referencia = [extraer(tipo, html, "bs4") for tipo, html in corpus]
+    equivalentes = True
+    for nombre in parsers:
+        diferencias = sum(1 for (tipo, html), esperado in zip(corpus, referencia) if extraer(tipo, html, nombre) != esperado)
+        equivalentes &= diferencias == 0
+        print(f"  {nombre:<9} {'idéntico a bs4' if diferencias == 0 else f'{diferencias} páginas distintas de bs4'}")
+    registros = sum(len(r[0]) for (tipo, _), r in zip(corpus, referencia) if tipo == "resultados")
+    print(f"  ({registros} registros y {len(corpus) - resultados_pag} sinopsis comparados)")
+
+    contexto = multiprocessing.get_context("spawn")
+    resultados = []
+    for nombre in parsers:
+        cola = contexto.Queue()
+        proceso = contexto.Process(target=medir, args=(nombre, args, cola))
+        proceso.start()
+        resultados.append(cola.get())
+        proceso.join()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            for resultado in resultados:
+                output.write(json.dumps(resultado) + "\n")
+
+    print()
+    print(f"{'parser':<9} {'páginas/s':>10} {'ms/página':>10} {'pico RSS MB':>12} {'pico tracemalloc MB':>20}")
+    for r in resultados:
+        print(f"{r['parser']:<9} {r['paginas_por_segundo']:>10.2f} {r['ms_por_pagina']:>10.3f} "
+              f"{r['pico_rss_mb']:>12.2f} {r['pico_tracemalloc_mb']:>20.2f}")
+    sys.exit(0 if equivalentes else 1)
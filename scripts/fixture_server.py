@@ -0,0 +1,174 @@
+import argparse
+import hashlib
+import html
+import os
+import random
+import threading
+import time
+from email.utils import formatdate
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Servidor HTTP local que imita el OPAC para probar scraper_selenium.py sin tocar la red:
+#   - con --pages-dir sirve tal cual páginas del OPAC guardadas en disco;
+#   - sin él genera un catálogo sintético con el mismo marcado que lee el scraper
+#     (div.record, h4.record-title, a.freccia-dx, div.abstract-text).
+# Puede añadir latencia y errores 503 a las fichas de detalle para probar la concurrencia, el
+# límite de peticiones por segundo y los reintentos. Las fichas llevan ETag y Last-Modified y
+# responden 304 a las peticiones condicionales; --revision cambia parte de ellas para probar una
+# pasada de actualización. Al terminar (Ctrl+C) muestra cuántas peticiones recibió, cuántas
+# conexiones abrieron los clientes y cuántas hubo a la vez.
+#
+#   python fixture_server.py --books 200 --per-page 20 --latency-ms 300 --error-rate 0.05
+#   python scraper_selenium.py --sin-navegador --start-url "http://127.0.0.1:8765/opac/search/lst?q=letteratura"
+
+
+LAST_MODIFIED = formatdate(time.time(), usegmt=True)
+
+
+class Estadisticas:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.peticiones = 0
+        self.errores = 0
+        self.no_modificadas = 0
+        self.conexiones = 0
+        self.en_curso = 0
+        self.max_en_curso = 0
+
+    def resumen(self):
+        with self.lock:
+            return (f"{self.peticiones} peticiones, {self.no_modificadas} respuestas 304, "
+                    f"{self.errores} errores 503 simulados, "
+                    f"{self.conexiones} conexiones, máximo {self.max_en_curso} a la vez")
+
+
+def pagina_resultados(start, total, per_page):
+    records = []
+    for book_id in range(start + 1, min(start + per_page, total) + 1):
+        records.append(f"""
+        <div class="record">
+          <h4 class="record-title"><a href="/opac/detail/view/{book_id}">Libro di prova {book_id:05d}</a></h4>
+          <div class="record-authors"><a href="#">Autore {book_id % 37}, Nome</a></div>
+          <div class="record-publication">Milano : Editore, {1950 + book_id % 75}</div>
+          <div class="record-shelfmark">Collocazione: GIALLI {book_id % 11:03d}</div>
+        </div>""")
+    siguiente = ""
+    if start + per_page < total:
+        siguiente = f'<a class="freccia-dx" href="/opac/search/lst?q=letteratura&amp;start={start + per_page}">&gt;</a>'
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>OPAC</title></head>
+<body><div class="results">{''.join(records)}</div><div class="pagination">{siguiente}</div></body></html>"""
+
+
+def pagina_detalle(book_id, revision=0, changed_every=0):
+    sinopsis = f"Sinossi del libro di prova {book_id:05d}. " * 8
+    # Con --revision, una de cada --changed-every fichas cambia de texto (y de ETag).
+    if revision and changed_every and book_id % changed_every == 0:
+        sinopsis += f"Revisione {revision}."
+    sinopsis = html.escape(sinopsis)
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Libro di prova {book_id:05d}</title></head>
+<body><div class="record-detail"><h2>Libro di prova {book_id:05d}</h2>
+<div class="abstract"><div class="abstract-text">{sinopsis}</div></div></div></body></html>"""
+
+
+def crear_handler(args, estadisticas):
+    class FixtureHandler(SimpleHTTPRequestHandler):
+        # HTTP/1.1 para que los clientes puedan reutilizar la conexión (keep-alive).
+        protocol_version = "HTTP/1.1"
+
+        def __init__(self, *handler_args, **kwargs):
+            super().__init__(*handler_args, directory=args.pages_dir or os.getcwd(), **kwargs)
+
+        def setup(self):
+            super().setup()
+            with estadisticas.lock:
+                estadisticas.conexiones += 1
+
+        def log_message(self, format, *log_args):
+            if args.verbose:
+                super().log_message(format, *log_args)
+
+        def enviar(self, status, body, cabeceras=()):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            if status == 503:
+                self.send_header("Retry-After", "0")
+            for nombre, valor in cabeceras:
+                self.send_header(nombre, valor)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def enviar_detalle(self, book_id):
+            body = pagina_detalle(book_id, args.revision, args.changed_every)
+            etag = '"' + hashlib.sha256(body.encode("utf-8")).hexdigest()[:16] + '"'
+            if self.headers.get("If-None-Match") == etag:
+                with estadisticas.lock:
+                    estadisticas.no_modificadas += 1
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.enviar(200, body, [("ETag", etag), ("Last-Modified", LAST_MODIFIED)])
+
+        def do_GET(self):
+            with estadisticas.lock:
+                estadisticas.peticiones += 1
+                estadisticas.en_curso += 1
+                estadisticas.max_en_curso = max(estadisticas.max_en_curso, estadisticas.en_curso)
+            try:
+                if args.pages_dir:
+                    return super().do_GET()
+                url = urlsplit(self.path)
+                if url.path == "/opac/search/lst":
+                    start = int(parse_qs(url.query).get("start", ["0"])[0])
+                    return self.enviar(200, pagina_resultados(start, args.books, args.per_page))
+                if url.path.startswith("/opac/detail/view/"):
+                    time.sleep(args.latency_ms / 1000)
+                    if random.random() < args.error_rate:
+                        with estadisticas.lock:
+                            estadisticas.errores += 1
+                        return self.enviar(503, "Servicio no disponible")
+                    return self.enviar_detalle(int(url.path.rsplit("/", 1)[1]))
+                return self.enviar(404, "No encontrado")
+            finally:
+                with estadisticas.lock:
+                    estadisticas.en_curso -= 1
+
+    return FixtureHandler
+
+
+def iniciar_servidor(args):
+    estadisticas = Estadisticas()
+    server = ThreadingHTTPServer((args.host, args.port), crear_handler(args, estadisticas))
+    server.daemon_threads = True
+    return server, estadisticas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor local con páginas del OPAC para probar el scraper.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pages-dir", default=None, help="Carpeta con páginas del OPAC guardadas (se sirven tal cual).")
+    parser.add_argument("--books", type=int, default=200)
+    parser.add_argument("--per-page", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Latencia de cada ficha de detalle.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de fichas que responden 503.")
+    parser.add_argument("--revision", type=int, default=0, help="Versión del catálogo (cambia algunas fichas).")
+    parser.add_argument("--changed-every", type=int, default=10, help="Con --revision, cambia una de cada N fichas.")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server, estadisticas = iniciar_servidor(args)
+    print(f"Servidor de pruebas en http://{args.host}:{args.port}/opac/search/lst?q=letteratura")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(estadisticas.resumen())
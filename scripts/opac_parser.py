@@ -0,0 +1,175 @@
+import re
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+# Extracción de datos de las páginas del OPAC (resultados y fichas de detalle), con tres
+# implementaciones que devuelven exactamente los mismos registros:
+#   - "bs4": el árbol completo de BeautifulSoup con html.parser (la original del scraper);
+#   - "strainer": BeautifulSoup solo sobre los elementos que interesan (SoupStrainer), sin
+#     construir el resto de la página;
+#   - "lxml": el parser en C de lxml con expresiones XPath precompiladas. Es la más rápida y la
+#     que usa el scraper si lxml está instalado.
+# bench_parser.py compara las tres sobre páginas guardadas y comprueba que coinciden.
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+SINOPSIS_NO_DISPONIBLE = "Sinopsis no disponible."
+PARSERS = ("lxml", "strainer", "bs4")
+DEFAULT_PARSER = "lxml" if lxml is not None else "strainer"
+
+
+# --- BeautifulSoup (árbol completo o filtrado con SoupStrainer) ---
+
+def _records_from_soup(soup, base_url):
+    libros = []
+    for record in soup.select('div.record'):
+        try:
+            title_tag = record.find('h4', class_='record-title')
+            if not title_tag or not title_tag.a: continue
+
+            titolo = title_tag.a.text.strip()
+            detail_link = urljoin(base_url, title_tag.a['href'])
+
+            author_tag = record.find('div', class_='record-authors')
+            autore = author_tag.a.text.strip() if author_tag and author_tag.a else "N/A"
+
+            publication_tag = record.find('div', class_='record-publication')
+            year_match = re.search(r'\b(\d{4})\b', publication_tag.text) if publication_tag else None
+            anno = year_match.group(1) if year_match else "N/A"
+
+            collocazione_tag = record.find('div', class_='record-shelfmark')
+            collocazione = collocazione_tag.text.strip().replace('Collocazione:', '').strip() if collocazione_tag else "N/A"
+
+            libros.append({
+                'titolo': titolo, 'autore': autore, 'anno': anno,
+                'collocazione': collocazione, 'detail_link': detail_link,
+            })
+        except Exception as e:
+            print(f"    ERROR al procesar una fila: {e}")
+            continue
+    return libros
+
+
+def _synopsis_from_soup(soup):
+    synopsis_div = soup.find('div', class_='abstract-text')
+    return synopsis_div.text.strip() if synopsis_div else SINOPSIS_NO_DISPONIBLE
+
+
+def _next_link_from_soup(soup, base_url):
+    next_tag = soup.select_one('a.freccia-dx')
+    if next_tag is None or not next_tag.get('href') or next_tag['href'].startswith('javascript'):
+        return None
+    return urljoin(base_url, next_tag['href'])
+
+
+_RECORDS_STRAINER = SoupStrainer('div', class_='record')
+_SYNOPSIS_STRAINER = SoupStrainer('div', class_='abstract-text')
+_NEXT_STRAINER = SoupStrainer('a', class_='freccia-dx')
+
+
+# --- lxml con XPath precompilado ---
+
+def _has_class(name):
+    # Igual que class_= de BeautifulSoup: una de las clases del atributo, separadas por espacios.
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+if lxml is not None:
+    _XP_RECORDS = etree.XPath(f"//div[{_has_class('record')}]")
+    _XP_TITLE = etree.XPath(f"(.//h4[{_has_class('record-title')}])[1]")
+    _XP_AUTHORS = etree.XPath(f"(.//div[{_has_class('record-authors')}])[1]")
+    _XP_PUBLICATION = etree.XPath(f"(.//div[{_has_class('record-publication')}])[1]")
+    _XP_SHELFMARK = etree.XPath(f"(.//div[{_has_class('record-shelfmark')}])[1]")
+    _XP_SYNOPSIS = etree.XPath(f"(//div[{_has_class('abstract-text')}])[1]")
+    _XP_NEXT = etree.XPath(f"(//a[{_has_class('freccia-dx')}])[1]")
+    _XP_FIRST_LINK = etree.XPath("(.//a)[1]")
+    # .text de BeautifulSoup no incluye el contenido de <script> ni <style>; text_content() de lxml sí.
+    _XP_TEXT = etree.XPath(".//text()[not(ancestor::script) and not(ancestor::style)]")
+
+
+# Como en BeautifulSoup, una etiqueta vacía (sin texto ni hijos) cuenta como "no encontrada".
+def _first(xpath, element):
+    if element is None:
+        return None
+    found = xpath(element)
+    if not found or (len(found[0]) == 0 and not found[0].text):
+        return None
+    return found[0]
+
+
+def _text(element):
+    return "".join(_XP_TEXT(element))
+
+
+def _document(html):
+    # lxml no acepta texto con declaración de codificación XML; en ese caso le damos los bytes.
+    try:
+        return lxml.html.document_fromstring(html)
+    except ValueError:
+        return lxml.html.document_fromstring(html.encode('utf-8'))
+
+
+def _records_from_lxml(html, base_url):
+    libros = []
+    for record in _XP_RECORDS(_document(html)):
+        try:
+            title_link = _first(_XP_FIRST_LINK, _first(_XP_TITLE, record))
+            if title_link is None: continue
+
+            titolo = _text(title_link).strip()
+            detail_link = urljoin(base_url, title_link.attrib['href'])
+
+            author_link = _first(_XP_FIRST_LINK, _first(_XP_AUTHORS, record))
+            autore = _text(author_link).strip() if author_link is not None else "N/A"
+
+            publication_tag = _first(_XP_PUBLICATION, record)
+            year_match = re.search(r'\b(\d{4})\b', _text(publication_tag)) if publication_tag is not None else None
+            anno = year_match.group(1) if year_match else "N/A"
+
+            collocazione_tag = _first(_XP_SHELFMARK, record)
+            collocazione = _text(collocazione_tag).strip().replace('Collocazione:', '').strip() if collocazione_tag is not None else "N/A"
+
+            libros.append({
+                'titolo': titolo, 'autore': autore, 'anno': anno,
+                'collocazione': collocazione, 'detail_link': detail_link,
+            })
+        except Exception as e:
+            print(f"    ERROR al procesar una fila: {e}")
+            continue
+    return libros
+
+
+# --- Interfaz común ---
+
+def parse_results_page(html, base_url, parser=DEFAULT_PARSER):
+    """Los libros de una página de resultados, sin la sinopsis (está en la ficha de detalle)."""
+    if parser == "lxml":
+        return _records_from_lxml(html, base_url)
+    strainer = _RECORDS_STRAINER if parser == "strainer" else None
+    return _records_from_soup(BeautifulSoup(html, 'html.parser', parse_only=strainer), base_url)
+
+
+def parse_synopsis(html, parser=DEFAULT_PARSER):
+    if parser == "lxml":
+        synopsis_div = _first(_XP_SYNOPSIS, _document(html))
+        return _text(synopsis_div).strip() if synopsis_div is not None else SINOPSIS_NO_DISPONIBLE
+    strainer = _SYNOPSIS_STRAINER if parser == "strainer" else None
+    return _synopsis_from_soup(BeautifulSoup(html, 'html.parser', parse_only=strainer))
+
+
+def parse_next_link(html, base_url, parser=DEFAULT_PARSER):
+    """El enlace a la página siguiente, si lo hay."""
+    if parser == "lxml":
+        # Aquí no vale _first: la flecha suele ser un <a> vacío y el original solo mira si existe.
+        found = _XP_NEXT(_document(html))
+        href = found[0].get('href') if found else None
+        if not href or href.startswith('javascript'):
+            return None
+        return urljoin(base_url, href)
+    strainer = _NEXT_STRAINER if parser == "strainer" else None
+    return _next_link_from_soup(BeautifulSoup(html, 'html.parser', parse_only=strainer), base_url)
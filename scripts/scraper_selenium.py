@@ -1,16 +1,18 @@
 import requests
-from bs4 import BeautifulSoup
-import re
 import csv
 import time
-from urllib.parse import urljoin
+import threading
+import argparse
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-# Importaciones para Selenium
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from opac_parser import (DEFAULT_PARSER, PARSERS, SINOPSIS_NO_DISPONIBLE, parse_next_link, parse_results_page,
+                         parse_synopsis)
 
 # --- CONFIGURACIÓN ---
 MAIN_PAGE_URL = "https://retebibliotecaria.provincia.va.it/opac/search/lst?q=letteratura&home-lib=54&facets-materiale=1&facets-target=m"
@@ -18,9 +20,225 @@ HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
 }
 
-def scrape_finalisimo():
-    libros_extraidos = []
-    book_id_counter = 1
+# Descarga de las fichas de detalle: cuántas a la vez, cuántas peticiones por segundo como máximo
+# al mismo servidor (para no sobrecargar el OPAC) y reintentos con espera exponencial.
+DETAIL_WORKERS = 8
+REQUESTS_PER_SECOND = 4.0
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+
+
+class RateLimiter:
+    """Reparte las peticiones a cada servidor a un ritmo fijo, compartido por todos los hilos."""
+
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def crear_sesion(pool_size):
+    """Sesión con conexiones keep-alive reutilizables y reintentos con espera exponencial
+    (también ante 429/5xx, respetando Retry-After)."""
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    retry = Retry(total=RETRIES, backoff_factor=BACKOFF_FACTOR, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=("GET",), respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class HttpCache:
+    """Caché en disco (SQLite) de las fichas de detalle, con su ETag y Last-Modified. En la
+    siguiente pasada se piden con If-None-Match / If-Modified-Since: si la ficha no ha cambiado el
+    OPAC responde 304 sin cuerpo y usamos la copia guardada. Una conexión por operación, así los
+    hilos del pool no comparten conexiones."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            body TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as db:
+            db.execute(self.SCHEMA)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10.0)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def get(self, url):
+        db = self._connect()
+        try:
+            row = db.execute("SELECT etag, last_modified, body, fetched_at FROM responses WHERE url = ?",
+                             (url,)).fetchone()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        return {"etag": row[0], "last_modified": row[1], "body": row[2], "fetched_at": row[3]}
+
+    def put(self, url, response):
+        db = self._connect()
+        try:
+            with db:
+                db.execute("INSERT OR REPLACE INTO responses (url, etag, last_modified, body, fetched_at) "
+                           "VALUES (?, ?, ?, ?, ?)",
+                           (url, response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                            response.text, time.time()))
+        finally:
+            db.close()
+
+    def touch(self, url):
+        db = self._connect()
+        try:
+            with db:
+                db.execute("UPDATE responses SET fetched_at = ? WHERE url = ?", (time.time(), url))
+        finally:
+            db.close()
+
+
+class DetailFetcher:
+    """Descarga las fichas de detalle en un pool de hilos acotado mientras el navegador sigue con
+    las páginas de resultados. Cada hilo tiene su propia sesión (requests.Session no es segura
+    entre hilos) y todas pasan por el mismo RateLimiter. Con `cache`, las fichas guardadas hace
+    menos de `max_age` segundos no se vuelven a pedir y las demás se piden de forma condicional."""
+
+    def __init__(self, workers=DETAIL_WORKERS, requests_per_second=REQUESTS_PER_SECOND, cache=None, max_age=0,
+                 parser=DEFAULT_PARSER):
+        self.workers = workers
+        self.parser = parser
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="detalle")
+        self.cache = cache
+        self.max_age = max_age
+        self.stats = {"descargadas": 0, "sin_cambios": 0, "de_cache": 0, "errores": 0}
+        self._local = threading.local()
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = crear_sesion(pool_size=2)
+            with self._sessions_lock:
+                self._sessions.append(session)
+        return session
+
+    def _count(self, stat):
+        with self._sessions_lock:
+            self.stats[stat] += 1
+
+    def _fetch(self, url, titolo):
+        cached = self.cache.get(url) if self.cache is not None else None
+        if cached is not None and time.time() - cached["fetched_at"] < self.max_age:
+            self._count("de_cache")
+            return parse_synopsis(cached["body"], self.parser)
+
+        headers = {}
+        if cached is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        self.rate_limiter.wait(url)
+        try:
+            response = self._session().get(url, headers=headers, timeout=10)
+            if response.status_code == 304 and cached is not None:
+                self._count("sin_cambios")
+                self.cache.touch(url)
+                return parse_synopsis(cached["body"], self.parser)
+            if response.ok:
+                self._count("descargadas")
+                if self.cache is not None:
+                    self.cache.put(url, response)
+                return parse_synopsis(response.text, self.parser)
+            print(f"    HTTP {response.status_code} al obtener sinopsis para {titolo}")
+        except requests.RequestException:
+            print(f"    Error de red al obtener sinopsis para {titolo}")
+        self._count("errores")
+        # Si la red falla pero tenemos una copia (aunque sea antigua), mejor esa que nada.
+        return parse_synopsis(cached["body"], self.parser) if cached is not None else SINOPSIS_NO_DISPONIBLE
+
+    def submit(self, url, titolo):
+        return self.executor.submit(self._fetch, url, titolo)
+
+    def close(self, cancelar=False):
+        self.executor.shutdown(wait=True, cancel_futures=cancelar)
+        for session in self._sessions:
+            session.close()
+
+
+class Checkpoint:
+    """Progreso de una extracción, guardado en JSON junto al CSV después de cada página escrita:
+    páginas terminadas, la URL de la siguiente, el próximo id, las fichas ya escritas y el tamaño
+    del CSV en ese momento. Al reanudar, el CSV se recorta a ese tamaño (por si el corte llegó a
+    medio escribir una página) y se sigue desde ahí."""
+
+    def __init__(self, path):
+        self.path = path
+        self.pages_done = 0
+        self.next_page_url = None
+        self.next_id = 1
+        self.seen = set()
+        self.csv_bytes = 0
+        self.finished = False
+
+    @classmethod
+    def load(cls, path):
+        checkpoint = cls(path)
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+        checkpoint.pages_done = data["pages_done"]
+        checkpoint.next_page_url = data["next_page_url"]
+        checkpoint.next_id = data["next_id"]
+        checkpoint.seen = set(data["seen"])
+        checkpoint.csv_bytes = data["csv_bytes"]
+        checkpoint.finished = data.get("finished", False)
+        return checkpoint
+
+    def save(self):
+        data = {
+            "pages_done": self.pages_done, "next_page_url": self.next_page_url, "next_id": self.next_id,
+            "csv_bytes": self.csv_bytes, "finished": self.finished, "seen": sorted(self.seen),
+        }
+        # Escribimos a un fichero temporal y lo renombramos: un corte nunca deja un JSON a medias.
+        temporal = self.path + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(temporal, self.path)
+
+
+def paginas_con_navegador(start_url):
+    """Recorre las páginas de resultados con Chromium (el OPAC las carga con JavaScript) y
+    devuelve el HTML de cada una en cuanto sus resultados están en el DOM."""
+    # Importaciones para Selenium
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
 
     print("Iniciando el navegador Chromium...")
     options = webdriver.ChromeOptions()
@@ -29,32 +247,26 @@ def scrape_finalisimo():
     options.add_argument("--headless") # Recomiendo dejarlo activado. Si quieres ver la ventana, ponle un '#' delante.
     options.add_argument("--disable-gpu")
     options.add_argument("--window-size=1920x1080")
-    
+
     service = Service()
     driver = webdriver.Chrome(service=service, options=options)
-    
-    session = requests.Session()
-    session.headers.update(HEADERS)
 
     try:
-        print(f"Navegando a: {MAIN_PAGE_URL}")
-        driver.get(MAIN_PAGE_URL)
+        print(f"Navegando a: {start_url}")
+        driver.get(start_url)
 
         try:
             print("Buscando banner de cookies...")
             accept_button = WebDriverWait(driver, 5).until(EC.element_to_be_clickable((By.ID, "c-p-bn")))
             accept_button.click()
+            # En lugar de dormir un segundo fijo, esperamos a que el banner desaparezca.
+            WebDriverWait(driver, 5).until(EC.invisibility_of_element_located((By.ID, "c-p-bn")))
             print("Banner de cookies aceptado.")
-            time.sleep(1)
         except Exception:
             print("Banner de cookies no encontrado o ya aceptado.")
-        
-        page_num = 1
+
         while True:
-            print(f"\n--- Procesando Página {page_num} ---")
-            
             try:
-                # ### CAMBIO CRÍTICO Y FINAL: Esperar a los resultados mismos ###
                 # Esperamos a que al menos un elemento con la clase 'record' esté presente en el DOM.
                 # Esta es la prueba definitiva de que el JavaScript ha cargado los datos.
                 print("Esperando a que los resultados de los libros se carguen en la página...")
@@ -66,81 +278,169 @@ def scrape_finalisimo():
                 print("La espera ha fallado después de 30 segundos. No se encontraron resultados. Terminando.")
                 break
 
-            html_completo = driver.page_source
-            soup = BeautifulSoup(html_completo, 'html.parser')
-            
-            book_records = soup.select('div.record')
-            if not book_records:
-                print("Contenedor de resultados vacío. Terminando.")
-                break
-
-            for record in book_records:
-                try:
-                    title_tag = record.find('h4', class_='record-title')
-                    if not title_tag or not title_tag.a: continue
-
-                    titolo = title_tag.a.text.strip()
-                    detail_link = urljoin(MAIN_PAGE_URL, title_tag.a['href'])
-                    
-                    print(f"  - {titolo[:60]}...")
-                    
-                    author_tag = record.find('div', class_='record-authors')
-                    autore = author_tag.a.text.strip() if author_tag and author_tag.a else "N/A"
-                    
-                    publication_tag = record.find('div', class_='record-publication')
-                    year_match = re.search(r'\b(\d{4})\b', publication_tag.text) if publication_tag else None
-                    anno = year_match.group(1) if year_match else "N/A"
-                    
-                    collocazione_tag = record.find('div', class_='record-shelfmark')
-                    collocazione = collocazione_tag.text.strip().replace('Collocazione:', '').strip() if collocazione_tag else "N/A"
-                    
-                    synopsis = "Sinopsis no disponible."
-                    try:
-                        detail_response = session.get(detail_link, timeout=10)
-                        if detail_response.ok:
-                            detail_soup = BeautifulSoup(detail_response.text, 'html.parser')
-                            synopsis_div = detail_soup.find('div', class_='abstract-text')
-                            if synopsis_div:
-                                synopsis = synopsis_div.text.strip()
-                    except requests.RequestException:
-                        print(f"    Error de red al obtener sinopsis para {titolo}")
-
-                    libros_extraidos.append({
-                        'id': book_id_counter, 'titolo': titolo, 'autore': autore, 'anno': anno,
-                        'synopsis': synopsis, 'collocazione': collocazione,
-                    })
-                    book_id_counter += 1
-                except Exception as e:
-                    print(f"    ERROR al procesar una fila: {e}")
-                    continue
+            yield driver.current_url, driver.page_source
 
             try:
                 # Usamos find_elements para comprobar si el botón existe sin causar un error
                 next_buttons = driver.find_elements(By.CSS_SELECTOR, "a.freccia-dx")
-                if next_buttons:
-                    print("Pasando a la siguiente página...")
-                    driver.execute_script("arguments[0].click();", next_buttons[0])
-                    page_num += 1
-                    time.sleep(3) 
-                else:
+                if not next_buttons:
                     print("No se encontró el botón 'Siguiente'. Scraping finalizado.")
                     break
+                print("Pasando a la siguiente página...")
+                # En lugar de dormir 3 segundos fijos, esperamos a que la página actual se descarte
+                # (sus resultados quedan obsoletos); la espera de 'div.record' de arriba hace el resto.
+                first_record = driver.find_element(By.CSS_SELECTOR, "div.record")
+                driver.execute_script("arguments[0].click();", next_buttons[0])
+                WebDriverWait(driver, 30).until(EC.staleness_of(first_record))
             except Exception:
                 print("No se pudo hacer clic en 'Siguiente'. Scraping finalizado.")
                 break
     finally:
         print("\nCerrando el navegador...")
         driver.quit()
-        
-        if libros_extraidos:
-            nombre_archivo = 'catalogo_finalisimo.csv'
-            print(f"Guardando {len(libros_extraidos)} libros en '{nombre_archivo}'...")
-            with open(nombre_archivo, mode='w', newline='', encoding='utf-8-sig') as file_csv:
-                writer = csv.writer(file_csv, delimiter='|', quoting=csv.QUOTE_ALL)
-                writer.writerow(['id', 'titolo', 'autore', 'anno', 'synopsis', 'collocazione'])
-                for libro in libros_extraidos:
-                    writer.writerow(list(libro.values()))
-            print("¡ÉXITO TOTAL!")
+
+
+def paginas_sin_navegador(start_url, session, parser=DEFAULT_PARSER):
+    """Igual que paginas_con_navegador, pero con peticiones HTTP normales siguiendo el enlace
+    'Siguiente'. Sirve para páginas que no necesitan JavaScript, como las del servidor de
+    pruebas (fixture_server.py)."""
+    url = start_url
+    while url:
+        print(f"Descargando: {url}")
+        response = session.get(url, timeout=30)
+        response.raise_for_status()
+        yield url, response.text
+        url = parse_next_link(response.text, url, parser)
+        if url is None:
+            print("No se encontró el enlace 'Siguiente'. Scraping finalizado.")
+
+
+CSV_COLUMNS = ['id', 'titolo', 'autore', 'anno', 'synopsis', 'collocazione']
+
+
+def abrir_csv(nombre_archivo, checkpoint):
+    """Abre el CSV para ir añadiendo filas. Al reanudar, lo recorta al tamaño del último
+    checkpoint; si no, empieza uno nuevo con la cabecera."""
+    if checkpoint.csv_bytes and os.path.exists(nombre_archivo):
+        os.truncate(nombre_archivo, checkpoint.csv_bytes)
+        file_csv = open(nombre_archivo, mode='a', newline='', encoding='utf-8')
+    else:
+        file_csv = open(nombre_archivo, mode='w', newline='', encoding='utf-8-sig')
+        csv.writer(file_csv, delimiter='|', quoting=csv.QUOTE_ALL).writerow(CSV_COLUMNS)
+    return file_csv
+
+
+def scrape_finalisimo(start_url=MAIN_PAGE_URL, usar_navegador=True, workers=DETAIL_WORKERS,
+                      requests_per_second=REQUESTS_PER_SECOND, nombre_archivo='catalogo_finalisimo.csv',
+                      reanudar=False, cache_path='http_cache.sqlite3', max_age=0, parser=DEFAULT_PARSER):
+    """Extrae el catálogo escribiendo el CSV página a página, en lugar de guardarlo todo en memoria
+    hasta el final. Tras cada página escrita se guarda un checkpoint; con `reanudar=True` una
+    extracción cortada sigue donde se quedó. Con `cache_path`, una nueva pasada completa solo
+    descarga las fichas que han cambiado."""
+    inicio = time.perf_counter()
+    checkpoint_path = nombre_archivo + '.checkpoint.json'
+    if reanudar and os.path.exists(checkpoint_path):
+        checkpoint = Checkpoint.load(checkpoint_path)
+        if checkpoint.finished:
+            print(f"La extracción de '{nombre_archivo}' ya había terminado. Nada que reanudar.")
+            return 0
+        print(f"Reanudando después de {checkpoint.pages_done} páginas y {len(checkpoint.seen)} libros.")
+    else:
+        checkpoint = Checkpoint(checkpoint_path)
+
+    fetcher = DetailFetcher(workers=workers, requests_per_second=requests_per_second,
+                            cache=HttpCache(cache_path) if cache_path else None, max_age=max_age,
+                            parser=parser)
+    session = crear_sesion(pool_size=2)
+    if usar_navegador:
+        paginas = paginas_con_navegador(start_url)
+    else:
+        paginas = paginas_sin_navegador(checkpoint.next_page_url or start_url, session, parser)
+    page_num = 0 if usar_navegador else checkpoint.pages_done
+    file_csv = abrir_csv(nombre_archivo, checkpoint)
+    writer = csv.writer(file_csv, delimiter='|', quoting=csv.QUOTE_ALL)
+    escritos = 0
+
+    # Las filas de una página se escriben cuando la página siguiente ya ha encargado sus fichas:
+    # así el pool nunca se queda sin trabajo y en memoria solo hay un par de páginas.
+    def escribir_pagina(pendientes, next_page_url):
+        nonlocal escritos
+        for libro, future in pendientes:
+            writer.writerow([checkpoint.next_id, libro['titolo'], libro['autore'], libro['anno'],
+                             future.result(), libro['collocazione']])
+            checkpoint.next_id += 1
+            checkpoint.seen.add(libro['detail_link'])
+            escritos += 1
+        file_csv.flush()
+        os.fsync(file_csv.fileno())
+        checkpoint.pages_done += 1
+        checkpoint.next_page_url = next_page_url
+        checkpoint.csv_bytes = file_csv.tell()
+        checkpoint.save()
+
+    pagina_anterior = None
+    try:
+        for page_url, html_completo in paginas:
+            page_num += 1
+            # Con el navegador no se puede saltar a la página N: las ya terminadas se recorren sin procesarlas.
+            if usar_navegador and page_num <= checkpoint.pages_done:
+                print(f"Página {page_num} ya extraída, pasando a la siguiente.")
+                continue
+            print(f"\n--- Procesando Página {page_num} ---")
+            libros_pagina = parse_results_page(html_completo, page_url, parser)
+            if not libros_pagina:
+                print("Contenedor de resultados vacío. Terminando.")
+                break
+
+            # Las fichas de detalle se piden ya, en segundo plano, mientras pasamos a la página siguiente.
+            pendientes = []
+            for libro in libros_pagina:
+                if libro['detail_link'] in checkpoint.seen:
+                    continue
+                print(f"  - {libro['titolo'][:60]}...")
+                pendientes.append((libro, fetcher.submit(libro['detail_link'], libro['titolo'])))
+
+            if pagina_anterior is not None:
+                escribir_pagina(*pagina_anterior)
+            next_page_url = None if usar_navegador else parse_next_link(html_completo, page_url, parser)
+            pagina_anterior = (pendientes, next_page_url)
+
+        if pagina_anterior is not None:
+            escribir_pagina(*pagina_anterior)
+            pagina_anterior = None
+        checkpoint.finished = True
+        checkpoint.save()
+    finally:
+        # Si la extracción se corta, las fichas aún en cola se descartan: el checkpoint no las cuenta.
+        fetcher.close(cancelar=not checkpoint.finished)
+        session.close()
+        file_csv.close()
+
+    print(f"{escritos} libros nuevos en '{nombre_archivo}' ({checkpoint.next_id - 1} en total).")
+    print(f"Fichas: {fetcher.stats['descargadas']} descargadas, {fetcher.stats['sin_cambios']} sin cambios (304), "
+          f"{fetcher.stats['de_cache']} de la caché sin pedirlas, {fetcher.stats['errores']} con error.")
+    print(f"¡ÉXITO TOTAL! ({time.perf_counter() - inicio:.1f}s)")
+    return escritos
 
 if __name__ == "__main__":
-    scrape_finalisimo()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Extrae el catálogo del OPAC a un CSV.")
+    parser.add_argument("--start-url", default=MAIN_PAGE_URL)
+    parser.add_argument("--sin-navegador", action="store_true",
+                        help="Recorre las páginas con HTTP normal (p. ej. contra fixture_server.py).")
+    parser.add_argument("--workers", type=int, default=DETAIL_WORKERS)
+    parser.add_argument("--rps", type=float, default=REQUESTS_PER_SECOND,
+                        help="Peticiones por segundo como máximo al mismo servidor (0 = sin límite).")
+    parser.add_argument("--output", default='catalogo_finalisimo.csv')
+    parser.add_argument("--reanudar", action="store_true",
+                        help="Sigue una extracción cortada desde su checkpoint (<output>.checkpoint.json).")
+    parser.add_argument("--cache", default='http_cache.sqlite3',
+                        help="Caché HTTP de las fichas de detalle ('' para desactivarla).")
+    parser.add_argument("--max-age", type=float, default=0,
+                        help="Segundos durante los que una ficha en caché se usa sin preguntar al servidor.")
+    parser.add_argument("--parser", choices=PARSERS, default=DEFAULT_PARSER,
+                        help="Cómo se leen las páginas (ver opac_parser.py y bench_parser.py).")
+    args = parser.parse_args()
+
+    scrape_finalisimo(args.start_url, usar_navegador=not args.sin_navegador, workers=args.workers,
+                      requests_per_second=args.rps, nombre_archivo=args.output, reanudar=args.reanudar,
+                      cache_path=args.cache or None, max_age=args.max_age, parser=args.parser)
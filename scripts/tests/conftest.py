@@ -0,0 +1,6 @@
+# Español: Los scripts se importan como hermanos (igual que hace bench_parser.py), así que la
+# carpeta scripts/ va al principio del path. Ejecutar desde scripts/: python -m pytest -q tests
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,42 @@
+# Español: Los tres parsers (lxml, bs4 con SoupStrainer y bs4 completo) deben extraer exactamente
+# lo mismo de las páginas del servidor de fixtures y de la página real guardada en debug_page.html.
+import os
+
+import pytest
+
+from fixture_server import pagina_detalle, pagina_resultados
+from opac_parser import PARSERS, lxml, parse_next_link, parse_results_page, parse_synopsis
+
+BASE_URL = "https://retebibliotecaria.provincia.va.it/opac/search/lst?q=letteratura"
+DEBUG_PAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "debug_page.html")
+
+PARSERS_DISPONIBLES = [p for p in PARSERS if p != "lxml" or lxml is not None]
+
+
+def paginas_resultados():
+    paginas = [pagina_resultados(start, 45, 20) for start in (0, 20, 40)]
+    if os.path.exists(DEBUG_PAGE):
+        with open(DEBUG_PAGE, encoding="utf-8") as f:
+            paginas.append(f.read())
+    return paginas
+
+
+@pytest.mark.parametrize("parser", PARSERS_DISPONIBLES)
+def test_resultados_iguales_a_bs4(parser):
+    for html in paginas_resultados():
+        assert parse_results_page(html, BASE_URL, parser) == parse_results_page(html, BASE_URL, "bs4")
+        assert parse_next_link(html, BASE_URL, parser) == parse_next_link(html, BASE_URL, "bs4")
+
+
+@pytest.mark.parametrize("parser", PARSERS_DISPONIBLES)
+def test_sinopsis_igual_a_bs4(parser):
+    for book_id in range(1, 30):
+        html = pagina_detalle(book_id)
+        assert parse_synopsis(html, parser) == parse_synopsis(html, "bs4")
+
+
+def test_fixture_no_vacia():
+    registros = parse_results_page(pagina_resultados(0, 45, 20), BASE_URL, "bs4")
+    assert len(registros) == 20
+    assert parse_next_link(pagina_resultados(40, 45, 20), BASE_URL, "bs4") is None
+    assert parse_synopsis(pagina_detalle(1), "bs4")